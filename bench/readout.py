@@ -0,0 +1,123 @@
+# Readout throughput benchmark: UFSDPyDAQ.poll -> TreeFile on the simulated
+# DT5742 (modules/sim/caen.py), no hardware needed.
+#
+# python bench/readout.py [--events N] [--rate HZ] [--writer null tree]
+#                         [--json results.json] [--baseline results.json]
+#
+# With --baseline the run fails (exit code 1) if events/s dropped or CPU per
+# event grew by more than --tolerance with respect to a previous --json.
+
+import argparse, json, os, resource, sys, tempfile, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Events read before measuring, fills the pulse bank and warms up caches
+WARMUP_EVENTS = 500
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description = "Readout benchmark")
+    parser.add_argument("--events", type = int, default = 10000)
+    parser.add_argument("--rate", type = float, default = 0,
+        help = "Simulated trigger rate in Hz, 0 keeps the board memory full")
+    parser.add_argument("--length", type = int, default = 1024,
+        help = "Samples per event (EVENT_LENGTH)")
+    parser.add_argument("--writer", nargs = "+", default = ["null", "tree"],
+        choices = ["null", "tree"])
+    parser.add_argument("--json", help = "Write results to this file")
+    parser.add_argument("--baseline", help = "Compare with a previous --json")
+    parser.add_argument("--tolerance", type = float, default = 0.2)
+    return parser.parse_args()
+
+# The simulated backend is picked when the modules are first imported
+def loadDaq(args):
+    os.environ["UFSDPYDAQ_SIMULATE"] = "1"
+    os.environ["UFSDPYDAQ_SIM_RATE"] = str(args.rate)
+    sys.path.insert(0, ROOT_DIR)
+
+    import main
+    config = main.io.config.Config()
+    config.hv["MANUAL"] = True
+    config.stage["MANUAL"] = True
+    config.dgt["EVENT_LENGTH"] = args.length
+    return main, main.UFSDPyDAQ(config)
+
+def makeWriter(main, kind, directory):
+    if kind == "null":
+        return main.sim.tree.NullTreeFile()
+    return main.io.tree.TreeFile(directory, "bench")
+
+# Take _events_ events through poll, the way acquirePoint does
+def run(daq, events):
+    taken = 0
+    daq.accounting.start()
+    daq.dgt.startAcquisition()
+    while taken < events:
+        taken += daq.poll(taken, events)
+    daq.dgt.stopAcquisition()
+    daq.file.write()
+    return taken
+
+def measure(main, daq, kind, events, directory):
+    daq.file = makeWriter(main, kind, directory)
+    run(daq, WARMUP_EVENTS)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall, cpu = time.perf_counter(), time.process_time()
+    taken = run(daq, events)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    daq.file.close()
+    size = main.sim.caen.eventBytes(daq.config.eventSize, 2)
+    return {"events": taken, "seconds": wall,
+        "events_per_s": taken / wall,
+        "cpu_us_per_event": cpu / taken * 1E6,
+        "link_mb_per_s": taken * size / wall / 1E6,
+        "peak_rss_mb": peak / 1024, "rss_growth_mb": (peak - rss) / 1024}
+
+# Compare with _baseline_, returns the list of regressions
+def compare(results, baseline, tolerance):
+    failures = []
+    for kind, result in results.items():
+        if kind not in baseline:
+            continue
+        reference = baseline[kind]
+        if result["events_per_s"] < reference["events_per_s"] * (1 - tolerance):
+            failures.append("{}: {:.0f} events/s, was {:.0f}".format(kind,
+                result["events_per_s"], reference["events_per_s"]))
+        if result["cpu_us_per_event"] > \
+            reference["cpu_us_per_event"] * (1 + tolerance):
+            failures.append("{}: {:.1f} us CPU/event, was {:.1f}".format(kind,
+                result["cpu_us_per_event"], reference["cpu_us_per_event"]))
+    return failures
+
+def report(results):
+    print("\n{:<8}{:>12}{:>16}{:>12}{:>14}".format("Writer", "events/s",
+        "CPU us/event", "link MB/s", "peak RSS MB"))
+    for kind, result in results.items():
+        print("{:<8}{:>12.0f}{:>16.1f}{:>12.1f}{:>14.1f}".format(kind,
+            result["events_per_s"], result["cpu_us_per_event"],
+            result["link_mb_per_s"], result["peak_rss_mb"]))
+
+if __name__ == "__main__":
+    args = parseArgs()
+    main, daq = loadDaq(args)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in args.writer:
+            results[kind] = measure(main, daq, kind, args.events, directory)
+    daq.dgt.close()
+
+    report(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            failures = compare(results, json.load(file), args.tolerance)
+        for failure in failures:
+            print("REGRESSION " + failure)
+        if failures:
+            exit(1)
@@ -0,0 +1,126 @@
+# Convert runs taken with CAEN WaveDump into the ROOT files main.py writes
+# (wfm and points trees, see modules/io/tree.py), so that the same analysis
+# runs on both.
+#
+# python importwavedump.py WaveDumpConfig.txt RUN [RUN ...] [--jobs N]
+#                          [--events-per-file N] [--output DIR]
+#                          [--bias V] [--position X Y] [--compression N]
+#
+# Every RUN is a directory with the wave_N and TR_a_b files of one run,
+# written with the settings of the given WaveDumpConfig. Runs are converted
+# in parallel with --jobs. Binary runs are also cut in parts of
+# --events-per-file events, converted in parallel to RUN_000.root,
+# RUN_001.root... ASCII runs can only be streamed and go to a single file.
+# Bias and position are not in WaveDump files, they are written as given.
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse, os, time
+
+from modules import accounting
+from modules.io import tree, wavedump
+from main import formatted, FORMAT_ERROR, FORMAT_OK
+
+# Events _start_ to _stop_ of the run in _directory_ to _output_/_name_.root.
+# Returns the file written, its events and the time taken.
+def convert(configPath, directory, output, name, start, stop, bias, position,
+    compression):
+    began = time.time()
+    run = wavedump.Run(directory, configPath)
+    # Only channels with a file get a branch
+    used = sorted(group * 8 + channel for group, channel in run.files
+        if channel < 8)
+    layout = [(group, [c % 8 for c in used if c // 8 == group])
+        for group in sorted({c // 8 for c in used})]
+    file = tree.TreeFile(output, name, compression,
+        channels = max(tree.CHANNELS, run.channels), used = used)
+    file.setFrequency(run.frequency)
+    file.setEventLength(run.length)
+    file.setBias(bias)
+    file.setPosition(*position)
+
+    # Counters are unwrapped from the first event of every file
+    counters = accounting.Unwrapper(accounting.COUNTER_BITS)
+    timeTags = accounting.Unwrapper(accounting.TTT_BITS)
+    events = 0
+    for block in run.blocks(start, stop):
+        for i in range(len(block)):
+            file.setEventInfo(counters.unwrap(block.counters[i]),
+                timeTags.unwrap(block.timeTags[i]))
+            for group, channels in layout:
+                if not block.present[i, group]:
+                    continue
+                file.setStartCell(group, block.cells[i, group])
+                waves = block.waves[i, group].tolist()
+                for channel in channels:
+                    file.setChannel(group * 8 + channel, waves[channel],
+                        len(waves[channel]))
+                file.setTrigger(group, waves[8], len(waves[8]))
+            file.fill()
+        events += len(block)
+
+    file.fillPoint({"x": position[0], "y": position[1], "bias": bias,
+        "events": events, "triggers": events})
+    file.close()
+    run.close()
+    return file.path, events, time.time() - began
+
+# Conversions to do for every run in _runs_: arguments of convert()
+def jobs(configPath, runs, output, eventsPerFile, bias, position,
+    compression):
+    jobs = []
+    for directory in runs:
+        name = os.path.basename(os.path.normpath(directory))
+        destination = output if output is not None else \
+            os.path.dirname(os.path.abspath(directory))
+        run = wavedump.Run(directory, configPath)
+        if run.binary and eventsPerFile > 0 and len(run) > eventsPerFile:
+            for part, start in enumerate(range(0, len(run), eventsPerFile)):
+                jobs.append((configPath, directory, destination,
+                    "{}_{:03d}".format(name, part), start,
+                    start + eventsPerFile, bias, position, compression))
+        else:
+            jobs.append((configPath, directory, destination, name, 0, None,
+                bias, position, compression))
+        run.close()
+    return jobs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Convert WaveDump runs to ROOT files")
+    parser.add_argument("config", help = "WaveDumpConfig the runs were "
+        "taken with")
+    parser.add_argument("runs", nargs = "+", help = "Run directories")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(),
+        help = "Conversions run in parallel")
+    parser.add_argument("--events-per-file", type = int, default = 0,
+        help = "Cut binary runs in files of this many events")
+    parser.add_argument("--output", help = "Output directory, next to the "
+        "runs if not given")
+    parser.add_argument("--bias", type = float, default = 0)
+    parser.add_argument("--position", type = float, nargs = 2,
+        default = (0, 0), metavar = ("X", "Y"))
+    parser.add_argument("--compression", type = int, default = 0)
+    args = parser.parse_args()
+
+    try:
+        todo = jobs(args.config, args.runs, args.output,
+            args.events_per_file, args.bias, tuple(args.position),
+            args.compression)
+    except ValueError as e:
+        formatted(str(e), FORMAT_ERROR)
+        exit()
+
+    began = time.time()
+    if args.jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(min(args.jobs, len(todo))) as pool:
+            results = list(pool.map(convert, *zip(*todo)))
+    else:
+        results = [convert(*job) for job in todo]
+    elapsed = time.time() - began
+
+    total = 0
+    for path, events, seconds in results:
+        total += events
+        print("{}: {} events in {:.1f} s".format(path, events, seconds))
+    formatted("{} events in {:.1f} s, {:.0f} events/s".format(total, elapsed,
+        total / elapsed if elapsed > 0 else 0), FORMAT_OK)
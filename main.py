@@ -1,15 +1,25 @@
 from modules import *
-import sys, os, datetime, time
+import argparse, sys, os, datetime, time
 
 CONFIG_PATH = "config.ini"
 
 DIGITIZER_MODELS = ["DT5742"]
 HIGHVOLTAGE_MODELS = ["DT1471ET", "DT1470ET"]
+# Software triggers sent before each readout in pedestal runs, the board
+# holds 128 full length events
+PEDESTAL_BATCH = 64
 
 class UFSDPyDAQ:
 
-    def __init__(self, config):
+    def __init__(self, config, interactive = True):
         self.config = config
+        # Without an operator (daemon, batch runs) prompts are answered
+        # with an empty string, which means "go on", and instruments fail
+        # instead of asking
+        self.interactive = interactive
+        # Channels of each enabled group written to file, by group
+        self.layout = self.config.layout
+        self.channels = set(self.config.channels)
 
         # PyUSB acts weird if we try to connect the digitizer first...
         self.connectHighVoltage()
@@ -17,72 +27,166 @@ class UFSDPyDAQ:
         self.connectStage()
         self.programStage()
 
-        self.connectDigitizer()
-        self.programDigitizer()
-        status = self.dgt.status()
-        print("Digitizer status is {}, ".format(hex(status)), end = "")
-        if status == 0x180:
-            formatted(" good!", FORMAT_OK)
+        # Host side DRS4 correction, see setupCorrector
+        self.corrector = None
+        # Continuous motion of the current LINE scan, if any, and the bin
+        # its point in progress is
+        self.line = None
+        self.lineBin = None
+        # Shared memory ring readout blocks are published to, if enabled
+        self.ring = None
+        self.position = (0, 0)
+        # Live monitoring server, if enabled
+        self.monitor = None
+        # Raw blocks are saved here for replay, if enabled
+        self.dumper = None
+        # Per point summary maps and amplitude/time histograms, if enabled
+        self.maps = None
+        self.histograms = None
+        # Online observable of the current point in adaptive acquisition
+        self.estimator = None
+        self.setupDigitizer()
+
+        self.accounting = accounting.Accounting()
+        self.readoutTuner = tuning.ReadoutTuner(self.config.bltSize,
+            self.config.pollInterval)
+
+        if self.config.isTraceEnabled():
+            trace.enable()
+
+    # Switch to _config_ keeping the instruments open. Instruments whose
+    # identity changed (other board, power supply or axes) are reconnected,
+    # the others are only reprogrammed with what changed.
+    def reconfigure(self, config):
+        old, self.config = self.config, config
+        self.layout = self.config.layout
+        self.channels = set(self.config.channels)
+
+        if (old.isHvAuto(), old.hvID) != (config.isHvAuto(), config.hvID):
+            if old.isHvAuto():
+                self.hv.disableChannel(old.powerChannels)
+                self.hv.close()
+            self.connectHighVoltage()
+
+        if (old.isStageAuto(), old.stageAxes) != \
+            (config.isStageAuto(), config.stageAxes):
+            if old.isStageAuto():
+                self.stage.close()
+            self.connectStage()
+        self.programStage()
+
+        if old.digitizerIDs != config.digitizerIDs:
+            self.disconnectDigitizer()
+            self.setupDigitizer()
         else:
-            formatted("something's wrong. Exiting.", FORMAT_ERROR)
-            exit()
-        self.dgt.allocateEvent()
-        self.dgt.mallocBuffer()
+            self.programDigitizer()
+            # The readout buffer is sized for the record length and BLT
+            if (old.eventSize, old.bltSize) != (config.eventSize,
+                config.bltSize):
+                self.dgt.freeBuffer()
+                self.dgt.mallocBuffer()
+
+        if self.config.isTraceEnabled():
+            trace.enable()
 
     def prepare(self):
-        dir = self.config.outputPath
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        self.file = io.tree.TreeFile(dir, self.config.outputFile)
+        self.file = self.openFile()
+        # Summary of every point taken in this run
+        self.summaries = []
+        # Points and events already in files handed to the analysis
+        self.handedOff = (0, 0)
+        self.readoutTuner = tuning.ReadoutTuner(self.config.bltSize,
+            self.config.pollInterval)
+        self.dgt.setMaxNumEventsBLT(self.readoutTuner.blt)
 
         self.file.setFrequency(self.config.frequencyValue)
         self.file.setEventLength(self.config.eventSize)
+        if self.config.isSharedMemoryEnabled():
+            self.ring = ring.Writer(self.config.eventSize,
+                name = self.config.sharedMemoryName,
+                slots = self.config.sharedMemorySlots)
+        if self.config.isRawDumpEnabled():
+            info = self.dgt.getInfo()
+            self.dumper = replay.Dumper(replay.dumpDirectory(
+                self.config.outputPath, self.config.outputFile),
+                self.config.frequency, info.SerialNumber)
+        if self.config.isMapsEnabled():
+            self.maps = maps.Maps(max(io.tree.CHANNELS,
+                readout.CHANNELS_PER_BOARD * len(self.config.digitizerIDs)),
+                1E3 / self.config.frequencyValue, self.config.signalPolarity,
+                self.config.mapsThreshold)
+        if self.config.isHistogramsEnabled():
+            self.histograms = histograms.Histograms(max(io.tree.CHANNELS,
+                readout.CHANNELS_PER_BOARD * len(self.config.digitizerIDs)),
+                1E3 / self.config.frequencyValue, self.config.signalPolarity,
+                self.config.histogramThreshold,
+                histograms.pointDirectory(self.config.outputPath,
+                self.config.outputFile) if self.config.isHistogramPerPoint()
+                else None)
+        if self.config.isMonitorEnabled():
+            self.monitor = monitor.Monitor(self.config.monitorPort,
+                self.hvReadings)
+            formatted("Live monitor on http://localhost:{}".format(
+                self.monitor.port), FORMAT_NOTE)
 
         self.hv.enableChannel(self.config.powerChannels)
         self.hvSetBlocking(self.config.triggerChannel,
             self.config.triggerBias)
 
-        if input("Start acquisition? [y/n] ") == "n":
+        if self.prompt("Start acquisition? [y/n] ") == "n":
             return False
         else:
             return True
 
+    def openFile(self):
+        dir = self.config.outputPath
+        if not os.path.exists(dir):
+            os.mkdir(dir)
+        channels = max(io.tree.CHANNELS,
+            readout.CHANNELS_PER_BOARD * len(self.config.digitizerIDs))
+        return io.tree.TreeFile(dir, self.config.outputFile,
+            channels = channels, used = self.config.usedChannels)
+
+    # Every question to the operator goes through here
+    def prompt(self, question):
+        if not self.interactive:
+            return ""
+        return input(question)
+
     def acquire(self):
-        (xStart, xStep, xStop,
-            yStart, yStep, yStop) = self.config.getGrid(inclusive = True)
+        points = self.config.getScanPoints()
 
         for bias in self.config.sensorBiases:
             self.hvSetBlocking(self.config.sensorChannel, bias)
             self.file.setBias(bias)
+            if self.histograms is not None:
+                self.histograms.setBias(bias)
             formatted("\nNow acquiring with sensor bias at {} V".format(bias),
                 FORMAT_NOTE)
 
             if not self.askSkipQuit(self.config.isHvAuto()):
                 continue
 
-            mode = self.config.mode
-            # Single point
-            if mode == 0:
-                self.acquirePoint(xStart, yStart)
-            # Grid acquisition
-            elif mode == 1:
-                for x in range(xStart, xStop, xStep):
-                    for y in range(yStart, yStop, yStep):
-                        self.acquirePoint(x, y)
-            # Diagonal acquisition
-            elif mode == 2:
-                xRatioEnd = xEnd - xStep
-                yRatioEnd = yEnd - yStep
-                aspectRatio = (yRatioEnd - yStart) / (xRatioEnd - xStart)
-
-                for x in range(xStart, xStop, xStep):
-                    y = yStart + ((x - xStart) * aspectRatio)
-                    self.acquirePoint(x, y)
-            elif mode == 3:
-                points = self.config.getPoints()
-                for point in points:
-                    self.acquirePoint(point[0], point[1])
-
+            if self.config.isRefined():
+                refine.Refiner(self.config).run(self.measurePoint)
+                continue
+            if self.config.isLine():
+                self.acquireLine()
+                continue
+            for x, y in points:
+                self.acquirePoint(x, y)
+
+    # Acquire a point of a refined scan, returns its observable and standard
+    # error
+    def measurePoint(self, x, y):
+        summary = self.acquirePoint(x, y)
+        if summary is None or "estimate" not in summary:
+            return None
+        return summary["estimate"], \
+            abs(summary["estimate"]) * summary["precision"]
+
+    # Returns the point summary, None if it was skipped
+    @trace.traced("daq.acquirePoint")
     def acquirePoint(self, x, y):
         target = self.config.eventsPerPoint
         formatted("\nNow acquiring {} events at (x = {}, y = {})".format(
@@ -96,7 +200,7 @@ class UFSDPyDAQ:
 
         if not self.askSkipQuit(self.config.isStageAuto()):
             return
-        self.file.setPosition(x, y)
+        self.beginPoint(x, y)
 
         events = 0
         self.dgt.startAcquisition()
@@ -107,49 +211,539 @@ class UFSDPyDAQ:
                 formatted("Acquired {}/{} events.".format(events,
                     target), FORMAT_OK, "")
                 break
+            if self.isPrecise(events):
+                formatted("Acquired {} events, {} known to {:.1f} %."
+                    .format(events, self.estimator.name,
+                    100 * self.estimator.relativeError), FORMAT_OK, "")
+                break
         self.dgt.stopAcquisition()
+        return self.endPoint(x, y)
 
+    # Everything a point starts with once the stage is at (_x_, _y_)
+    def beginPoint(self, x, y):
+        self.file.setPosition(x, y)
+        self.position = (x, y)
+        self.estimator = self.makeEstimator()
+        if self.maps is not None:
+            self.maps.start()
+        if self.histograms is not None:
+            self.histograms.start()
+        # Line scans account for the whole line at once
+        if self.line is None:
+            self.accounting.start()
+
+    # Write out what's left of the point at (_x_, _y_) and its summary,
+    # which is returned. Bins of a line scan come with their own _summary_
+    # while the acquisition goes on, they are saved at the end of the line.
+    def endPoint(self, x, y, summary = None):
+        if summary is None:
+            self.accounting.stop()
+            if self.corrector is not None:
+                for block in self.corrector.drain():
+                    self.writeBlock(block)
+
+            summary = self.accounting.summary()
+            formatted(" Trigger rate {:.1f} Hz, accepted {:.1f} Hz, {} lost."
+                .format(summary["offered"], summary["accepted"],
+                summary["lost"]), FORMAT_WARNING if summary["lost"]
+                else FORMAT_NOTE)
+
+        summary.update(x = x, y = y, bias = self.file.bias[0],
+            blt = self.readoutTuner.blt,
+            pollInterval = self.readoutTuner.interval)
+        if summary.get("full"):
+            formatted("Board memory was full {} times, triggers were lost."
+                .format(summary["full"]), FORMAT_WARNING)
+        if self.config.isReadoutTuningEnabled() and self.line is None:
+            self.tuneReadout(summary)
+        if self.estimator is not None:
+            self.estimator.update()
+            summary.update(estimate = self.estimator.estimate,
+                precision = self.estimator.relativeError)
+        self.summaries.append(summary)
+        self.file.fillPoint(summary)
+        if self.maps is not None:
+            self.maps.endPoint(x, y, summary["bias"])
+        if self.histograms is not None:
+            self.histograms.endPoint(x, y)
+        if self.line is None:
+            self.savePoints()
+        return summary
+
+    # Write the points so far to the output file, maps and histograms
+    def savePoints(self):
         self.file.write()
+        if self.config.isHandoffEnabled():
+            for path in self.file.rolled():
+                self.handOff(path, False)
+        if self.maps is not None:
+            self.maps.save(maps.outputPath(self.config.outputPath,
+                self.config.outputFile))
+        if self.histograms is not None:
+            self.histograms.save(histograms.outputPath(
+                self.config.outputPath, self.config.outputFile))
+
+    # Move a line scan on to bin _index_: the point of the previous bin is
+    # ended and that of _index_ begun. None only ends the last one.
+    def moveLinePoint(self, index):
+        if self.lineBin is not None:
+            point = self.line.point(self.lineBin)
+            self.endPoint(point["x"], point["y"], point)
+        self.lineBin = index
+        if index is not None:
+            self.beginPoint(*self.line.nominal(index))
+
+    # Ranges of the events with (unwrapped) _timeTags_ that belong to the
+    # same point. In line scans events are cut where they reach the next
+    # bin, which moves the point on before the rest is handed out.
+    def linePoints(self, timeTags):
+        if self.line is None:
+            yield 0, len(timeTags)
+            return
+        start = 0
+        for i, index in enumerate(self.line.indices(timeTags)):
+            # Bins only go forward, stage jitter doesn't reopen one
+            if self.lineBin is not None and index <= self.lineBin:
+                continue
+            if i > start:
+                yield start, i
+            self.moveLinePoint(int(index))
+            start = i
+        if len(timeTags) > start:
+            yield start, len(timeTags)
+
+    # Acquire while the stage moves along the line, each event gets the
+    # position it was taken at and the points tree one entry per bin
+    @trace.traced("daq.acquireLine")
+    def acquireLine(self):
+        (xStart, xStep, xEnd,
+            yStart, yStep, yEnd) = self.config.getGrid(inclusive = False)
+        target = self.config.eventsPerPoint
+        if not self.config.isStageAuto():
+            formatted("\nLine scans need the stage under control, skipping",
+                FORMAT_ERROR)
+            return
+
+        formatted("\nNow acquiring up to {} events from (x = {}, y = {}) to "
+            "(x = {}, y = {})".format(target, xStart, yStart, xEnd, yEnd),
+            FORMAT_NOTE, "")
+        self.stage.to2d(xStart, yStart, True)
+        if not self.askSkipQuit(True):
+            return
 
+        events = 0
+        self.line = linescan.LineScan(self.stage, (xStart, yStart),
+            (xEnd, yEnd), xStep)
+        self.lineBin = None
+        self.estimator = None
+        self.accounting.start()
+        self.line.begin(self.dgt.startAcquisition)
+        self.stage.to2d(xEnd, yEnd, False)
+        while events < target and not self.line.arrived:
+            events += self.poll(events, target)
+        self.dgt.stopAcquisition()
+        self.accounting.stop()
+        if self.corrector is not None:
+            for block in self.corrector.drain():
+                self.writeBlock(block)
+        self.moveLinePoint(None)
+        # Stop the stage where it is if the events ran out first
+        position = self.stage.getPosition()
+        self.stage.to2d(position[0], position[1], True)
+
+        summary = self.accounting.summary()
+        formatted("Acquired {} events over {} bins.".format(events,
+            len(self.line.counts)), FORMAT_OK, "")
+        formatted(" Trigger rate {:.1f} Hz, accepted {:.1f} Hz, {} lost."
+            .format(summary["offered"], summary["accepted"],
+            summary["lost"]), FORMAT_WARNING if summary["lost"]
+            else FORMAT_NOTE)
+        if summary["full"]:
+            formatted("Board memory was full {} times, triggers were lost."
+                .format(summary["full"]), FORMAT_WARNING)
+        self.line = None
+        if self.config.isReadoutTuningEnabled():
+            self.tuneReadout(summary)
+        self.savePoints()
+
+    # Event counter and time tag of the event about to be filled, and its
+    # position in line scans
+    def setEventInfo(self, counter, timeTag):
+        self.file.setEventInfo(counter, timeTag)
+        if self.line is not None:
+            self.file.setPosition(*self.line.position(counter, timeTag))
+
+    # Estimator of the configured observable, None if points have a fixed
+    # number of events and nothing needs it. Line scans never stop early.
+    def makeEstimator(self):
+        if self.line is not None or not (self.config.isAdaptive() or
+            self.config.isRefined()):
+            return None
+        return observables.ESTIMATORS[self.config.observable](
+            self.config.observableChannel,
+            1E3 / self.config.frequencyValue, self.config.signalPolarity)
+
+    # Adaptive acquisition: is the estimate good enough to move on?
+    def isPrecise(self, events):
+        if not self.config.isAdaptive() or self.estimator is None or \
+            events < self.config.minEvents:
+            return False
+        self.estimator.update()
+        return self.estimator.relativeError <= self.config.precision
+
+    @trace.traced("daq.poll")
     def poll(self, taken, target):
+        # Boards are read out by their own processes, just merge and write
+        if self.config.isMultiBoard():
+            return self.pollBoards(taken, target)
+
+        if self.readoutTuner.interval:
+            time.sleep(self.readoutTuner.interval)
+        # A full memory drops triggers until this readout makes room
+        status = self.dgt.acquisitionStatus()
+        self.accounting.addStatus(bool(status & digitizer.STATUS_FULL))
         self.dgt.readData() # Update local buffer with data from the digitizer
+        if self.line is not None:
+            self.line.sample()
 
         size = self.dgt.getNumEvents() # How many events in this block?
         remaining = min(size, target - taken)
+        if self.corrector is not None:
+            self.pollRaw(remaining)
+            trace.count(events = remaining)
+            return remaining
+
+        # Decoded events are only valid until the next one is decoded, copy
+        # them if they are going to be published or mapped
+        copied = calibration.Block(remaining, self.config.eventSize) \
+            if self.ring is not None or self.maps is not None or \
+            self.histograms is not None else None
+        timeTags = [0] * remaining
         for i in range(remaining):
             data, info = self.dgt.getEvent(i, True) # Get event data and info
-
-            for j in range(18):
-                group = int(j / 9)
+            counter, timeTag = self.accounting.add(info.EventCounter,
+                info.TriggerTimeTag)
+            self.setEventInfo(counter, timeTag)
+            timeTags[i] = timeTag
+            if copied is not None:
+                copied.add(i, counter, timeTag, data)
+
+            for group, channels in self.layout:
                 if data.GrPresent[group] != 1:
                     continue # If this group was disabled then skip it
 
-                channel = j - (9 * group)
                 block = data.DataGroup[group]
-                size = block.ChSize[channel]
+                self.file.setStartCell(group, block.StartIndexCell)
+                for channel in channels:
+                    self.file.setChannel(group * 8 + channel,
+                        block.DataChannel[channel], block.ChSize[channel])
+                self.file.setTrigger(group, block.DataChannel[8],
+                    block.ChSize[8])
+
+            if self.estimator is not None:
+                self.estimator.addEvent(data)
+            self.file.fill()
+        # Fold the block into the estimate, waves aren't kept past it
+        if self.estimator is not None:
+            self.estimator.update()
+        if self.ring is not None:
+            self.publish(copied)
+        for start, stop in self.linePoints(timeTags):
+            if self.maps is not None:
+                self.maps.addBlock(copied.slice(start, stop))
+            if self.histograms is not None:
+                self.histograms.addBlock(copied.slice(start, stop))
+        if self.monitor is not None and remaining and self.monitor.due():
+            # Only the last event decoded is still valid
+            if copied is None:
+                copied = calibration.Block(1, self.config.eventSize)
+                copied.add(0, counter, timeTag, data)
+            self.snapshot(monitor.blockWaves(copied))
+        trace.count(events = remaining)
+        return remaining
 
-                if channel == 8:
-                    self.file.setTrigger(group,
-                        block.DataChannel[channel], size)
-                else:
-                    self.file.setChannel(j - group,
-                        block.DataChannel[channel], size)
+    # Same as poll, with raw samples corrected a block at a time. Blocks are
+    # written once the corrector hands them back, maybe at a later poll.
+    def pollRaw(self, count):
+        block = calibration.Block(count, self.config.eventSize)
+        for i in range(count):
+            data, info = self.dgt.getEvent(i, True)
+            block.add(i, *self.accounting.add(info.EventCounter,
+                info.TriggerTimeTag), data)
+        if self.dumper is not None:
+            self.dumper.write(block, self.file.bias[0], *self.position)
+
+        for ready in self.corrector.submit(block):
+            self.writeBlock(ready)
+
+    @trace.traced("daq.writeBlock")
+    def writeBlock(self, block):
+        for i in range(len(block)):
+            self.setEventInfo(block.counters[i], block.timeTags[i])
+            for group, channels in self.layout:
+                if not block.present[i, group]:
+                    continue
+                self.file.setStartCell(group, block.cells[i, group])
+                # Python floats are much quicker to push than NumPy scalars
+                waves = block.waves[i, group].tolist()
+                for channel in channels:
+                    self.file.setChannel(group * 8 + channel, waves[channel],
+                        len(waves[channel]))
+                self.file.setTrigger(group, waves[8], len(waves[8]))
+            self.file.fill()
+        if self.ring is not None:
+            self.publish(block)
+        for start, stop in self.linePoints(block.timeTags):
+            part = block.slice(start, stop)
+            if self.estimator is not None:
+                self.estimator.addBlock(part)
+            if self.maps is not None:
+                self.maps.addBlock(part)
+            if self.histograms is not None:
+                self.histograms.addBlock(part)
+        if self.monitor is not None and len(block) and self.monitor.due():
+            self.snapshot(monitor.blockWaves(block))
+
+    # Readout settings for the next point, from the _summary_ of the last one
+    def tuneReadout(self, summary):
+        rate = summary["offered"] or summary["accepted"]
+        if self.readoutTuner.update(rate, summary["full"]):
+            self.dgt.setMaxNumEventsBLT(self.readoutTuner.blt)
+            formatted("Readout now {} events per transfer, {:.1f} ms between "
+                "readouts".format(self.readoutTuner.blt,
+                1E3 * self.readoutTuner.interval), FORMAT_NOTE)
+
+    # Hand the state of the run and the latest _waves_ to the live monitor
+    def snapshot(self, waves):
+        summary = self.accounting.summary()
+        if self.line is not None and self.line.positions:
+            position = list(self.line.positions[-1])
+        else:
+            position = list(self.position)
+        self.monitor.update({"file": getattr(self.file, "path", None),
+            "bias": self.file.bias[0], "position": position,
+            "point": len(self.summaries) + 1,
+            "events": summary["events"], "target": self.config.eventsPerPoint,
+            "offered": round(summary["offered"], 1),
+            "accepted": round(summary["accepted"], 1),
+            "live": round(self.accounting.liveRate, 1),
+            "lost": summary["lost"]}, self.summaries, waves)
+
+    # Voltage and current of the sensor and trigger channels, for the live
+    # monitor
+    def hvReadings(self):
+        if not self.config.isHvAuto():
+            return {}
+        readings = {}
+        for name, channel in (("sensor", self.config.sensorChannel),
+            ("trigger", self.config.triggerChannel)):
+            readings["{} V".format(name)] = self.hv.getVoltage(channel)
+            readings["{} uA".format(name)] = self.hv.getCurrent(channel)
+        return readings
+
+    # Hand _block_ to shared memory readers, with the bias and position of
+    # the point (the latest stage sample in line scans)
+    def publish(self, block):
+        if self.line is not None and self.line.positions:
+            x, y = self.line.positions[-1]
+        else:
+            x, y = self.position
+        self.ring.publish(block, self.file.bias[0], x, y)
+
+    # Same as poll, for events merged from several boards. Counters and time
+    # tags come from the first board.
+    def pollBoards(self, taken, target):
+        events = self.dgt.poll(target - taken)
+        # Any board with a full memory drops triggers for all of them
+        self.accounting.addStatus(any(self.dgt.full))
+        if self.line is not None:
+            self.line.sample()
+        timeTags = []
+        for event in events:
+            counter, timeTag = self.accounting.add(event[0][0], event[0][1])
+            self.setEventInfo(counter, timeTag)
+            timeTags.append(timeTag)
+
+            for board, (counter, ttt, channels, triggers) in enumerate(event):
+                for channel, wave in channels.items():
+                    if channel not in self.channels:
+                        continue
+                    self.file.setChannel(
+                        board * readout.CHANNELS_PER_BOARD + channel,
+                        wave, len(wave))
+                for group, wave in triggers.items():
+                    self.file.setTrigger(
+                        board * readout.GROUPS_PER_BOARD + group,
+                        wave, len(wave))
+
+            if self.estimator is not None:
+                board, channel = divmod(self.estimator.index,
+                    readout.CHANNELS_PER_BOARD)
+                channels, triggers = event[board][2], event[board][3]
+                if channel in channels:
+                    self.estimator.addWave(channels[channel],
+                        triggers[channel // 8])
 
             self.file.fill()
-        return remaining
+        if self.estimator is not None:
+            self.estimator.update()
+        for start, stop in self.linePoints(timeTags):
+            if self.maps is not None:
+                self.maps.addEvents(events[start:stop],
+                    readout.CHANNELS_PER_BOARD, readout.GROUPS_PER_BOARD)
+            if self.histograms is not None:
+                self.histograms.addEvents(events[start:stop],
+                    readout.CHANNELS_PER_BOARD, readout.GROUPS_PER_BOARD)
+        if self.monitor is not None and events and self.monitor.due():
+            waves = {}
+            for board, (counter, ttt, channels, triggers) in \
+                enumerate(events[-1]):
+                for channel, wave in channels.items():
+                    waves["w{}".format(board * readout.CHANNELS_PER_BOARD +
+                        channel)] = wave
+                for group, wave in triggers.items():
+                    waves["trg{}".format(board * readout.GROUPS_PER_BOARD +
+                        group)] = wave
+            self.snapshot(waves)
+        trace.count(events = len(events))
+        return len(events)
+
+    # Random trigger pedestal run: _events_ software triggered events read
+    # raw, accumulated per channel and DRS4 cell. TR0 and the correction are
+    # off meanwhile and restored at the end.
+    def takePedestals(self, events):
+        info = self.dgt.getInfo()
+        result = pedestal.Pedestal(self.config.frequency, info.SerialNumber)
+        self.dgt.setFastTriggerMode(0)
+        self.dgt.disableCorrection()
+
+        formatted("\nTaking {} pedestal events... ".format(events),
+            FORMAT_NOTE, "")
+        self.dgt.startAcquisition()
+        while result.events < events:
+            for i in range(min(PEDESTAL_BATCH, events - result.events)):
+                self.dgt.trigger()
+            self.dgt.readData()
+            count = min(self.dgt.getNumEvents(), events - result.events)
+
+            block = calibration.Block(count, self.config.eventSize)
+            for i in range(count):
+                data, info = self.dgt.getEvent(i, True)
+                block.add(i, info.EventCounter, info.TriggerTimeTag, data)
+            result.add(block)
+        self.dgt.stopAcquisition()
+        formatted("Done!", FORMAT_OK)
+
+        self.programDigitizer()
+        return result
+
+    # Find the TR0 threshold (or DC offset, _knob_ = "offset") giving
+    # _target_ Hz, or the one just before the noise wall if _target_ is
+    # None. The trigger detector is biased first, like in prepare.
+    def tuneTrigger(self, target, knob = "threshold"):
+        self.hv.enableChannel(self.config.powerChannels)
+        self.hvSetBlocking(self.config.triggerChannel,
+            self.config.triggerBias)
+
+        tuner = tuning.TriggerTuner(self.dgt, self.config.triggerOffset,
+            self.config.triggerThreshold, knob)
+        formatted("\nScanning the trigger {}...".format(knob), FORMAT_NOTE)
+        if target is None:
+            value, rate = tuner.knee()
+        else:
+            value, rate = tuner.toRate(target)
+        formatted("Best {} is {}, {:.1f} Hz after {} measurements".format(
+            knob, value, rate, len(tuner.measured)), FORMAT_OK)
+
+        self.programDigitizer()
+        return tuner, rate
 
     def cleanup(self):
-        self.file.close()
+        self.finish()
+        self.disconnect()
+        formatted("Exiting, goodbye...", FORMAT_NOTE, "")
 
-        formatted("\nDigitizer cleanup... ", FORMAT_NOTE, "")
+    # End of a run: close the output file but leave every instrument as
+    # it is, HV included, ready for the next run
+    def finish(self):
+        path = getattr(self.file, "path", None)
+        if self.config.isHandoffEnabled() and path is not None:
+            for part in self.file.rolled():
+                self.handOff(part, False)
+            path = self.file.parts[-1]
+        self.file.close()
+        if self.config.isHandoffEnabled() and path is not None:
+            self.handOff(path, True)
         self.dgt.stopAcquisition()
-        self.dgt.freeEvent()
-        self.dgt.freeBuffer()
-        formatted("Done!", FORMAT_OK)
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.dumper is not None:
+            formatted("\n{} raw blocks saved to {}".format(
+                self.dumper.blocks, self.dumper.directory), FORMAT_NOTE)
+            self.dumper = None
+        if self.maps is not None:
+            path = maps.outputPath(self.config.outputPath,
+                self.config.outputFile)
+            self.maps.save(path)
+            formatted("\nMaps of {} points written to {}".format(
+                len(self.maps.xs), path), FORMAT_NOTE)
+            self.maps = None
+        if self.histograms is not None:
+            path = histograms.outputPath(self.config.outputPath,
+                self.config.outputFile)
+            self.histograms.save(path)
+            formatted("Histograms of {} biases written to {}".format(
+                len(self.histograms.biases), path), FORMAT_NOTE)
+            self.histograms = None
+        if self.config.isReadoutTuningEnabled() and \
+            self.readoutTuner.history:
+            full = sum(point[3] for point in self.readoutTuner.history)
+            snippet = self.readoutTuner.snippet("Readout tuned over {} points "
+                "({} full memory episodes) on {}".format(
+                len(self.readoutTuner.history), full,
+                datetime.datetime.now().strftime("%Y-%m-%d %H:%M")))
+            path = os.path.join(self.config.outputPath,
+                "{}_readout.ini".format(self.config.outputFile))
+            with open(path, "w") as file:
+                file.write(snippet)
+            formatted("\nReadout settings written to {}, paste them in "
+                "[DIGITIZER]".format(path), FORMAT_NOTE)
+        if self.monitor is not None:
+            formatted("\nLive monitor took {:.2f} % of the run".format(
+                100 * self.monitor.cost), FORMAT_NOTE)
+            self.monitor.close()
+            self.monitor = None
+
+        if trace.enabled:
+            path = os.path.join(self.config.outputPath,
+                "{}_trace.json".format(self.config.outputFile))
+            trace.write(path)
+            formatted("\nReadout trace written to {}".format(path),
+                FORMAT_NOTE)
+            print(trace.summary())
+            trace.disable()
+
+    # Queue the closed file at _path_ for the analysis, with the points and
+    # events that went into it. _final_ is False for the parts ROOT closed
+    # during the run.
+    def handOff(self, path, final):
+        points = len(self.summaries)
+        events = sum(s.get("events", 0) for s in self.summaries)
+        try:
+            handoff.append(handoff.record(path, self.config,
+                points - self.handedOff[0], events - self.handedOff[1],
+                final), self.config.handoffPath)
+            formatted("\n{} queued for analysis in {}".format(path,
+                self.config.handoffPath), FORMAT_NOTE)
+        except OSError as e:
+            formatted("\nCouldn't queue {} for analysis: {}".format(path, e),
+                FORMAT_ERROR)
+        self.handedOff = (points, events)
 
-        formatted("Closing connection to digitizer... ", FORMAT_NOTE, "")
-        self.dgt.close()
-        formatted("Done!", FORMAT_OK)
+    # Power down and close every instrument
+    def disconnect(self):
+        self.disconnectDigitizer()
 
         if self.config.isHvAuto():
             formatted("Power supply cleanup... ", FORMAT_NOTE, "")
@@ -171,8 +765,6 @@ class UFSDPyDAQ:
             self.stage.close()
             formatted("Done!", FORMAT_OK)
 
-        formatted("Exiting, goodbye...", FORMAT_NOTE, "")
-
 # ============================ STAGE STUFF ====================================
 
     def connectStage(self):
@@ -202,7 +794,8 @@ class UFSDPyDAQ:
             return False
 
         formatted("\nConnecting to power supply... ", FORMAT_NOTE, end = "")
-        self.hv = highvoltage.HighVoltage(self.config.hvID)
+        self.hv = highvoltage.HighVoltage(self.config.hvID,
+            self.config.hvResource, self.interactive)
         if not self.hv.connected:
             formatted("Fail!", "Couldn't connect to device, exiting.",
                 FORMAT_ERROR)
@@ -222,6 +815,7 @@ class UFSDPyDAQ:
         self.hv.setRampDown(self.config.powerChannels,
             self.config.rampDownRate)
 
+    @trace.traced("daq.hvSetBlocking")
     def hvSetBlocking(self, channel, bias):
         if self.config.isHvAuto():
             formatted("\nWaiting for power supply... ", FORMAT_NOTE, "")
@@ -232,13 +826,26 @@ class UFSDPyDAQ:
 
     def connectDigitizer(self):
         formatted("\nConnecting to digitizer... ", FORMAT_NOTE, "")
-        self.dgt = digitizer.Digitizer(self.config.digitizerID)
+        # With more than one board every digitizer gets its own readout
+        # process, self.dgt then forwards each call to all of them
+        if self.config.isMultiBoard():
+            self.dgt = readout.Boards(self.config.digitizerIDs)
+        else:
+            self.dgt = digitizer.Digitizer(self.config.digitizerID)
         if not self.dgt.connected:
             formatted("Fail! Couldn't connect to device, exiting.",
                 FORMAT_ERROR)
             exit()
 
-        self.dgt.reset()
+        # A reset wipes every setting and costs a full reprogramming. By
+        # default the board is only stopped and its settings read back, so
+        # that programDigitizer writes just what changed since the last run.
+        if self.config.isResetEnabled():
+            self.dgt.reset()
+        else:
+            self.dgt.stopAcquisition()
+            self.dgt.clearData()
+            self.dgt.readBack()
         dgtInfo = self.dgt.getInfo()
         dgtModel = str(dgtInfo.ModelName, "utf-8")
         if dgtModel not in DIGITIZER_MODELS:
@@ -249,12 +856,41 @@ class UFSDPyDAQ:
         formatted("Done! Hello " + dgtModel, FORMAT_OK)
         return True
 
+    # Connect, program and check the digitizer, then get its buffers ready
+    def setupDigitizer(self):
+        self.connectDigitizer()
+        self.programDigitizer()
+        status = self.dgt.status()
+        print("Digitizer status is {}, ".format(hex(status)), end = "")
+        if status == 0x180:
+            formatted(" good!", FORMAT_OK)
+        else:
+            formatted("something's wrong. Exiting.", FORMAT_ERROR)
+            exit()
+        self.dgt.allocateEvent()
+        self.dgt.mallocBuffer()
+
+    def disconnectDigitizer(self):
+        if self.corrector is not None:
+            self.corrector.close()
+            self.corrector = None
+
+        formatted("\nDigitizer cleanup... ", FORMAT_NOTE, "")
+        self.dgt.stopAcquisition()
+        self.dgt.freeEvent()
+        self.dgt.freeBuffer()
+        formatted("Done!", FORMAT_OK)
+
+        formatted("Closing connection to digitizer... ", FORMAT_NOTE, "")
+        self.dgt.close()
+        formatted("Done!", FORMAT_OK)
+
     def programDigitizer(self):
         formatted("Programming digitizer... ", FORMAT_NOTE, end = "")
         # Data acquisition
         self.dgt.setSamplingFrequency(self.config.frequency)
         self.dgt.setRecordLength(self.config.eventSize)
-        self.dgt.setMaxNumEventsBLT(1023) # Packet size for file transfer
+        self.dgt.setMaxNumEventsBLT(self.config.bltSize) # Packet size for file transfer
         self.dgt.setAcquisitionMode(0) # Software controlled
         self.dgt.setExtTriggerInputMode(0) # Disable TRG IN trigger
 
@@ -264,8 +900,11 @@ class UFSDPyDAQ:
         self.dgt.setFastTriggerMode(1) # Enable TR0 trigger
         self.dgt.setFastTriggerDigitizing(1) # Digitize TR0
 
-        # Enable or disable groups
-        self.dgt.setGroupEnableMask(0b11)
+        # Enable or disable groups, disabled ones are never transferred
+        self.dgt.setGroupEnableMask(self.config.groupMask)
+        # Readout processes only send the channels written to file
+        if self.config.isMultiBoard():
+            self.dgt.setLayout(self.layout)
 
         channelOffset = self.config.channelsOffset
         if channelOffset != None:
@@ -280,20 +919,51 @@ class UFSDPyDAQ:
         self.dgt.setFastTriggerThreshold(self.config.triggerThreshold)
 
         # Data processing
-        if self.config.isCorrectionEnabled():
+        if self.config.isSoftwareCorrectionEnabled():
+            self.dgt.disableCorrection()
+        elif self.config.isCorrectionEnabled():
             # Correction tables for 5 GHz operation
             self.dgt.loadCorrectionData(self.config.frequency)
             self.dgt.enableCorrection()
+        else:
+            self.dgt.disableCorrection()
 
         # Extra time after trigger
         self.dgt.setPostTriggerSize(self.config.postTriggerDelay)
         formatted("Done!", FORMAT_OK)
 
+        self.setupCorrector()
+
+    # Raw samples get corrected on the host with tables for this board and
+    # frequency, cached in the calibration directory
+    def setupCorrector(self):
+        if self.corrector is not None:
+            self.corrector.close()
+            self.corrector = None
+        if not self.config.isSoftwareCorrectionEnabled():
+            return
+
+        tables = calibration.get(self.dgt, self.config.frequency,
+            self.config.calibrationPath)
+        if self.config.isPedestalCorrectionEnabled():
+            path = pedestal.cachePath(self.config.calibrationPath,
+                tables.serial, self.config.frequency)
+            if os.path.exists(path):
+                tables = pedestal.load(path).tables(tables)
+                formatted("Cell offsets from {}".format(path), FORMAT_NOTE)
+            else:
+                formatted("No pedestal run in {}, cell offsets from the "
+                    "board".format(path), FORMAT_WARNING)
+        self.corrector = calibration.Corrector(tables,
+            self.config.isCorrectionWorkerEnabled())
+        formatted("Correcting on the host with tables for board {}".format(
+            tables.serial), FORMAT_NOTE)
+
     def askSkipQuit(self, bypass):
         if bypass:
             return True
 
-        prompt = input("Press enter to continue, type 's' to skip or 'q' to quit... ")
+        prompt = self.prompt("Press enter to continue, type 's' to skip or 'q' to quit... ")
         if prompt == "s":
             return False
         elif prompt == "q":
@@ -325,22 +995,147 @@ class Nothing():
             pass
         return bye
 
-if __name__ == "__main__":
-    args = sys.argv
-
-    configPath = CONFIG_PATH
-    if len(args) == 2:
-        configPath = args[1]
+# Show what a config would do without touching any hardware
+def dryRun(config):
+    points = config.getScanPoints()
+    biases = config.sensorBiases
+    # A line scan is one long point
+    events = (1 if config.isLine() else len(points)) * len(biases) * \
+        config.eventsPerPoint
+
+    channels = max(io.tree.CHANNELS,
+        readout.CHANNELS_PER_BOARD * len(config.digitizerIDs))
+    branches = io.tree.waveBranches(channels, config.usedChannels)
+    size = events * len(branches) * config.eventSize * 8
+
+    formatted("\nDry run, nothing will be acquired.", FORMAT_NOTE)
+    print("Digitizers: {}, groups {}, channels {}".format(
+        config.digitizerIDs, config.groups, config.channels))
+    print("Biases: {} V".format(biases))
+    print("Points: {} per bias, first {}, last {}".format(len(points),
+        points[0] if points else None, points[-1] if points else None))
+    print("Events: {}{} ({} per point)".format(
+        "at most " if config.isAdaptive() else "", events,
+        config.eventsPerPoint))
+    if config.isAdaptive():
+        print("Adaptive: {} on channel {} to {:.1f} %, from {} events".format(
+            config.observable.lower(), config.observableChannel,
+            100 * config.precision, config.minEvents))
+    if config.isRefined():
+        print("Refine: {} coarse points above, split down to ({}, {}) where "
+            "{} changes by {:.0f} %, budget {}".format(len(points),
+            config.getGrid()[1], config.getGrid()[4],
+            config.observable.lower(), 100 * config.refineThreshold,
+            "{} s".format(config.timeBudget) if config.timeBudget
+            else "none"))
+    print("Output: {}".format(io.tree.outputPath(config.outputPath,
+        config.outputFile)))
+    print("Branches: {} waveforms, ~{:.1f} GB uncompressed".format(
+        len(branches), size / 1E9))
 
-    config = io.config.Config(configPath)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "UFSD DAQ")
+    parser.add_argument("config", nargs = "?", default = CONFIG_PATH)
+    parser.add_argument("--dry-run", action = "store_true",
+        help = "Parse the config, show the scan plan and exit")
+    parser.add_argument("--serve", action = "store_true",
+        help = "Keep the instruments open and wait for runs on the socket")
+    parser.add_argument("--remote", action = "store_true",
+        help = "Hand the config to a running daemon")
+    parser.add_argument("--shutdown", action = "store_true",
+        help = "Stop a running daemon, powering everything down")
+    parser.add_argument("--socket", default = daemon.SOCKET_PATH,
+        help = "Daemon socket path")
+    parser.add_argument("--batch", nargs = "+", metavar = "PATH",
+        help = "Run these configs (or directories of configs) unattended")
+    parser.add_argument("--keep-order", action = "store_true",
+        help = "Run the batch in the given order")
+    parser.add_argument("--pedestal", type = int, metavar = "EVENTS",
+        help = "Take a random trigger pedestal run instead of a scan")
+    parser.add_argument("--tune-trigger", metavar = "HZ|knee",
+        help = "Tune the trigger threshold to a rate or to the noise knee")
+    parser.add_argument("--tune-offset", action = "store_true",
+        help = "Tune the trigger DC offset instead of the threshold")
+    args = parser.parse_args()
+
+    if args.batch:
+        queue = batch.Queue(UFSDPyDAQ, args.batch, not args.keep_order)
+        queue.run()
+        exit(0 if queue.report() else 1)
+
+    if args.serve:
+        daemon.Server(UFSDPyDAQ, args.socket).serve()
+        exit()
+    if args.remote or args.shutdown:
+        if args.shutdown:
+            message = {"command": "shutdown"}
+        else:
+            message = {"command": "run",
+                "config": os.path.abspath(args.config)}
+        result = daemon.request(message, args.socket)
+        if result["ok"] and "seconds" in result:
+            formatted("\nRun done in {:.1f} s".format(result["seconds"]),
+                FORMAT_OK)
+        elif result["ok"]:
+            formatted("\nDone!", FORMAT_OK)
+        else:
+            formatted("\nFailed: {}".format(result["error"]), FORMAT_ERROR)
+        exit(0 if result["ok"] else 1)
+
+    config = io.config.Config(args.config)
+    if args.dry_run:
+        dryRun(config)
+        exit()
+
+    # Pedestals are per board and read events one by one, which the
+    # readout processes of a multi-board setup don't hand out
+    if args.pedestal and config.isMultiBoard():
+        formatted("\nPedestal runs take one board at a time, set DEVICE_ID "
+            "to one of {}".format(config.digitizerIDs), FORMAT_ERROR)
+        exit(1)
+    # Trigger tuning counts the events of a single board
+    if args.tune_trigger and config.isMultiBoard():
+        formatted("\nTrigger tuning takes one board at a time, set DEVICE_ID "
+            "to one of {}".format(config.digitizerIDs), FORMAT_ERROR)
+        exit(1)
 
     daq = UFSDPyDAQ(config)
+
+    if args.pedestal:
+        result = daq.takePedestals(args.pedestal)
+        path = pedestal.cachePath(config.calibrationPath, result.serial,
+            config.frequency)
+        result.save(path)
+        mean, rms = result.channels()
+        for group in range(mean.shape[0]):
+            for channel in range(mean.shape[1]):
+                print("Group {} channel {}: pedestal {:8.2f}, noise {:5.2f}"
+                    .format(group, channel, mean[group, channel],
+                    rms[group, channel]))
+        formatted("\nPedestals written to {}".format(path), FORMAT_OK)
+        daq.disconnect()
+        exit()
+
+    if args.tune_trigger:
+        target = None if args.tune_trigger == "knee" \
+            else float(args.tune_trigger)
+        tuner, rate = daq.tuneTrigger(target,
+            "offset" if args.tune_offset else "threshold")
+        comment = "Tuned {} to {:.1f} Hz ({}) on {}".format(tuner.knob, rate,
+            "noise knee" if target is None else "target {:g} Hz".format(
+            target), datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+        snippet = tuner.snippet(comment)
+        path = os.path.splitext(args.config)[0] + "_trigger.ini"
+        with open(path, "w") as file:
+            file.write(snippet)
+        print("\n" + snippet)
+        formatted("Written to {}, paste it in [DIGITIZER]".format(path),
+            FORMAT_OK)
+        daq.disconnect()
+        exit()
     
     if daq.prepare():
         daq.acquire()
         #discord_alert()  
 
     daq.cleanup()
-else:
-    print("Please don't run me as a module...")
-    exit()
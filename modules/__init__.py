@@ -1,4 +1,7 @@
-from . import digitizer, highvoltage, stage, io
+from . import digitizer, highvoltage, stage, io, readout, accounting, trace, sim, \
+    daemon, batch, calibration, pedestal, tuning, \
+    observables, refine, linescan, ring, monitor, maps, histograms, \
+    replay, handoff
 
 if __name__ == "__main__":
     print("I'm a module, please don't run me alone.")
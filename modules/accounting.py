@@ -0,0 +1,134 @@
+# Trigger accounting: unwraps counters and time tags, tracks lost triggers.
+
+from collections import deque
+import time
+
+# Duration of one trigger time tag tick for the DT5742
+TTT_PERIOD = 8.5E-9 # s
+# Width of the hardware counters, both wrap around silently
+TTT_BITS = 32
+COUNTER_BITS = 22
+# The live trigger rate is computed over this many recent events
+RATE_WINDOW = 256
+
+# Keeps track of the EventCounter and TriggerTimeTag of each event within a
+# point. Counters are unwrapped, gaps in the event counter are triggers the
+# digitizer saw but never handed to us.
+class Accounting():
+
+    def __init__(self, period = TTT_PERIOD):
+        self.period = period
+        self.start()
+
+    # Forget everything, the digitizer resets both counters when
+    # acquisition (re)starts
+    def start(self):
+        self.began = time.time()
+        self.ended = None
+
+        self.counter = Unwrapper(COUNTER_BITS)
+        self.ttt = Unwrapper(TTT_BITS)
+
+        self.firstCounter = None
+        self.lastCounter = None
+        self.firstTag = None
+        self.lastTag = None
+
+        self.accepted = 0
+        self.lost = 0
+        self.recent = deque(maxlen = RATE_WINDOW)
+
+        # Samples of the board memory status and episodes it was found full
+        self.samples = 0
+        self.full = 0
+        self.wasFull = False
+
+    def stop(self):
+        self.ended = time.time()
+
+    # Account for one accepted event, returns the unwrapped counter and time
+    # tag so they can be written to file
+    def add(self, counter, ttt):
+        counter = self.counter.unwrap(counter)
+        ttt = self.ttt.unwrap(ttt)
+
+        if self.firstCounter is None:
+            self.firstCounter = counter
+            self.firstTag = ttt
+        elif counter > self.lastCounter + 1:
+            self.lost += counter - self.lastCounter - 1
+
+        self.lastCounter = counter
+        self.lastTag = ttt
+        self.accepted += 1
+        self.recent.append(ttt)
+
+        return counter, ttt
+
+    # Account for one look at the board memory, _full_ if it had no room
+    # left. Consecutive full samples are a single episode.
+    def addStatus(self, full):
+        self.samples += 1
+        if full and not self.wasFull:
+            self.full += 1
+        self.wasFull = full
+
+    # Triggers seen by the digitizer since the first accepted event
+    @property
+    def triggers(self):
+        if self.firstCounter is None:
+            return 0
+        return self.lastCounter - self.firstCounter + 1
+
+    # Time between first and last accepted trigger, in seconds
+    @property
+    def span(self):
+        if self.firstTag is None:
+            return 0
+        return (self.lastTag - self.firstTag) * self.period
+
+    # Trigger rate over the last RATE_WINDOW events, in Hz
+    @property
+    def liveRate(self):
+        if len(self.recent) < 2:
+            return 0
+        elapsed = (self.recent[-1] - self.recent[0]) * self.period
+        return (len(self.recent) - 1) / elapsed if elapsed > 0 else 0
+
+    # Rate of triggers offered to the digitizer, in Hz
+    @property
+    def offeredRate(self):
+        span = self.span
+        return (self.triggers - 1) / span if span > 0 else 0
+
+    # Rate at which events actually made it to file, in Hz. This uses
+    # wall time, so it includes readout dead time
+    @property
+    def acceptedRate(self):
+        ended = self.ended if self.ended is not None else time.time()
+        elapsed = ended - self.began
+        return self.accepted / elapsed if elapsed > 0 else 0
+
+    def summary(self):
+        return {"events": self.accepted, "triggers": self.triggers,
+            "lost": self.lost, "offered": self.offeredRate,
+            "accepted": self.acceptedRate, "full": self.full}
+
+# Turns a free running counter of _bits_ bits into a monotonic one
+class Unwrapper():
+
+    def __init__(self, bits):
+        self.modulo = 1 << bits
+        self.offset = 0
+        self.last = None
+
+    def unwrap(self, value):
+        value &= self.modulo - 1
+        if self.last is not None and value < self.last:
+            self.offset += self.modulo
+        self.last = value
+        return value + self.offset
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
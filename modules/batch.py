@@ -0,0 +1,132 @@
+# Run a queue of configs back to back with no operator. The instruments are
+# opened once (see daemon.Server) and the runs are ordered so that the HV
+# ramps and stage moves between them take as little time as possible.
+
+import datetime, glob, json, os
+
+from . import daemon, stage
+from .io import config
+
+SUMMARY_SUFFIX = "_summary.json"
+
+# What a run needs from the instruments when it starts and leaves behind.
+# A config that can't be read leaves the run with an _error_ instead.
+class Run():
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.error = None
+        try:
+            self.config = config.Config(self.path)
+        except (Exception, SystemExit) as error:
+            # Config exits on invalid files, after saying why
+            self.config = None
+            self.error = "invalid config" if isinstance(error, SystemExit) \
+                else repr(error)
+            return
+        points = self.config.getScanPoints() or [(0, 0)]
+        biases = self.config.sensorBiases
+        self.first = (biases[0], points[0])
+        self.last = (biases[-1], points[-1])
+
+    # Seconds needed to go from _state_ (bias, (x, y)) to the start of this run
+    def cost(self, state, trigger):
+        bias, position = state
+        seconds = self.ramp(bias, self.first[0])
+        seconds += self.ramp(trigger, self.config.triggerBias)
+        if self.config.isStageAuto():
+            # Axes move together, the longest one sets the time
+            distance = max(abs(a - b) for a, b in zip(position, self.first[1]))
+            seconds += distance / stage.CONVERSION_COEFFICIENT / \
+                max(self.config.stageSpeed, 1)
+        return seconds
+
+    def ramp(self, start, stop):
+        rate = self.config.rampUpRate if stop > start \
+            else self.config.rampDownRate
+        return abs(stop - start) / max(rate, 1)
+
+# Config files in _paths_, directories are expanded to the .ini files in them
+def collect(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.ini"))))
+        else:
+            files.append(path)
+    return files
+
+# Greedy nearest neighbour: always take the run that is quickest to reach
+# from where the previous one left HV and stage. Starts with HV off and the
+# stage at the origin.
+def order(runs):
+    runs = list(runs)
+    state, trigger = (0, (0, 0)), 0
+    ordered = []
+    while runs:
+        best = min(runs, key = lambda run: run.cost(state, trigger))
+        runs.remove(best)
+        ordered.append(best)
+        state, trigger = best.last, best.config.triggerBias
+    return ordered
+
+class Queue():
+
+    # _factory_ builds the DAQ object from a config, e.g. main.UFSDPyDAQ.
+    # Runs with an invalid config are not ordered, they fail last.
+    def __init__(self, factory, paths, reorder = True):
+        self.server = daemon.Server(factory)
+        runs = [Run(path) for path in collect(paths)]
+        if reorder:
+            self.runs = order([run for run in runs if run.error is None]) + \
+                [run for run in runs if run.error is not None]
+        else:
+            self.runs = runs
+        self.results = []
+
+    def run(self):
+        try:
+            for i, run in enumerate(self.runs):
+                print("\n===== Run {}/{}: {} =====".format(i + 1,
+                    len(self.runs), run.path))
+                if run.error is not None:
+                    print("Skipped: {}".format(run.error))
+                    self.results.append({"ok": False, "config": run.path,
+                        "error": run.error, "seconds": 0,
+                        "finished": datetime.datetime.now().isoformat()})
+                    continue
+                result = self.server.run(run.path)
+                result["finished"] = datetime.datetime.now().isoformat()
+                self.results.append(result)
+                self.writeSummary(run, result)
+        finally:
+            self.server.close()
+        return self.results
+
+    # Per run summary, next to the output file
+    def writeSummary(self, run, result):
+        path = os.path.join(run.config.outputPath,
+            run.config.outputFile + SUMMARY_SUFFIX)
+        try:
+            with open(path, "w") as file:
+                json.dump(result, file, indent = 1)
+        except OSError:
+            print("Couldn't write run summary to {}".format(path))
+
+    def report(self):
+        print("\n{:<4}{:<40}{:>8}{:>10}{:>8}{:>10}".format("#", "config",
+            "points", "events", "lost", "time [s]"))
+        for i, result in enumerate(self.results):
+            name = os.path.basename(result["config"])
+            if result["ok"]:
+                print("{:<4}{:<40}{:>8}{:>10}{:>8}{:>10.1f}".format(i + 1,
+                    name, result["points"], result["events"], result["lost"],
+                    result["seconds"]))
+            else:
+                print("{:<4}{:<40}  failed: {}".format(i + 1, name,
+                    result["error"]))
+        return all(result["ok"] for result in self.results)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
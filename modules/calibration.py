@@ -0,0 +1,254 @@
+# DRS4 cell-wise correction applied on the host. Raw samples are read out
+# uncorrected, together with the start cell of each group, and corrected a
+# whole block at a time with NumPy. The same tables can be applied again
+# later to the raw data, with a better calibration if one comes along.
+#
+# Tables follow the CAEN layout: per group, a cell offset for each of the
+# 1024 DRS4 cells and each channel, a per sample offset ("nsample") and the
+# time of each cell. They are cached on disk by board serial and frequency.
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+
+from .io.config import SAMPLING_FREQUENCIES
+
+CELLS = 1024
+GROUPS = 2
+# 8 channels and the digitized TR0
+CHANNELS_PER_GROUP = 9
+# What to correct, same bits as the CAEN library
+CELL = 1
+NSAMPLE = 2
+TIME = 4
+ALL = CELL | NSAMPLE | TIME
+# Dips larger than this on all 8 channels of a group at once are spikes
+SPIKE_THRESHOLD = 30 # ADC counts
+CACHE_PATH = "calibration"
+
+class Tables():
+
+    def __init__(self, cell, nsample, time, frequency, serial = None):
+        self.cell = np.asarray(cell, np.float32)
+        self.nsample = np.asarray(nsample, np.float32)
+        self.time = np.asarray(time, np.float32)
+        self.frequency = frequency
+        self.serial = serial
+
+    # Sampling period in ns
+    @property
+    def period(self):
+        return 1E3 / SAMPLING_FREQUENCIES[self.frequency]
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        np.savez(path, cell = self.cell, nsample = self.nsample,
+            time = self.time, frequency = self.frequency,
+            serial = -1 if self.serial is None else self.serial)
+
+    # Correct _block_ in place, returns it
+    def apply(self, block, levels = ALL):
+        waves, cells = block.waves, block.cells
+        if not len(block):
+            return block
+        length = waves.shape[-1]
+        groups = np.arange(waves.shape[1])[None, :]
+
+        # Every window of _length_ cells starting anywhere in the (wrapped)
+        # tables, picking one per event and group is a plain gather
+        if levels & CELL:
+            waves -= windows(self.cell, length)[groups, :, cells]
+        if levels & NSAMPLE:
+            waves -= self.nsample[None, :waves.shape[1], :, :length]
+        if levels & CELL:
+            removeSpikes(waves)
+        if levels & TIME:
+            block.waves = self.resample(waves,
+                windows(self.time, length)[groups, cells])
+        return block
+
+    # Interpolate the samples, taken at the real cell _times_, back onto an
+    # evenly spaced grid
+    def resample(self, waves, times):
+        events, groups, channels, length = waves.shape
+        period = self.period
+        steps = np.diff(times, axis = -1)
+        steps[steps <= 0] += period * CELLS
+        times = np.zeros(times.shape, np.float64)
+        np.cumsum(steps, axis = -1, out = times[..., 1:])
+
+        # One searchsorted for every row at once: rows are shifted apart so
+        # that the flattened times stay sorted
+        rows = events * groups
+        grid = np.arange(length, dtype = np.float64) * period
+        span = max(times.max(), grid[-1]) + period
+        shift = np.arange(rows)[:, None] * span
+        flat = (times.reshape(rows, length) + shift).ravel()
+        after = np.searchsorted(flat, (grid + shift).ravel())
+        after = after.reshape(rows, length) - np.arange(rows)[:, None] * length
+        after = np.clip(after, 1, length - 1)
+
+        times = times.reshape(rows, length)
+        t0 = np.take_along_axis(times, after - 1, -1)
+        t1 = np.take_along_axis(times, after, -1)
+        weight = ((grid - t0) / (t1 - t0)).astype(np.float32)[:, None, :]
+
+        # Flat indices of the samples around each grid point
+        waves[..., 0] = waves[..., 1]
+        flat = waves.reshape(-1)
+        base = (np.arange(rows)[:, None] * channels +
+            np.arange(channels)[None, :]) * length
+        after = base[:, :, None] + after[:, None, :]
+        v0 = np.take(flat, after - 1)
+        v1 = np.take(flat, after)
+        resampled = (v0 + (v1 - v0) * weight).reshape(waves.shape)
+        resampled[..., 0] = waves[..., 0]
+        return resampled
+
+# View of _table_ (..., CELLS) as every run of _length_ consecutive cells,
+# wrapping around: window[..., start, :] starts at cell _start_
+def windows(table, length):
+    wrapped = np.concatenate((table, table[..., :length]), axis = -1)
+    return np.lib.stride_tricks.sliding_window_view(wrapped, length,
+        axis = -1)[..., :CELLS, :]
+
+# Common mode dips of one or two samples seen by all 8 channels of a group
+# are DRS4 readout spikes, replace them with their neighbours. Vectorized
+# version of the CAEN PeakCorrection, without its edge cases.
+def removeSpikes(waves):
+    data = waves[:, :, :8]
+    center = data[..., 1:-2]
+    before = data[..., :-3] - center > SPIKE_THRESHOLD
+    single = (before & (data[..., 2:-1] - center > SPIKE_THRESHOLD)).all(2)
+    double = (before & (data[..., 3:] - center > SPIKE_THRESHOLD)).all(2) \
+        & ~single
+
+    events, groups, samples = np.nonzero(single)
+    samples += 1
+    waves[events, groups, :, samples] = (waves[events, groups, :, samples - 1]
+        + waves[events, groups, :, samples + 1]) / 2
+
+    events, groups, samples = np.nonzero(double)
+    samples += 1
+    fill = (waves[events, groups, :, samples - 1] +
+        waves[events, groups, :, samples + 2]) / 2
+    waves[events, groups, :, samples] = fill
+    waves[events, groups, :, samples + 1] = fill
+
+def load(path):
+    data = np.load(path)
+    serial = int(data["serial"])
+    return Tables(data["cell"], data["nsample"], data["time"],
+        int(data["frequency"]), None if serial < 0 else serial)
+
+# Tables as stored in the board flash, _dgt_ is a connected Digitizer
+def fromBoard(dgt, frequency):
+    tables = dgt.getCorrectionTables(frequency)
+    cell = [np.ctypeslib.as_array(tables[g].cell) for g in range(GROUPS)]
+    nsample = [np.ctypeslib.as_array(tables[g].nsample) for g in range(GROUPS)]
+    time = [np.ctypeslib.as_array(tables[g].time) for g in range(GROUPS)]
+    return Tables(cell, nsample, time, frequency,
+        dgt.getInfo().SerialNumber)
+
+# Tables that change nothing: no offsets and evenly spaced cells
+def ideal(frequency, serial = None):
+    period = 1E3 / SAMPLING_FREQUENCIES[frequency]
+    time = np.tile(np.arange(CELLS, dtype = np.float32) * period, (GROUPS, 1))
+    zeros = np.zeros((GROUPS, CHANNELS_PER_GROUP, CELLS), np.float32)
+    return Tables(zeros, zeros.copy(), time, frequency, serial)
+
+def cachePath(directory, serial, frequency):
+    return os.path.join(directory, "dt5742_{}_{:.0f}MHz.npz".format(serial,
+        SAMPLING_FREQUENCIES[frequency]))
+
+# Tables for the board behind _dgt_ at _frequency_: from the cache if there,
+# otherwise read from the board and cached
+def get(dgt, frequency, directory = CACHE_PATH):
+    path = cachePath(directory, dgt.getInfo().SerialNumber, frequency)
+    if os.path.exists(path):
+        return load(path)
+    tables = fromBoard(dgt, frequency)
+    tables.save(path)
+    return tables
+
+# Raw samples and start cells of a block of events
+class Block():
+
+    def __init__(self, events, length, groups = GROUPS):
+        self.waves = np.zeros((events, groups, CHANNELS_PER_GROUP, length),
+            np.float32)
+        self.cells = np.zeros((events, groups), np.int64)
+        self.present = np.zeros((events, groups), bool)
+        self.counters = [0] * events
+        self.timeTags = [0] * events
+
+    def __len__(self):
+        return len(self.counters)
+
+    # Events _start_ to _stop_, sharing the arrays of this block
+    def slice(self, start, stop):
+        part = Block(0, 0)
+        part.waves = self.waves[start:stop]
+        part.cells = self.cells[start:stop]
+        part.present = self.present[start:stop]
+        part.counters = self.counters[start:stop]
+        part.timeTags = self.timeTags[start:stop]
+        return part
+
+    # Copy the decoded _event_ (a digitizer.Event) at _index_
+    def add(self, index, counter, timeTag, event):
+        self.counters[index] = counter
+        self.timeTags[index] = timeTag
+        length = self.waves.shape[-1]
+        for g in range(self.waves.shape[1]):
+            if event.GrPresent[g] != 1:
+                continue
+            group = event.DataGroup[g]
+            self.present[index, g] = True
+            self.cells[index, g] = group.StartIndexCell
+            for c in range(CHANNELS_PER_GROUP):
+                size = min(group.ChSize[c], length)
+                if size:
+                    self.waves[index, g, c, :size] = np.ctypeslib.as_array(
+                        group.DataChannel[c], (size,))
+
+# Corrects blocks, in a worker thread if asked to so that the readout goes
+# on meanwhile. Blocks come out in the order they went in.
+class Corrector():
+
+    def __init__(self, tables, worker = True, levels = ALL):
+        self.tables = tables
+        self.levels = levels
+        self.pool = ThreadPoolExecutor(1) if worker else None
+        self.pending = deque()
+
+    # Hand over _block_, returns the blocks that are done
+    def submit(self, block):
+        if self.pool is None:
+            return [self.tables.apply(block, self.levels)]
+
+        self.pending.append(self.pool.submit(self.tables.apply, block,
+            self.levels))
+        ready = []
+        while self.pending and self.pending[0].done():
+            ready.append(self.pending.popleft().result())
+        return ready
+
+    # Wait for every block handed over so far
+    def drain(self):
+        ready = [future.result() for future in self.pending]
+        self.pending.clear()
+        return ready
+
+    def close(self):
+        self.drain()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
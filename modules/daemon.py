@@ -0,0 +1,186 @@
+# Long lived DAQ process: owns the digitizer, stage and power supply and
+# takes run requests over a local UNIX socket, so that consecutive runs
+# skip the connection, reset and programming of every instrument.
+#
+# Requests and answers are one JSON object per line. The server streams the
+# run output back to the client and ends every answer with a line starting
+# with DONE_MARK followed by the JSON result.
+
+import contextlib, json, os, signal, socket, sys, time
+
+from .io import config
+
+SOCKET_PATH = "/tmp/ufsdpydaq.sock"
+DONE_MARK = "#DONE "
+BACKLOG = 1
+
+# Write to the daemon console and to the client at once. A client that went
+# away must not stop the run, its output is just dropped.
+class Tee():
+
+    def __init__(self, stream, connection):
+        self.stream = stream
+        self.connection = connection
+
+    def write(self, text):
+        self.stream.write(text)
+        if self.connection is not None:
+            try:
+                self.connection.sendall(text.encode())
+            except OSError:
+                self.connection = None
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+class Server():
+
+    # _factory_(config, interactive = False) builds the DAQ object, e.g.
+    # main.UFSDPyDAQ
+    def __init__(self, factory, path = SOCKET_PATH):
+        self.factory = factory
+        self.path = path
+        self.daq = None
+        self.running = False
+        self.runs = 0
+        self.last = None
+
+    def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen(BACKLOG)
+        signal.signal(signal.SIGTERM, self.terminate)
+        print("Waiting for runs on {}".format(self.path))
+
+        self.running = True
+        try:
+            while self.running:
+                connection, address = self.socket.accept()
+                with connection:
+                    self.handle(connection)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def terminate(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def handle(self, connection):
+        stream = connection.makefile("r")
+        try:
+            request = json.loads(stream.readline())
+        except ValueError:
+            self.answer(connection, {"ok": False, "error": "bad request"})
+            return
+
+        command = request.get("command")
+        if command == "run":
+            tee = Tee(sys.stdout, connection)
+            with contextlib.redirect_stdout(tee):
+                result = self.run(request.get("config"))
+            self.answer(tee.connection, result)
+        elif command == "status":
+            self.answer(connection, self.status())
+        elif command == "shutdown":
+            self.running = False
+            self.answer(connection, {"ok": True})
+        else:
+            self.answer(connection, {"ok": False,
+                "error": "unknown command '{}'".format(command)})
+
+    def answer(self, connection, result):
+        if connection is None:
+            return
+        try:
+            connection.sendall((DONE_MARK + json.dumps(result) + "\n").encode())
+        except OSError:
+            pass
+
+    def status(self):
+        return {"ok": True, "connected": self.daq is not None,
+            "runs": self.runs,
+            "last": self.last}
+
+    # One whole run without operator: HV is left on at the end, it is set
+    # again by the next run anyway
+    def run(self, path):
+        began = time.time()
+        result = {"ok": False, "config": path}
+        if not path or not os.path.isfile(path):
+            result["error"] = "no such config '{}'".format(path)
+            return result
+
+        try:
+            self.last = path
+            settings = config.Config(path)
+            if self.daq is None:
+                self.daq = self.factory(settings, interactive = False)
+            else:
+                self.daq.reconfigure(settings)
+
+            if self.daq.prepare():
+                self.daq.acquire()
+            self.daq.finish()
+            self.runs += 1
+            summaries = self.daq.summaries
+            result.update(ok = True, file = getattr(self.daq.file, "path",
+                None), points = len(summaries),
+                events = sum(s["events"] for s in summaries),
+                lost = sum(s["lost"] for s in summaries))
+        except (Exception, SystemExit) as error:
+            # The instruments may be in any state, start from scratch
+            result["error"] = repr(error)
+            self.drop()
+        result["seconds"] = time.time() - began
+        return result
+
+    # Forget the DAQ after a failure, closing what can still be closed
+    def drop(self):
+        daq, self.daq = self.daq, None
+        if daq is None:
+            return
+        with contextlib.suppress(Exception, SystemExit):
+            daq.file.close()
+        with contextlib.suppress(Exception, SystemExit):
+            daq.disconnect()
+
+    # Power down and close every instrument
+    def close(self):
+        if self.daq is not None:
+            with contextlib.suppress(Exception, SystemExit):
+                self.daq.disconnect()
+            self.daq = None
+
+    def shutdown(self):
+        self.close()
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        print("Daemon stopped")
+
+# Send one request to the daemon, print its output as it comes and return
+# the result
+def request(message, path = SOCKET_PATH):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        return {"ok": False, "error": "no daemon on {}".format(path)}
+
+    with client:
+        client.sendall((json.dumps(message) + "\n").encode())
+        for line in client.makefile("r"):
+            # The result may follow output that didn't end its line
+            output, mark, result = line.partition(DONE_MARK)
+            print(output, end = "\n" if mark and output else "", flush = True)
+            if mark:
+                return json.loads(result)
+    return {"ok": False, "error": "daemon closed the connection"}
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
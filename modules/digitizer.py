@@ -1,7 +1,9 @@
 # CAEN DT5742 control module, not all original API features supported.
 
 from ctypes import *
-import time
+import os, time
+
+from . import trace
 
 # ===================== PSEUDO STRUCTURES (C INHERITED) =======================
 
@@ -50,12 +52,52 @@ class EventInfo(Structure):
         ("EventCounter", c_uint32),
         ("TriggerTimeTag", c_uint32)]
 
+# DRS4 correction tables of one group, as stored in the board flash
+class DRS4Correction(Structure):
+    _fields_ = [
+        ("cell", (c_int16*1024)*9),
+        ("nsample", (c_int8*1024)*9),
+        ("time", c_float*1024)]
+
+# Settings read back into the shadow copy after connecting, the name is
+# the one of the CAEN_DGTZ_Get/Set functions
+SHADOW_SETTINGS = [("DRS4SamplingFrequency", c_long), ("RecordLength", c_uint32),
+    ("MaxNumEventsBLT", c_uint32), ("AcquisitionMode", c_long),
+    ("ExtTriggerInputMode", c_long), ("FastTriggerMode", c_long),
+    ("FastTriggerDigitizing", c_long), ("GroupEnableMask", c_uint32),
+    ("PostTriggerSize", c_uint32)]
+# Registers written directly by the DAQ
+SHADOW_REGISTERS = [0x811C]
+
+# Acquisition status register, its value once the board is ready and the
+# bit telling the event memory is full (triggers are being dropped)
+STATUS_REGISTER = 0x8104
+STATUS_READY = 0x180
+STATUS_FULL = 1 << 4
+# How long status() waits for the board to get ready, and how often it checks
+STATUS_TIMEOUT = 2 # s
+STATUS_POLL_INTERVAL = 0.01 # s
+
 SO_FILENAME = "libCAENDigitizer.so"
-API = CDLL("/usr/lib/" + SO_FILENAME)
+# Loaded by load() when the first Digitizer is created
+API = None
+
+# Load the CAEN library, or the simulated board (see sim/caen.py) if
+# UFSDPYDAQ_SIMULATE is set
+def load():
+    global API
+    if API is not None:
+        return
+    if os.environ.get("UFSDPYDAQ_SIMULATE"):
+        from .sim import caen
+        API = caen.SimulatedDigitizer()
+    else:
+        API = CDLL("/usr/lib/" + SO_FILENAME)
 
 class Digitizer:
 
     def __init__(self, number):
+        load()
         self.connected = False
         # This will keep track of the connection to our device
         self.handle = self.open(number)
@@ -82,6 +124,10 @@ class Digitizer:
         self.eventVoidPointer = cast(byref(self.eventObject),
             POINTER(c_void_p))
 
+        # Shadow copy of what has been programmed into the board, setters
+        # skip values that are already there. Filled by readBack().
+        self.shadow = {}
+
 # ============================= BOARD COMMUNICATION ===========================
     
     #TODO (#TOCHECK) #TODO2 add the device number in the config file 
@@ -109,9 +155,48 @@ class Digitizer:
     # Reset digitizer registers
     def reset(self):
         check(API.CAEN_DGTZ_Reset(self.handle))
+        self.readBack()
+
+    # True if the board already holds _value_ for setting _key_. Otherwise
+    # _value_ becomes the new shadow value, the caller is about to write it.
+    def cached(self, key, value):
+        if self.shadow.get(key) == value:
+            return True
+        self.shadow[key] = value
+        return False
+
+    # Read a setting through CAEN_DGTZ_Get<name>, None if that fails
+    def getSetting(self, name, ctype, *args):
+        value = ctype()
+        function = getattr(API, "CAEN_DGTZ_Get" + name)
+        if function(self.handle, *args, byref(value)) != 0:
+            return None
+        return value.value
+
+    # Fill the shadow copy with the settings currently in the board, so
+    # that programming only writes what's different
+    def readBack(self):
+        self.shadow.clear()
+        for name, ctype in SHADOW_SETTINGS:
+            self.shadow[name] = self.getSetting(name, ctype)
+        for group in range(2):
+            for name in ["TriggerPolarity", "GroupFastTriggerDCOffset",
+                "GroupFastTriggerThreshold"]:
+                self.shadow[(name, group)] = self.getSetting(name,
+                    c_long if name == "TriggerPolarity" else c_uint32,
+                    c_uint32(group))
+        for channel in range(16):
+            self.shadow[("ChannelDCOffset", channel)] = self.getSetting(
+                "ChannelDCOffset", c_uint32, c_uint32(channel))
+        for address in SHADOW_REGISTERS:
+            value = c_uint32()
+            self.readRegister(address, value)
+            self.shadow[("Register", address)] = value.value
 
     # Write bytes to register at offset (address)
     def writeRegister(self, address, data):
+        if self.cached(("Register", address), data):
+            return
         check(API.CAEN_DGTZ_WriteRegister(
             self.handle, c_uint32(address), c_uint32(data)))
 
@@ -124,6 +209,8 @@ class Digitizer:
     # Mode: 0 -> Software controlled
     # ...other modes
     def setAcquisitionMode(self, mode):
+        if self.cached("AcquisitionMode", mode):
+            return
         check(API.CAEN_DGTZ_SetAcquisitionMode(
             self.handle, c_long(mode)))
 
@@ -158,17 +245,27 @@ class Digitizer:
     # new data: binary transfer is fast while a full buffer means the digitizer
     # will discard events.
     def setMaxNumEventsBLT(self, setting):
+        if self.cached("MaxNumEventsBLT", setting):
+            return
         check(API.CAEN_DGTZ_SetMaxNumEventsBLT(
             self.handle, c_uint32(setting)))
 
-    # Wait - read - wait - read to clear registers and get digitizer's status.
-    # Funny but works.
-    def status(self):
-        time.sleep(0.3)
+    # Poll the acquisition status register until the board reports ready
+    # with the PLL locked (0x180), or until _timeout_ seconds have passed.
+    # Returns the last value read.
+    def status(self, timeout = STATUS_TIMEOUT):
+        deadline = time.time() + timeout
         status = c_uint32()
-        self.readRegister(0x8104, status)
-        time.sleep(0.2)
-        self.readRegister(0x8104, status)
+        while True:
+            self.readRegister(STATUS_REGISTER, status)
+            if status.value == STATUS_READY or time.time() > deadline:
+                return status.value
+            time.sleep(STATUS_POLL_INTERVAL)
+
+    # One read of the acquisition status register, see STATUS_FULL
+    def acquisitionStatus(self):
+        status = c_uint32()
+        self.readRegister(STATUS_REGISTER, status)
         return status.value
 
 # ============================== TR0 TRIGGER ==================================
@@ -178,6 +275,8 @@ class Digitizer:
     # Mode: 1 -> Acquisition only
     # ...other options
     def setFastTriggerMode(self, mode):
+        if self.cached("FastTriggerMode", mode):
+            return
         check(API.CAEN_DGTZ_SetFastTriggerMode(
             self.handle, c_long(mode)))
 
@@ -187,6 +286,8 @@ class Digitizer:
     # Setting: 0 -> DISABLED
     # Setting: 1 -> ENABLED
     def setFastTriggerDigitizing(self, setting):
+        if self.cached("FastTriggerDigitizing", setting):
+            return
         check(API.CAEN_DGTZ_SetFastTriggerDigitizing(
             self.handle, c_long(setting)))
 
@@ -200,10 +301,10 @@ class Digitizer:
         # the two groups. We only care about that one and that's what the
         # c_uint32(0) is for. 
         # MODIFIED, same offset on the second group, TR1 - c_uint32(1)
-        check(API.CAEN_DGTZ_SetGroupFastTriggerDCOffset(
-            self.handle, c_uint32(0), c_uint32(offset)))
-        check(API.CAEN_DGTZ_SetGroupFastTriggerDCOffset(
-            self.handle, c_uint32(1), c_uint32(offset)))
+        for group in range(2):
+            if not self.cached(("GroupFastTriggerDCOffset", group), offset):
+                check(API.CAEN_DGTZ_SetGroupFastTriggerDCOffset(
+                    self.handle, c_uint32(group), c_uint32(offset)))
 
 
     # Set TR0 trigger threshold, in ADC steps.
@@ -214,10 +315,11 @@ class Digitizer:
         # the two groups. We only care about that one and that's what the
         # c_uint32(0) is for. MODIFIED, set the same threshold also on the second
         # group of trigger, TR1 - c_uint32(1)
-        check(API.CAEN_DGTZ_SetGroupFastTriggerThreshold(
-            self.handle, c_uint32(0), c_uint32(threshold)))
-        check(API.CAEN_DGTZ_SetGroupFastTriggerThreshold(
-            self.handle, c_uint32(1), c_uint32(threshold)))
+        for group in range(2):
+            if not self.cached(("GroupFastTriggerThreshold", group),
+                threshold):
+                check(API.CAEN_DGTZ_SetGroupFastTriggerThreshold(
+                    self.handle, c_uint32(group), c_uint32(threshold)))
 
     # Set how many samples should be taken AFTER triggering, useful for
     # situations where triggering happens before the actual signal arrives.
@@ -226,12 +328,16 @@ class Digitizer:
     # _size_ is in percentage of the full acquisition window, thus it
     # goes from 0 to 100.
     def setPostTriggerSize(self, size):
+        if self.cached("PostTriggerSize", size):
+            return
         check(API.CAEN_DGTZ_SetPostTriggerSize(
             self.handle, c_uint32(size)))
 
     # Set how many samples should be taken for each event. Allowed values
     # are: 1024, 520, 256 and 136
     def setRecordLength(self, length):
+        if self.cached("RecordLength", length):
+            return
         check(API.CAEN_DGTZ_SetRecordLength(
             self.handle, c_uint32(length)))
 
@@ -243,6 +349,8 @@ class Digitizer:
     # Mode: 0 -> Disabled
     # Mode: 1 -> Acquisition only
     def setExtTriggerInputMode(self, mode):
+        if self.cached("ExtTriggerInputMode", mode):
+            return
         check(API.CAEN_DGTZ_SetExtTriggerInputMode(
             self.handle, c_long(mode)))
 
@@ -251,6 +359,8 @@ class Digitizer:
     # Polarity: 0 -> Rising edge
     # Polarity: 1 -> Falling edge
     def setGroupTriggerPolarity(self, group, polarity):
+        if self.cached(("TriggerPolarity", group), polarity):
+            return
         check(API.CAEN_DGTZ_SetTriggerPolarity(
             self.handle, c_uint32(group), c_long(polarity)));
 
@@ -265,6 +375,8 @@ class Digitizer:
     # Frequency: 0 -> 5 GHz
     # ...other frequencies
     def setSamplingFrequency(self, frequency):
+        if self.cached("DRS4SamplingFrequency", frequency):
+            return
         check(API.CAEN_DGTZ_SetDRS4SamplingFrequency(
             self.handle, c_long(frequency)))
 
@@ -275,6 +387,8 @@ class Digitizer:
     # If our model had 4 groups we could've used 0b1111 or 0xF to enable all
     # of them. THERE IS NO WAY TO ENABLE OR DISABLE SINGLE CHANNELS SELECTIVELY.
     def setGroupEnableMask(self, mask):
+        if self.cached("GroupEnableMask", mask):
+            return
         check(API.CAEN_DGTZ_SetGroupEnableMask(
             self.handle, c_uint32(mask)))
 
@@ -284,6 +398,8 @@ class Digitizer:
     # It might be useful to set this to half the max value for signals that
     # span both polarities.
     def setChannelDCOffset(self, channel, offset):
+        if self.cached(("ChannelDCOffset", channel), offset):
+            return
         check(API.CAEN_DGTZ_SetChannelDCOffset(
             self.handle, c_uint32(channel), c_uint32(offset)))
 
@@ -304,10 +420,12 @@ class Digitizer:
 
     # Start an event block transfer and put all data in eventBuffer.
     # eventBufferSize will contain the length of the event.
+    @trace.traced("digitizer.readData")
     def readData(self):
         check(API.CAEN_DGTZ_ReadData(
             self.handle, c_long(0), self.eventBuffer,
             byref(self.eventBufferSize)))
+        trace.count(bytes = self.eventBufferSize.value)
 
     # Get the number of EVENTS contained in the last block transfer initiated,
     # and therefore in eventBuffer.
@@ -339,6 +457,7 @@ class Digitizer:
 
     # Get event data without having to call getEventInfo first. If event
     # info is to be returned as well, pass wantInfo = True.
+    @trace.traced("digitizer.getEvent")
     def getEvent(self, index, wantInfo = False):
         info = self.getEventInfo(index)
         event = self.decodeEvent()
@@ -349,17 +468,40 @@ class Digitizer:
 
     # Load correction tables from digitizer's memory at right frequency.
     def loadCorrectionData(self, frequency):
+        if self.cached("CorrectionData", frequency):
+            return
         check(API.CAEN_DGTZ_LoadDRS4CorrectionData(
             self.handle, c_long(frequency)))
 
+    # Read the correction tables for _frequency_ out of the board flash, one
+    # DRS4Correction for each of the (up to) four groups
+    def getCorrectionTables(self, frequency):
+        tables = (DRS4Correction*4)()
+        check(API.CAEN_DGTZ_GetCorrectionTables(
+            self.handle, c_int(frequency), byref(tables)))
+        return tables
+
     # Enable raw data correction using tables loaded with loadCorrectionData.
     # This corrects for slight differences in ADC capacitors' values and
     # different latency between the two groups' circutry. Refer to manual for
     # more.
     def enableCorrection(self):
+        if self.cached("Correction", True):
+            return
         check(API.CAEN_DGTZ_EnableDRS4Correction(
             self.handle))
 
+    # Hand out raw samples again
+    def disableCorrection(self):
+        if self.cached("Correction", False):
+            return
+        check(API.CAEN_DGTZ_DisableDRS4Correction(
+            self.handle))
+
+    # Throw away any event still in the board's memory
+    def clearData(self):
+        check(API.CAEN_DGTZ_ClearData(self.handle))
+
 # ======================== UTIL FUNCTIONS =====================================
 
 # Simply check that the API function returned 0L
@@ -411,10 +553,24 @@ def __init__():
         API.CAEN_DGTZ_GetEventInfo,
         API.CAEN_DGTZ_DecodeEvent,
         API.CAEN_DGTZ_LoadDRS4CorrectionData,
-        API.CAEN_DGTZ_EnableDRS4Correction)
+        API.CAEN_DGTZ_EnableDRS4Correction,
+        API.CAEN_DGTZ_DisableDRS4Correction,
+        API.CAEN_DGTZ_GetCorrectionTables,
+        API.CAEN_DGTZ_ClearData,
+#
+        API.CAEN_DGTZ_GetDRS4SamplingFrequency,
+        API.CAEN_DGTZ_GetRecordLength,
+        API.CAEN_DGTZ_GetMaxNumEventsBLT,
+        API.CAEN_DGTZ_GetAcquisitionMode,
+        API.CAEN_DGTZ_GetExtTriggerInputMode,
+        API.CAEN_DGTZ_GetFastTriggerMode,
+        API.CAEN_DGTZ_GetFastTriggerDigitizing,
+        API.CAEN_DGTZ_GetGroupEnableMask,
+        API.CAEN_DGTZ_GetPostTriggerSize,
+        API.CAEN_DGTZ_GetTriggerPolarity,
+        API.CAEN_DGTZ_GetGroupFastTriggerDCOffset,
+        API.CAEN_DGTZ_GetGroupFastTriggerThreshold)
 
 if __name__ == "__main__":
     print("I'm a module, please don't run me alone.")
     exit()
-else:
-    print("[Digitizer ok] ", end = "")
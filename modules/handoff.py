@@ -0,0 +1,167 @@
+# Handoff of finished output files to the analysis: every file the DAQ is
+# done with (end of run, or a part ROOT closed when the tree outgrew it) is
+# appended to a queue, one JSON line with its path, size, checksum, the hash
+# of the config it was taken with and its points and events.
+#
+# Lines are appended with a single write on a locked file opened in append
+# mode and synced, so a reader never sees half of one and none is lost if
+# the DAQ dies afterwards. Watcher follows the queue and runs the configured
+# commands on every new file, several files at a time, while the DAQ goes
+# on with the next run.
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime, fcntl, functools, hashlib, json, os, subprocess, time
+
+QUEUE_PATH = "log/ready_to_be_analyzed.log"
+# Files already handed to the commands, next to the queue
+DONE_SUFFIX = ".done"
+# Read size while checksumming
+CHECKSUM_BLOCK = 1 << 24 # B
+# How often the watcher looks for new lines
+POLL_INTERVAL = 2 # s
+# Status of a file whose processing raised instead of running the commands
+ERROR_STATUS = -2
+
+def checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_BLOCK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Hash of every setting of a io.config.Config, equal configs give equal
+# hashes whatever file they came from
+def configHash(config):
+    sections = {"acq": config.acq, "dgt": config.dgt, "hv": config.hv,
+        "stage": config.stage}
+    text = json.dumps(sections, sort_keys = True, default = str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+# Queue entry for the file at _path_
+def record(path, config, points, events, final = True):
+    path = os.path.abspath(path)
+    return {"path": path, "size": os.path.getsize(path),
+        "checksum": checksum(path), "config": configHash(config),
+        "points": points, "events": events, "final": final,
+        "time": datetime.datetime.now().isoformat()}
+
+# Append _entry_ to the queue at _path_ as one line
+def append(entry, path = QUEUE_PATH):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    line = (json.dumps(entry, sort_keys = True) + "\n").encode()
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        os.write(descriptor, line)
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+# Complete lines of the queue at _path_ from byte _offset_ on, as (entry,
+# offset of the next line)
+def read(path, offset = 0):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            # A line still being written has no newline yet
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            if line.strip():
+                yield json.loads(line), offset
+
+# Runs _commands_ on every file of the queue at _path_ that wasn't already.
+# Commands are formatted with the fields of the entry ({path}, {size},
+# {checksum}, {config}, {points}, {events}) and {name}, {directory}; those
+# of one file run in order, up to _jobs_ files at once.
+class Watcher():
+
+    def __init__(self, commands, jobs = 1, path = QUEUE_PATH):
+        self.commands = commands
+        self.path = path
+        self.pool = ThreadPoolExecutor(jobs)
+        self.offset = 0
+        self.done = set()
+        for entry, offset in read(path + DONE_SUFFIX):
+            self.done.add((entry["path"], entry["checksum"]))
+        self.pending = set()
+
+    # Hand every new entry to the pool, returns their futures
+    def dispatch(self):
+        futures = []
+        for entry, offset in read(self.path, self.offset):
+            self.offset = offset
+            key = (entry["path"], entry["checksum"])
+            if key in self.done or key in self.pending:
+                continue
+            self.pending.add(key)
+            future = self.pool.submit(self.process, entry)
+            future.add_done_callback(functools.partial(self.check, entry))
+            futures.append(future)
+        return futures
+
+    # Nobody waits for the futures while following the queue: a process()
+    # that raised is reported here and its file marked as done with
+    # ERROR_STATUS, instead of staying pending forever
+    def check(self, entry, future):
+        error = future.exception()
+        if error is None:
+            return
+        print("Processing {} failed: {!r}".format(entry["path"], error))
+        try:
+            self.markDone(entry, ERROR_STATUS, repr(error))
+        except OSError as e:
+            print("Couldn't mark {} as done: {}".format(entry["path"], e))
+            self.pending.discard((entry["path"], entry["checksum"]))
+
+    def process(self, entry):
+        fields = dict(entry, name = os.path.splitext(
+            os.path.basename(entry["path"]))[0],
+            directory = os.path.dirname(entry["path"]))
+        status = 0
+        if not os.path.exists(entry["path"]) or \
+            os.path.getsize(entry["path"]) != entry["size"]:
+            print("{} is gone or changed since it was queued, skipped".format(
+                entry["path"]))
+            status = -1
+        for command in self.commands if status == 0 else []:
+            command = command.format(**fields)
+            print("Running {}".format(command))
+            status = subprocess.call(command, shell = True)
+            if status != 0:
+                print("{} failed ({})".format(command, status))
+                break
+        self.markDone(entry, status)
+        return status
+
+    # Record _entry_ as handled with _status_, and _error_ if it raised
+    def markDone(self, entry, status, error = None):
+        line = {"path": entry["path"], "checksum": entry["checksum"],
+            "status": status, "time": datetime.datetime.now().isoformat()}
+        if error is not None:
+            line["error"] = error
+        append(line, self.path + DONE_SUFFIX)
+        key = (entry["path"], entry["checksum"])
+        self.pending.discard(key)
+        self.done.add(key)
+
+    # Follow the queue until interrupted, or only until what's already in
+    # it is done if _once_
+    def run(self, once = False):
+        try:
+            while True:
+                futures = self.dispatch()
+                if once:
+                    return [ERROR_STATUS if future.exception() is not None
+                        else future.result() for future in futures]
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.pool.shutdown(wait = True)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
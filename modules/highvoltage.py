@@ -1,7 +1,8 @@
 # CAEN DT1471ET control module, not all original features supported.
 
-import pyvisa as pv
-import time
+import os, threading, time
+
+from . import trace
 
 # Tolerance for voltage target, setting function will return once
 # the difference between set voltage and actual output is less than this
@@ -10,16 +11,40 @@ VOLTAGE_TOLERANCE = 2 # Volt
 # Delay between commands sent to device, increase as needed
 TIME_DELAY = 1 # s
 
+# pyvisa, loaded by load() when the first HighVoltage is created
+pv = None
+
+# Import pyvisa, or the simulated power supply (see sim/visa.py) if
+# UFSDPYDAQ_SIMULATE is set. The simulated power supply also brings its own
+# (possibly virtual) clock.
+def load():
+    global pv, time
+    if pv is not None:
+        return
+    if os.environ.get("UFSDPYDAQ_SIMULATE"):
+        from .sim import visa as pv
+        from .sim import clock as time
+    else:
+        import pyvisa as pv
+
 class HighVoltage():
 
-    def __init__(self, board, resource = None):
+    # Without an operator (_interactive_ False) a missing _resource_ or a
+    # power supply in LOCAL control is an error instead of a question
+    def __init__(self, board, resource = None, interactive = True):
+        load()
         self.board = board
         self.connected = False
         self.rm = pv.ResourceManager("@py")
+        # Queries also come from the live monitor thread, one at a time
+        self.lock = threading.Lock()
 
         # If no VISA resource is specified when instantiating the class
         # ask the user directly!
         if resource == None:
+            if not interactive:
+                raise ValueError("No power supply RESOURCE given and nobody "
+                    "to choose one")
             resource = self.promptResource()
         # Otherwise use it...
         else:
@@ -38,6 +63,9 @@ class HighVoltage():
         while True:
             status = self.getQuery("BDCTR")
             if "REMOTE" not in status:
+                if not interactive:
+                    raise RuntimeError("Power supply is not in REMOTE "
+                        "control")
                 input("Please set power supply to REMOTE control and \
                     press enter...")
             else:
@@ -57,7 +85,8 @@ class HighVoltage():
             cmd = "$BD:{},CMD:SET,CH:{},PAR:{},VAL:{}".format(self.board,
                 channel, param, value)
 
-        check(self.handle.query(cmd))
+        with self.lock:
+            check(self.handle.query(cmd))
 
     # General method to sent a GET query to the power supply
     def getQuery(self, param, channel = None):
@@ -69,7 +98,8 @@ class HighVoltage():
             cmd = "$BD:{},CMD:MON,CH:{},PAR:{}".format(self.board,
                 channel, param)
 
-        out = self.handle.query(cmd)
+        with self.lock:
+            out = self.handle.query(cmd)
         # Clean up the returned string and extract the value
         # we're interested in...
         if check(out):
@@ -91,6 +121,7 @@ class HighVoltage():
     # Set output voltage for _channel_. If _confirm_ is set to True
     # then wait until the actual output voltage is at most VOLTAGE_TOLERANCE
     # away from the set value before returning.
+    @trace.traced("highvoltage.setVoltage")
     def setVoltage(self, channel, value, confirm = True):
         self.setQuery("VSET", channel, value)
         if confirm:
@@ -170,5 +201,3 @@ def check(msg):
 if __name__ == "__main__":
     print("I'm a module, please don't run me alone.")
     exit()
-else:
-    print("[High voltage ok] ", end = "")
@@ -0,0 +1,143 @@
+# Amplitude and time of arrival histograms of every channel, filled a
+# readout block at a time with bincount, for every bias and optionally every
+# point. Fixed binning keeps them small: bias scans get their gain curves
+# without going through the waveforms again.
+#
+# The first and last bin of every histogram count underflows and overflows.
+
+import os
+
+import numpy as np
+
+from . import maps, observables
+
+# Amplitude binning, ADC counts
+AMPLITUDE_BINS = 512
+AMPLITUDE_RANGE = (0, 2048)
+# Time of arrival against the digitized trigger, ns
+TIME_BINS = 1000
+TIME_RANGE = (-50, 50)
+# Only hits over this amplitude are timed, ADC counts
+THRESHOLD = 20
+
+# Bin of each value, 0 and bins + 1 for underflows and overflows
+def binIndex(values, bins, low, high):
+    index = np.floor((values - low) * (bins / (high - low))).astype(np.int64)
+    return np.clip(index + 1, 0, bins + 1)
+
+# Edges of the in range bins
+def edges(bins, low, high):
+    return np.linspace(low, high, bins + 1)
+
+class Histograms():
+
+    # _channels_ channels, 8 per digitized trigger, sampled every _period_
+    # ns, pulses of sign _polarity_. Histograms of every point are written
+    # to _pointDirectory_ if given.
+    def __init__(self, channels, period, polarity = -1, threshold = THRESHOLD,
+        pointDirectory = None):
+        self.channels = channels
+        self.period = period
+        self.polarity = polarity
+        self.threshold = threshold
+        self.pointDirectory = pointDirectory
+        self.points = 0
+        # Totals of every bias, and the point in progress
+        self.biases = {}
+        self.bias = 0
+        self.start()
+
+    def empty(self):
+        return (np.zeros((self.channels, AMPLITUDE_BINS + 2), np.int64),
+            np.zeros((self.channels, TIME_BINS + 2), np.int64))
+
+    def setBias(self, bias):
+        self.bias = bias
+
+    # Forget the point in progress
+    def start(self):
+        self.point = self.empty()
+
+    # _waves_ (events, channels, samples), _triggers_ (events, groups,
+    # samples), _present_ (events, groups) tells which groups were read
+    def add(self, waves, triggers, present):
+        events, channels, samples = waves.shape
+        if not events:
+            return
+        amplitudes = observables.amplitudes(
+            waves.reshape(-1, samples), self.polarity).reshape(events, -1)
+        read = np.repeat(present, 8, axis = 1)[:, :channels]
+        rows, columns = np.nonzero(read)
+        index = columns * (AMPLITUDE_BINS + 2) + binIndex(
+            amplitudes[rows, columns], AMPLITUDE_BINS, *AMPLITUDE_RANGE)
+        amplitude = np.bincount(index, minlength = self.channels *
+            (AMPLITUDE_BINS + 2)).reshape(self.channels, -1)
+
+        rows, columns, delays = maps.hitTimes(waves, triggers,
+            (amplitudes > self.threshold) & read, self.polarity, self.period)
+        index = columns * (TIME_BINS + 2) + binIndex(delays, TIME_BINS,
+            *TIME_RANGE)
+        time = np.bincount(index, minlength = self.channels *
+            (TIME_BINS + 2)).reshape(self.channels, -1)
+
+        self.point[0][...] += amplitude
+        self.point[1][...] += time
+        totals = self.biases.setdefault(self.bias, self.empty())
+        totals[0][...] += amplitude
+        totals[1][...] += time
+
+    # Every event of a calibration.Block
+    def addBlock(self, block):
+        events, groups, channels, samples = block.waves.shape
+        self.add(block.waves[:, :, :8].reshape(events, groups * 8, samples),
+            block.waves[:, :, 8], block.present)
+
+    # Events merged from several boards, as returned by readout.Boards.poll
+    def addEvents(self, events, channelsPerBoard, groupsPerBoard):
+        if events:
+            self.add(*maps.eventArrays(events, channelsPerBoard,
+                groupsPerBoard))
+
+    # Close the point in progress, taken at (_x_, _y_). Its histograms are
+    # written out and forgotten, only the totals stay in memory.
+    def endPoint(self, x, y):
+        if self.pointDirectory is not None:
+            if not os.path.exists(self.pointDirectory):
+                os.makedirs(self.pointDirectory)
+            path = os.path.join(self.pointDirectory,
+                "point_{:05d}.npz".format(self.points))
+            np.savez_compressed(path, x = x, y = y, bias = self.bias,
+                amplitude = self.point[0], time = self.point[1],
+                amplitudeEdges = edges(AMPLITUDE_BINS, *AMPLITUDE_RANGE),
+                timeEdges = edges(TIME_BINS, *TIME_RANGE))
+        self.points += 1
+        self.start()
+
+    # Totals of every bias, (biases, channels, bins + 2) arrays
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        biases = sorted(self.biases)
+        empty = self.empty()
+        amplitude = np.array([self.biases[b][0] for b in biases]).reshape(
+            (-1,) + empty[0].shape)
+        time = np.array([self.biases[b][1] for b in biases]).reshape(
+            (-1,) + empty[1].shape)
+        temporary = path + ".tmp.npz"
+        np.savez_compressed(temporary, bias = np.array(biases, float),
+            amplitude = amplitude, time = time,
+            amplitudeEdges = edges(AMPLITUDE_BINS, *AMPLITUDE_RANGE),
+            timeEdges = edges(TIME_BINS, *TIME_RANGE))
+        os.replace(temporary, path)
+
+def outputPath(directory, name):
+    return os.path.join(directory, "{}_histograms.npz".format(name))
+
+# Where the histograms of every point go
+def pointDirectory(directory, name):
+    return os.path.join(directory, "{}_histograms".format(name))
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -1,7 +1,5 @@
-from . import config, tree
+from . import config, tree, wavedump
 
 if __name__ == "__main__":
     print("I'm a module, please don't run me alone.")
     exit()
-else:
-    print("[IO ok] ", end = "")
@@ -1,6 +1,9 @@
 import configparser, os
 
 SAMPLING_FREQUENCIES = [5E3, 2.5E3, 1E3, 750] # MHz
+# Channels of one DT5742, in groups of 8
+BOARD_CHANNELS = 16
+GROUP_CHANNELS = 8
 
 class Config():
 
@@ -20,6 +23,17 @@ class Config():
             if len(self.acq["X_LIST"]) != len(self.acq["Y_LIST"]):
                 print("Lists have to be the same length... Exiting")
                 exit()
+
+            # Only channels asked for explicitly can conflict with the mask
+            disabled = [c for c in self.requestedChannels
+                if c not in self.channels]
+            if disabled:
+                print("Channels {} are not in an enabled group... Exiting"
+                    .format(disabled))
+                exit()
+            if not self.channels:
+                print("No channel is enabled... Exiting")
+                exit()
         else:
             self.loadDefaults()
 
@@ -96,6 +110,52 @@ class Config():
         return list(zip(self.acq["X_LIST"],
             self.acq["Y_LIST"]))
 
+    # Every (x, y) point of the scan, in acquisition order
+    def getScanPoints(self):
+        (xStart, xStep, xStop,
+            yStart, yStep, yStop) = self.getGrid(inclusive = True)
+
+        mode = self.mode
+        # Single point
+        if mode == 0:
+            return [(xStart, yStart)]
+        # Grid acquisition
+        elif mode == 1:
+            points = []
+            for i, x in enumerate(range(xStart, xStop, xStep)):
+                column = range(yStart, yStop, yStep)
+                if self.scanOrder == "SERPENTINE" and i % 2:
+                    column = reversed(column)
+                points.extend((x, y) for y in column)
+            return points
+        # Diagonal acquisition
+        elif mode == 2:
+            xRatioEnd = xStop - xStep
+            yRatioEnd = yStop - yStep
+            aspectRatio = (yRatioEnd - yStart) / (xRatioEnd - xStart)
+
+            return [(x, yStart + ((x - xStart) * aspectRatio))
+                for x in range(xStart, xStop, xStep)]
+        elif mode == 3:
+            return self.getPoints()
+        # Refined grid, only the coarse points are known beforehand
+        elif mode == 4:
+            xStop, yStop = xStop - xStep, yStop - yStep
+            size = self.coarseFactor
+            columns = sorted(set(list(range(xStart, xStop, xStep * size)) +
+                [xStart + (xStop - xStart) // xStep * xStep]))
+            rows = sorted(set(list(range(yStart, yStop, yStep * size)) +
+                [yStart + (yStop - yStart) // yStep * yStep]))
+            points = []
+            for i, x in enumerate(columns):
+                points.extend((x, y) for y in (reversed(rows) if i % 2
+                    else rows))
+            return points
+        # Continuous line, from start to end without stopping
+        elif mode == 5:
+            return [(xStart, yStart), (xStop - xStep, yStop - yStep)]
+        return []
+
     @property
     def outputPath(self):
         return self.acq["DATA_PATH"]
@@ -108,13 +168,88 @@ class Config():
     def eventsPerPoint(self):
         return self.acq["MAX_EVENTS"]
 
+    # Stop each point as soon as the online estimate of the observable is
+    # known to PRECISION (relative), with MIN_EVENTS to MAX_EVENTS events
+    def isAdaptive(self):
+        return self.acq.get("ADAPTIVE", False)
+
+    @property
+    def minEvents(self):
+        return self.acq.get("MIN_EVENTS", 100)
+
+    @property
+    def precision(self):
+        return float(self.acq.get("PRECISION", 0.05))
+
+    # AMPLITUDE (mean amplitude) or TIMING (time resolution against TR0)
+    @property
+    def observable(self):
+        return self.acq.get("OBSERVABLE", "AMPLITUDE")
+
+    @property
+    def observableChannel(self):
+        return self.acq.get("OBSERVABLE_CHANNEL", 0)
+
+    @property
+    def signalPolarity(self):
+        return 1 if self.acq.get("SIGNAL_POLARITY", "NEGATIVE") == \
+            "POSITIVE" else -1
+
     @property
     def mode(self):
         return self.acq["MODE"]
 
+    # REFINE mode: coarse grid every COARSE_FACTOR steps, cells are split
+    # down to X_STEP, Y_STEP where the observable changes by more than
+    # REFINE_THRESHOLD of its range, REFINE_MIN_CHANGE (in its own units) and
+    # its uncertainty, within TIME_BUDGET seconds (0 for none)
+    def isRefined(self):
+        return self.mode == MODE_PARAM["REFINE"]
+
+    # LINE mode: the stage moves from (X_START, Y_START) to (X_END, Y_END)
+    # while acquiring up to MAX_EVENTS, events are binned every X_STEP um
+    # along the line
+    def isLine(self):
+        return self.mode == MODE_PARAM["LINE"]
+
+    @property
+    def coarseFactor(self):
+        return self.acq.get("COARSE_FACTOR", 8)
+
+    @property
+    def refineThreshold(self):
+        return float(self.acq.get("REFINE_THRESHOLD", 0.1))
+
+    # Smallest change of the observable worth a split, ADC counts for the
+    # amplitude and ns for the timing
+    @property
+    def refineMinChange(self):
+        return float(self.acq.get("REFINE_MIN_CHANGE", 0))
+
+    @property
+    def timeBudget(self):
+        return self.acq.get("TIME_BUDGET", 0)
+
+    # RASTER goes back to Y_START on every column, SERPENTINE alternates
+    # the direction of the inner loop to save stage travel
+    @property
+    def scanOrder(self):
+        return self.acq.get("SCAN_ORDER", "RASTER")
+
     @property
     def digitizerID(self):
-        return self.dgt["DEVICE_ID"]
+        return self.digitizerIDs[0]
+
+    # One or more boards, DEVICE_ID = [2, 3] reads out two DT5742s
+    @property
+    def digitizerIDs(self):
+        ids = self.dgt["DEVICE_ID"]
+        if not isinstance(ids, list):
+            ids = [ids]
+        return ids
+
+    def isMultiBoard(self):
+        return len(self.digitizerIDs) > 1
 
     @property
     def frequency(self):
@@ -132,13 +267,173 @@ class Config():
     def triggerThreshold(self):
         return self.dgt["TRIGGER_THRESHOLD"]
 
+    # Time the readout pipeline and write a Chrome trace at the end of the run
+    def isTraceEnabled(self):
+        return self.acq.get("TRACE", False)
+
+    # Publish every readout block to a shared memory ring for online
+    # consumers, see ring.py. Multi-board readout is not published.
+    def isSharedMemoryEnabled(self):
+        return self.acq.get("SHARED_MEMORY", False) and \
+            not self.isMultiBoard()
+
+    @property
+    def sharedMemoryName(self):
+        return self.acq.get("SHARED_MEMORY_NAME", "ufsdpydaq")
+
+    @property
+    def sharedMemorySlots(self):
+        return self.acq.get("SHARED_MEMORY_SLOTS", 8)
+
+    # Save every raw block for replay (replay.py), raw samples are only read
+    # with SOFTWARE_CORRECTION
+    def isRawDumpEnabled(self):
+        return self.acq.get("RAW_DUMP", False) and \
+            self.isSoftwareCorrectionEnabled()
+
+    # Append every finished output file to the HANDOFF_PATH queue for the
+    # analysis, see modules/handoff.py
+    def isHandoffEnabled(self):
+        return self.acq.get("HANDOFF", True)
+
+    @property
+    def handoffPath(self):
+        return self.acq.get("HANDOFF_PATH", "log/ready_to_be_analyzed.log")
+
+    # Keep per point amplitude, efficiency and timing maps of every channel
+    # and write them next to the run, events over MAPS_THRESHOLD ADC counts
+    # are hits
+    def isMapsEnabled(self):
+        return self.acq.get("MAPS", False)
+
+    @property
+    def mapsThreshold(self):
+        return self.acq.get("MAPS_THRESHOLD", 20)
+
+    # Fill amplitude and time of arrival histograms of every channel for each
+    # bias, and each point if HISTOGRAMS_PER_POINT. Only events over
+    # HISTOGRAM_THRESHOLD ADC counts are timed.
+    def isHistogramsEnabled(self):
+        return self.acq.get("HISTOGRAMS", False)
+
+    def isHistogramPerPoint(self):
+        return self.acq.get("HISTOGRAMS_PER_POINT", False)
+
+    @property
+    def histogramThreshold(self):
+        return self.acq.get("HISTOGRAM_THRESHOLD", 20)
+
+    # Serve live monitoring pages on http://localhost:MONITOR_PORT
+    def isMonitorEnabled(self):
+        return self.acq.get("MONITOR", False)
+
+    @property
+    def monitorPort(self):
+        return self.acq.get("MONITOR_PORT", 8080)
+
+    # Reset the board on connection instead of only reprogramming the
+    # settings that changed
+    def isResetEnabled(self):
+        return self.dgt.get("RESET", False)
+
     def isCorrectionEnabled(self):
         return self.dgt["USE_INTERNAL_CORRECTION"]
 
+    # Read raw samples and correct them on the host, see calibration.py. The
+    # boards of a multi-board setup are read out raw by their own processes,
+    # which only know the library correction.
+    def isSoftwareCorrectionEnabled(self):
+        return self.dgt.get("SOFTWARE_CORRECTION", False) and \
+            not self.isMultiBoard()
+
+    # Correct in a worker thread while the next block is read out
+    def isCorrectionWorkerEnabled(self):
+        return self.dgt.get("CORRECTION_WORKER", True)
+
+    # Take the cell offsets from the pedestal run of the board (main.py
+    # --pedestal) in CALIBRATION_PATH instead of the board tables
+    def isPedestalCorrectionEnabled(self):
+        return self.dgt.get("PEDESTAL_CORRECTION", False)
+
+    # Directory where correction tables are cached
+    @property
+    def calibrationPath(self):
+        return self.dgt.get("CALIBRATION_PATH", "calibration")
+
+    # Events per block transfer, 1 to 1023. The readout buffer is sized for
+    # it, the readout tuning never goes above.
+    @property
+    def bltSize(self):
+        return min(max(self.dgt.get("BLT_SIZE", 1023), 1), 1023)
+
+    # Pause before every readout, in s
+    @property
+    def pollInterval(self):
+        return float(self.dgt.get("POLL_INTERVAL", 0))
+
+    # Choose BLT size and poll interval point after point from the trigger
+    # rate and the full memory episodes, see tuning.ReadoutTuner
+    def isReadoutTuningEnabled(self):
+        return self.dgt.get("READOUT_TUNING", False)
+
     @property
     def postTriggerDelay(self):
         return self.dgt["POST_TRIGGER_DELAY"]
 
+    # GROUP_ENABLE_MASK as given, None if not
+    @property
+    def requestedMask(self):
+        mask = self.dgt.get("GROUP_ENABLE_MASK")
+        return int(mask, 0) if isinstance(mask, str) else mask
+
+    # Groups read out, bit 0 for channels 0-7 and bit 1 for 8-15: the
+    # groups of CHANNELS, within GROUP_ENABLE_MASK if given. A group with no
+    # channel to write is never transferred.
+    @property
+    def groupMask(self):
+        used = sum({1 << (c // GROUP_CHANNELS)
+            for c in self.requestedChannels})
+        mask = self.requestedMask
+        return used if mask is None else used & mask
+
+    # Groups read out, in order
+    @property
+    def groups(self):
+        return [g for g in range(BOARD_CHANNELS // GROUP_CHANNELS)
+            if self.groupMask & (1 << g)]
+
+    # Channels of each board written to file: CHANNELS, or every channel of
+    # the enabled groups. Channels of disabled groups are never there.
+    @property
+    def channels(self):
+        return sorted(c for c in set(self.requestedChannels)
+            if c // GROUP_CHANNELS in self.groups)
+
+    # CHANNELS as given, every channel of GROUP_ENABLE_MASK if not, every
+    # channel without either
+    @property
+    def requestedChannels(self):
+        channels = self.dgt.get("CHANNELS")
+        if channels is None:
+            mask = self.requestedMask
+            return [c for c in range(BOARD_CHANNELS)
+                if mask is None or mask & (1 << (c // GROUP_CHANNELS))]
+        if not isinstance(channels, list):
+            channels = [channels]
+        return channels
+
+    # Channels of every group read out, as (group, channels in the group)
+    @property
+    def layout(self):
+        return [(g, [c % GROUP_CHANNELS for c in self.channels
+            if c // GROUP_CHANNELS == g]) for g in self.groups]
+
+    # Channels written to file for every board, numbered like the branches
+    @property
+    def usedChannels(self):
+        return [board * BOARD_CHANNELS + c
+            for board in range(len(self.digitizerIDs)) for c in self.channels]
+
     @property
     def eventSize(self):
         return self.dgt["EVENT_LENGTH"]
@@ -155,6 +450,12 @@ class Config():
     def hvID(self):
         return self.hv["DEVICE_ID"]
 
+    # Index of the VISA resource of the power supply, if None the user is
+    # asked to pick one at connection
+    @property
+    def hvResource(self):
+        return self.hv.get("RESOURCE", None)
+
     @property
     def rampDownRate(self):
         return self.hv["RAMP_DOWN_RATE"]
@@ -198,7 +499,8 @@ class Config():
         return not self.stage["MANUAL"]
 
 BOOLEAN_PARAM = {"YES": True, "NO": False}
-MODE_PARAM = {"SINGLE": 0, "GRID": 1, "DIAG": 2, "LIST": 3}
+MODE_PARAM = {"SINGLE": 0, "GRID": 1, "DIAG": 2, "LIST": 3, "REFINE": 4,
+    "LINE": 5}
 KEYS_ARRAY = ["SENSOR_BIAS", "X_LIST", "Y_LIST"]
 
 def load(path):
@@ -210,23 +512,27 @@ def load(path):
         # Print params and make them machine-usable
         config = {}
         for k, param in parser[key].items():
-            if k in KEYS_ARRAY:
-                config[k] = [int(i) for i in param[1:-1].split(",")]
-            elif param in BOOLEAN_PARAM.keys():
-                config[k] = BOOLEAN_PARAM[param]
-            elif param in MODE_PARAM.keys():
-                config[k] = MODE_PARAM[param]
-            else:
-                try:
-                    config[k] = int(param)
-                except:
-                    config[k] = str(param)
+            config[k] = parseValue(k, param)
 
         return config
 
     config = {key: parse(key) for key in parser.sections()}
     return config
 
+# Turn the string _param_ found at _key_ into a list, boolean, mode or number
+def parseValue(key, param):
+    if key in KEYS_ARRAY or param.startswith("["):
+        return [int(i) for i in param[1:-1].split(",")]
+    elif param in BOOLEAN_PARAM.keys():
+        return BOOLEAN_PARAM[param]
+    elif param in MODE_PARAM.keys():
+        return MODE_PARAM[param]
+    else:
+        try:
+            return int(param)
+        except:
+            return str(param)
+
 if __name__ == "__main__":
     print("I'm a module, please don't run me alone.")
     exit()
@@ -1,20 +1,54 @@
-import ROOT as rt
 from array import array
 import os, math
 
+from .. import trace
+
 MAX_FILE_SIZE = 500 # GB
 CHANNELS = 32
+# One entry per acquired point in the "points" tree
+POINT_FIELDS = ["x", "y", "bias", "events", "triggers", "lost",
+    "offered", "accepted", "estimate", "precision", "full", "blt",
+    "pollInterval"]
+
+# PyROOT, loaded by load() when the first TreeFile is created
+rt = None
+
+def load():
+    global rt
+    if rt is None:
+        import ROOT as rt
+
+# Where a TreeFile called _name_ ends up: existing files are never
+# overwritten, an underscore is appended instead
+def outputPath(path, name):
+    path = os.path.join(path, "{}.root".format(name))
+
+    while(os.path.isfile(path)):
+        path = path.replace(".root", "_.root")
+    return path
+
+# Names of the waveform branches for _channels_ channels, only _used_ ones
+# and the triggers of their groups if given
+def waveBranches(channels = CHANNELS, used = None):
+    used = range(channels) if used is None else sorted(used)
+    return ["w{}".format(c) for c in used] + \
+        ["trg{}".format(t) for t in sorted({c // 8 for c in used})]
 
 class TreeFile():
 
-    def __init__(self, path, name, compression = 0):
-        path = os.path.join(path, "{}.root".format(name))
-
-        while(os.path.isfile(path)):
-            path = path.replace(".root", "_.root")
+    # Only the _used_ channels (and the digitized triggers of their groups)
+    # get a branch if given, named as if all _channels_ had one
+    def __init__(self, path, name, compression = 0, channels = CHANNELS,
+        used = None):
+        load()
+        path = outputPath(path, name)
+        self.path = path
         self.file = rt.TFile(path, "RECREATE", name, compression)
         self.tree = rt.TTree("wfm", "Digitizer waveforms")
         self.tree.SetMaxTreeSize(math.floor(MAX_FILE_SIZE * 10E9))
+        # Files written so far: past MAX_FILE_SIZE ROOT closes the current
+        # one and goes on in a new one
+        self.parts = [path]
 
         self.bias = array("d", [0.0])
         self.tree.Branch("bias", self.bias, "bias/D")
@@ -28,27 +62,55 @@ class TreeFile():
         self.pos = rt.std.vector("double")()
         self.tree.Branch("pos", self.pos)
 
-        self.channels = []
-        for c in range(CHANNELS):
+        # Unwrapped event counter and trigger time tag, see accounting.py
+        self.counter = array("I", [0])
+        self.tree.Branch("evt", self.counter, "evt/i")
+
+        self.timeTag = array("Q", [0])
+        self.tree.Branch("ttt", self.timeTag, "ttt/l")
+
+        # DRS4 start cell of each group, needed to correct raw samples
+        groups = int(channels/8.)
+        self.cells = array("I", [0] * groups)
+        self.tree.Branch("cell", self.cells, "cell[{}]/i".format(groups))
+
+        used = range(channels) if used is None else sorted(used)
+        self.channels = {}
+        for c in used:
             wave = rt.std.vector("double")()
             self.tree.Branch("w{}".format(c), wave)
-            self.channels.append(wave)
+            self.channels[c] = wave
 
         # one digitized trigger for each group of 8 channels
-        self.triggers = []
-        for t in range(int(CHANNELS/8.)):
+        self.triggers = {}
+        for t in sorted({c // 8 for c in used}):
             wave = rt.std.vector("double")()
             self.tree.Branch("trg{}".format(t), wave)
-            self.triggers.append(wave)
+            self.triggers[t] = wave
 
+        # Per point summary, filled once at the end of each point
+        self.points = rt.TTree("points", "Acquisition points")
+        self.point = {}
+        for field in POINT_FIELDS:
+            value = array("d", [0.0])
+            self.points.Branch(field, value, "{}/D".format(field))
+            self.point[field] = value
+
+    @trace.traced("tree.fill")
     def fill(self):
         self.tree.Fill()
 
+    # Fill the points tree, fields missing from _values_ are written as 0
+    def fillPoint(self, values):
+        for field, value in self.point.items():
+            value[0] = float(values.get(field, 0))
+        self.points.Fill()
+
     def clearEvent(self):
-        for c in self.channels:
+        for c in self.channels.values():
             c.clear()
 
-        for t in self.triggers:
+        for t in self.triggers.values():
             t.clear()
 
     def clearMeta(self):
@@ -57,13 +119,26 @@ class TreeFile():
         self.frequency[0] = 0
         self.pos.clear()
 
+    # Paths of the files ROOT closed since the last call
+    def rolled(self):
+        current = self.tree.GetCurrentFile().GetName()
+        if current == self.parts[-1]:
+            return []
+        self.parts.append(current)
+        return self.parts[-2:-1]
+
+    @trace.traced("tree.write")
     def write(self):
-        self.file.Write()
+        self.tree.GetCurrentFile().Write()
 
+    @trace.traced("tree.close")
     def close(self):
-        self.file.Write()
-        self.file.Close()
+        file = self.tree.GetCurrentFile()
+        file.Write()
+        file.Close()
 
+    # Setters run for every channel of every event, they are not traced on
+    # their own but as part of the block (daq.poll, daq.writeBlock)
     def setChannel(self, index, data, length):
         channel = self.channels[index]
         channel.clear()
@@ -76,6 +151,13 @@ class TreeFile():
         for t in range(length):
             trigger.push_back(float(data[t]))
 
+    def setEventInfo(self, counter, timeTag):
+        self.counter[0] = counter
+        self.timeTag[0] = timeTag
+
+    def setStartCell(self, group, cell):
+        self.cells[group] = cell
+
     def setFrequency(self, frequency):
         self.frequency[0] = float(frequency)
 
@@ -0,0 +1,230 @@
+# Runs taken with CAEN WaveDump: one file per channel (wave_N) and per
+# digitized trigger (TR_a_b), ASCII or binary, with or without the per
+# event header, as set by OUTPUT_FILE_FORMAT and OUTPUT_FILE_HEADER in the
+# WaveDumpConfig file. Every file holds one record per event, in order, so
+# events are put back together record by record and come out as
+# calibration.Block, ready for TreeFile.
+#
+# Binary files are memory mapped and can be read from any event on, ASCII
+# files are streamed from the start.
+
+import glob, itertools, os, re
+
+import numpy as np
+
+from .. import calibration
+from .config import SAMPLING_FREQUENCIES
+
+# Events put together at once
+CHUNK = 1024
+# Binary header: event size in bytes, board, pattern, channel, event
+# counter and trigger time tag, 32 bit words
+HEADER_WORDS = 6
+HEADER_FIELDS = {"counter": 4, "timeTag": 5}
+# ASCII header lines worth keeping
+ASCII_FIELDS = {"Event Number": "counter", "Trigger Time Stamp": "timeTag",
+    "Start Index Cell": "cell"}
+
+WAVE = re.compile(r"wave_(\d+)\.(txt|dat)$")
+TRIGGER = re.compile(r"TR_(\d+)_(\d+)\.(txt|dat)$")
+
+# COMMON settings of a WaveDumpConfig file as a dict of strings
+def readConfig(path):
+    settings = {}
+    section = None
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            if line.startswith("["):
+                section = line.strip("[]").strip()
+                continue
+            if section == "COMMON":
+                words = line.split(None, 1)
+                settings[words[0].upper()] = words[1].strip() \
+                    if len(words) > 1 else ""
+    return settings
+
+# Record length, sampling frequency in MHz, binary and header flags
+def settings(path):
+    common = readConfig(path)
+    length = int(common.get("RECORD_LENGTH", 1024))
+    frequency = SAMPLING_FREQUENCIES[int(common.get("DRS4_FREQUENCY", 0))]
+    binary = common.get("OUTPUT_FILE_FORMAT", "ASCII").upper() == "BINARY"
+    header = common.get("OUTPUT_FILE_HEADER", "NO").upper() == "YES"
+    return length, frequency, binary, header
+
+# Files of the run in _directory_ as {(group, channel): path}, channel 8
+# being the digitized trigger of the group
+def channelFiles(directory):
+    files = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        name = os.path.basename(path)
+        match = WAVE.match(name)
+        if match:
+            channel = int(match.group(1))
+            files[(channel // 8, channel % 8)] = path
+            continue
+        match = TRIGGER.match(name)
+        if match:
+            group = 2 * int(match.group(1)) + int(match.group(2))
+            files[(group, 8)] = path
+    return files
+
+# Records of a binary channel file, memory mapped
+class BinaryChannel():
+
+    def __init__(self, path, length, header):
+        self.path = path
+        if header:
+            # The header knows the record length better than the config
+            first = np.fromfile(path, np.uint32, HEADER_WORDS)
+            if len(first) == HEADER_WORDS:
+                length = (int(first[0]) - 4 * HEADER_WORDS) // 4
+            record = np.dtype([("header", "<u4", HEADER_WORDS),
+                ("samples", "<f4", length)])
+        else:
+            record = np.dtype([("samples", "<f4", length)])
+        self.length = length
+        self.header = header
+        size = os.path.getsize(path) // record.itemsize
+        self.records = np.memmap(path, record, "r", shape = (size,)) \
+            if size else np.zeros(0, record)
+
+    def __len__(self):
+        return len(self.records)
+
+    # Samples and header fields of events _start_ to _stop_
+    def read(self, start, stop):
+        records = self.records[start:stop]
+        fields = {}
+        if self.header:
+            for name, word in HEADER_FIELDS.items():
+                fields[name] = records["header"][:, word].astype(np.int64)
+        return records["samples"], fields
+
+# Records of an ASCII channel file, read in order
+class AsciiChannel():
+
+    def __init__(self, path, length, header):
+        self.path = path
+        self.length = length
+        self.header = header
+        self.file = open(path)
+        self.headerLines = 0
+        if header:
+            # Header lines are the "Name: value" ones before the samples
+            lines = list(itertools.islice(self.file, 64))
+            self.headerLines = next(i for i, line in enumerate(lines)
+                if ":" not in line)
+            for line in lines[:self.headerLines]:
+                name, value = line.split(":", 1)
+                if name.strip() == "Record Length":
+                    self.length = int(value)
+            self.file.seek(0)
+
+    # Samples and header fields of the next _count_ events at most
+    def read(self, count):
+        record = self.headerLines + self.length
+        lines = list(itertools.islice(self.file, count * record))
+        events = len(lines) // record
+        lines = lines[:events * record]
+        fields = {}
+        if not events:
+            return np.zeros((0, self.length), np.float32), fields
+        if self.headerLines:
+            for i in range(self.headerLines):
+                name, value = lines[i].split(":", 1)
+                field = ASCII_FIELDS.get(name.strip())
+                if field is not None:
+                    fields[field] = np.array([int(line.split(":", 1)[1])
+                        for line in lines[i::record]], np.int64)
+            lines = [line for i, line in enumerate(lines)
+                if i % record >= self.headerLines]
+        samples = np.array(lines, dtype = np.float32).reshape(events,
+            self.length)
+        return samples, fields
+
+    def close(self):
+        self.file.close()
+
+# A whole WaveDump run: the files in _directory_, written with the
+# settings of the WaveDumpConfig at _configPath_
+class Run():
+
+    def __init__(self, directory, configPath):
+        self.directory = directory
+        self.length, self.frequency, self.binary, self.header = \
+            settings(configPath)
+        extension = ".dat" if self.binary else ".txt"
+        self.files = {key: path for key, path in
+            channelFiles(directory).items() if path.endswith(extension)}
+        if not self.files:
+            raise ValueError("No WaveDump {} files in {}".format(extension,
+                directory))
+        self.groups = max(group for group, channel in self.files) + 1
+        self.channels = self.groups * 8
+        reader = BinaryChannel if self.binary else AsciiChannel
+        self.readers = {key: reader(path, self.length, self.header)
+            for key, path in self.files.items()}
+        self.length = next(iter(self.readers.values())).length
+
+    # Events in the run, only known beforehand for binary files. Files
+    # with fewer records than the others cut the run short.
+    def __len__(self):
+        if not self.binary:
+            raise TypeError("ASCII runs have to be read to be counted")
+        return min(len(reader) for reader in self.readers.values())
+
+    def mismatch(self, fields):
+        counters = [f["counter"] for f in fields if "counter" in f]
+        return any(not np.array_equal(c, counters[0]) for c in counters[1:])
+
+    # Blocks of at most _chunk_ events, from event _start_ to _stop_
+    # (binary files only, ASCII runs are always read whole)
+    def blocks(self, start = 0, stop = None, chunk = CHUNK):
+        if self.binary:
+            stop = len(self) if stop is None else min(stop, len(self))
+        position = start
+        while True:
+            if self.binary:
+                if position >= stop:
+                    return
+                count = min(chunk, stop - position)
+                read = {key: reader.read(position, position + count)
+                    for key, reader in self.readers.items()}
+                position += count
+            else:
+                read = {key: reader.read(chunk)
+                    for key, reader in self.readers.items()}
+                count = min(len(samples) for samples, f in read.values())
+                if not count:
+                    return
+                position += count
+            if self.mismatch([f for s, f in read.values()]):
+                print("Event numbers differ between channel files in {}, "
+                    "events are matched in file order".format(self.directory))
+
+            block = calibration.Block(count, self.length, self.groups)
+            for (group, channel), (samples, fields) in read.items():
+                block.waves[:, group, channel] = samples[:count]
+                block.present[:, group] = True
+                if "cell" in fields:
+                    block.cells[:, group] = fields["cell"][:count]
+                if "counter" in fields:
+                    block.counters = fields["counter"][:count].tolist()
+                if "timeTag" in fields:
+                    block.timeTags = fields["timeTag"][:count].tolist()
+            if not self.header:
+                block.counters = list(range(position - count, position))
+            yield block
+
+    def close(self):
+        for reader in self.readers.values():
+            if isinstance(reader, AsciiChannel):
+                reader.close()
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
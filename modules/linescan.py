@@ -0,0 +1,137 @@
+# Continuous motion line scans: the stage moves at constant speed along a
+# line while the digitizer keeps acquiring. The axes are sampled after every
+# readout, so every event read so far happened before the latest sample, and
+# the position of each event is interpolated at its trigger time tag.
+#
+# Time tags restart from zero when acquisition starts, host and digitizer
+# clocks are tied there. Events are binned into virtual points every _step_
+# um along the line.
+
+import math, time
+
+import numpy as np
+
+from . import accounting
+
+# The stage has arrived once every axis is this close to the end, um
+ARRIVAL_TOLERANCE = 1
+
+class LineScan():
+
+    # From _start_ to _end_, (x, y) in um. _stage_ is a connected Stage.
+    def __init__(self, stage, start, end, step, period =
+        accounting.TTT_PERIOD):
+        self.stage = stage
+        self.start = np.asarray(start, np.float64)
+        self.end = np.asarray(end, np.float64)
+        self.step = step
+        self.period = period
+
+        self.began = None
+        # Host time and (x, y) of every sample of the axes
+        self.times = []
+        self.positions = []
+        # Events, position sums, lost triggers and first and last time tags
+        # of each virtual point. Triggers lost between two events are lost
+        # in the point of the second one.
+        self.counts = {}
+        self.sums = {}
+        self.lost = {}
+        self.tags = {}
+        self.lastCounter = None
+
+    @property
+    def length(self):
+        return float(np.hypot(*(self.end - self.start)))
+
+    # Run _startAcquisition_, time tags count from the middle of the call
+    def begin(self, startAcquisition):
+        self.sample()
+        before = time.time()
+        startAcquisition()
+        self.began = (before + time.time()) / 2
+
+    # Read the axes, timed at the middle of the readout
+    def sample(self):
+        before = time.time()
+        position = self.stage.getPosition()
+        self.times.append((before + time.time()) / 2)
+        self.positions.append(position[:2])
+
+    @property
+    def arrived(self):
+        if not self.positions:
+            return False
+        return all(abs(p - e) <= ARRIVAL_TOLERANCE
+            for p, e in zip(self.positions[-1], self.end))
+
+    # Position of the event with (unwrapped) counter _counter_ and time tag
+    # _timeTag_, which is also counted in its virtual point
+    def position(self, counter, timeTag):
+        at = self.began + timeTag * self.period
+        positions = np.asarray(self.positions)
+        x = float(np.interp(at, self.times, positions[:, 0]))
+        y = float(np.interp(at, self.times, positions[:, 1]))
+
+        index = self.bin(x, y)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        sums = self.sums.setdefault(index, [0.0, 0.0])
+        sums[0] += x
+        sums[1] += y
+        if self.lastCounter is not None and counter > self.lastCounter + 1:
+            self.lost[index] = self.lost.get(index, 0) + \
+                counter - self.lastCounter - 1
+        self.lastCounter = counter
+        self.tags.setdefault(index, [timeTag, timeTag])[1] = timeTag
+        return x, y
+
+    # Virtual point of (x, y), by distance along the line
+    def bin(self, x, y):
+        length = self.length
+        if length == 0:
+            return 0
+        direction = (self.end - self.start) / length
+        along = float(np.dot((x, y) - self.start, direction))
+        return int(math.floor(along / self.step + 0.5))
+
+    # Virtual points of the events with (unwrapped) time tags _timeTags_,
+    # without counting them
+    def indices(self, timeTags):
+        length = self.length
+        if length == 0:
+            return np.zeros(len(timeTags), np.int64)
+        at = self.began + np.asarray(timeTags, np.float64) * self.period
+        positions = np.asarray(self.positions)
+        along = np.dot(np.stack((np.interp(at, self.times, positions[:, 0]),
+            np.interp(at, self.times, positions[:, 1])), axis = 1) -
+            self.start, (self.end - self.start) / length)
+        return np.floor(along / self.step + 0.5).astype(np.int64)
+
+    # Nominal position of virtual point _index_
+    def nominal(self, index):
+        length = self.length
+        direction = (self.end - self.start) / length if length else 0
+        x, y = self.start + direction * index * self.step
+        return float(x), float(y)
+
+    # Summary of virtual point _index_: nominal position, mean event
+    # position, and events, triggers and rates like Accounting.summary.
+    # Rates are over the time tags of the point, the host doesn't time
+    # single points of the line.
+    def point(self, index):
+        x, y = self.nominal(index)
+        count = self.counts.get(index, 0)
+        sums = self.sums.get(index, (0, 0))
+        lost = self.lost.get(index, 0)
+        first, last = self.tags.get(index, (0, 0))
+        span = (last - first) * self.period
+        return {"x": x, "y": y, "events": count,
+            "meanX": sums[0] / count if count else x,
+            "meanY": sums[1] / count if count else y,
+            "triggers": count + lost, "lost": lost,
+            "offered": (count + lost - 1) / span if span > 0 else 0,
+            "accepted": (count - 1) / span if span > 0 else 0}
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,164 @@
+# Per point summary maps built during the scan: for every channel, the
+# number of events, sum, sum of squares and maximum of the amplitude, the
+# events above threshold (efficiency) and the time against the digitized
+# trigger of those. Accumulators are updated a readout block at a time and
+# the maps are written at the end of every point, so they are there as soon
+# as the scan is, without going through the waveforms again.
+
+import os
+
+import numpy as np
+
+from . import observables
+
+# Amplitude over which an event counts as a hit, ADC counts
+THRESHOLD = 20
+# Accumulated for each channel at each point
+FIELDS = ["count", "sum", "sumsq", "max", "hits", "timeSum", "timeSumsq"]
+
+class Maps():
+
+    # _channels_ channels, 8 per digitized trigger, sampled every _period_
+    # ns, pulses of sign _polarity_
+    def __init__(self, channels, period, polarity = -1, threshold = THRESHOLD):
+        self.channels = channels
+        self.period = period
+        self.polarity = polarity
+        self.threshold = threshold
+        # Every finished point: position, bias and accumulators
+        self.xs, self.ys, self.biases = [], [], []
+        self.done = {field: [] for field in FIELDS}
+        self.start()
+
+    # Forget the point in progress
+    def start(self):
+        self.point = {field: np.zeros(self.channels) for field in FIELDS}
+        self.point["max"][:] = -np.inf
+
+    # _waves_ (events, channels, samples), _triggers_ (events, groups,
+    # samples), _present_ (events, groups) tells which groups were read
+    def add(self, waves, triggers, present):
+        events, channels, samples = waves.shape
+        if not events:
+            return
+        amplitudes = observables.amplitudes(
+            waves.reshape(-1, samples), self.polarity).reshape(events, -1)
+        hits = amplitudes > self.threshold
+
+        rows, columns, delays = hitTimes(waves, triggers, hits,
+            self.polarity, self.period)
+
+        read = np.repeat(present, 8, axis = 1)[:, :channels]
+        amplitudes = np.where(read, amplitudes, 0)
+        point = self.point
+        point["count"][:channels] += read.sum(axis = 0)
+        point["sum"][:channels] += amplitudes.sum(axis = 0)
+        point["sumsq"][:channels] += (amplitudes ** 2).sum(axis = 0)
+        point["max"][:channels] = np.maximum(point["max"][:channels],
+            np.where(read, amplitudes, -np.inf).max(axis = 0))
+        point["hits"][:channels] += (hits & read).sum(axis = 0)
+        point["timeSum"] += np.bincount(columns, delays, self.channels)
+        point["timeSumsq"] += np.bincount(columns, delays ** 2, self.channels)
+
+    # Every event of a calibration.Block
+    def addBlock(self, block):
+        events, groups, channels, samples = block.waves.shape
+        self.add(block.waves[:, :, :8].reshape(events, groups * 8, samples),
+            block.waves[:, :, 8], block.present)
+
+    # Events merged from several boards, as returned by readout.Boards.poll
+    def addEvents(self, events, channelsPerBoard, groupsPerBoard):
+        if events:
+            self.add(*eventArrays(events, channelsPerBoard, groupsPerBoard))
+
+    # Close the point in progress, taken at (_x_, _y_) and _bias_
+    def endPoint(self, x, y, bias):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.biases.append(bias)
+        for field in FIELDS:
+            self.done[field].append(self.point[field])
+        self.start()
+
+    # Mean, RMS and maximum amplitude, efficiency, mean time and time
+    # resolution of every point and channel, (points, channels) arrays
+    def summary(self):
+        done = {field: np.array(self.done[field]).reshape(-1, self.channels)
+            for field in FIELDS}
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            count, hits = done["count"], done["hits"]
+            mean = done["sum"] / count
+            rms = np.sqrt(np.maximum(done["sumsq"] / count - mean ** 2, 0))
+            time = done["timeSum"] / hits
+            jitter = np.sqrt(np.maximum(done["timeSumsq"] / hits - time ** 2,
+                0))
+            efficiency = hits / count
+        return {"mean": mean, "rms": rms, "max": done["max"],
+            "efficiency": efficiency, "time": time, "jitter": jitter}
+
+    # Flat per point arrays (x, y, bias and every accumulator), and each
+    # summary as a grid (biases, y, x, channels) with NaN where no point was
+    # taken
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        xs, ys = np.array(self.xs, float), np.array(self.ys, float)
+        biases = np.array(self.biases, float)
+        xAxis, column = np.unique(xs, return_inverse = True)
+        yAxis, row = np.unique(ys, return_inverse = True)
+        biasAxis, layer = np.unique(biases, return_inverse = True)
+
+        arrays = {"x": xs, "y": ys, "bias": biases, "xAxis": xAxis,
+            "yAxis": yAxis, "biasAxis": biasAxis}
+        for field in FIELDS:
+            arrays[field] = np.array(self.done[field]).reshape(-1,
+                self.channels)
+        for name, values in self.summary().items():
+            grid = np.full((len(biasAxis), len(yAxis), len(xAxis),
+                self.channels), np.nan)
+            grid[layer, row, column] = values
+            arrays[name + "Map"] = grid
+        # Written aside and moved, readers never see half a file
+        temporary = path + ".tmp.npz"
+        np.savez_compressed(temporary, **arrays)
+        os.replace(temporary, path)
+
+# Time of the _hits_ (events, channels) against the trigger of their group,
+# in ns. Returns the event, channel and time of those that could be timed.
+def hitTimes(waves, triggers, hits, polarity, period):
+    events, channels, samples = waves.shape
+    rows, columns = np.nonzero(hits)
+    trigger = observables.times(triggers.reshape(-1, samples), -1,
+        period).reshape(events, -1)
+    delays = observables.times(waves[rows, columns], polarity, period) - \
+        trigger[rows, columns // 8]
+    timed = np.isfinite(delays)
+    return rows[timed], columns[timed], delays[timed]
+
+# Waves (events, channels, samples), triggers (events, groups, samples) and
+# group presence (events, groups) of events merged from several boards
+def eventArrays(events, channelsPerBoard, groupsPerBoard):
+    samples = min(len(wave) for event in events for board in event
+        for wave in list(board[2].values()) + list(board[3].values()))
+    boards = len(events[0])
+    waves = np.zeros((len(events), boards * channelsPerBoard, samples),
+        np.float32)
+    triggers = np.zeros((len(events), boards * groupsPerBoard, samples),
+        np.float32)
+    present = np.zeros((len(events), boards * groupsPerBoard), bool)
+    for i, event in enumerate(events):
+        for board, (counter, ttt, channels, groups) in enumerate(event):
+            for channel, wave in channels.items():
+                waves[i, board * channelsPerBoard + channel] = wave[:samples]
+            for group, wave in groups.items():
+                triggers[i, board * groupsPerBoard + group] = wave[:samples]
+                present[i, board * groupsPerBoard + group] = True
+    return waves, triggers, present
+
+def outputPath(directory, name):
+    return os.path.join(directory, "{}_maps.npz".format(name))
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,224 @@
+# Live monitoring over HTTP: a page for the browser and the latest snapshot
+# of the run as JSON (decimated waveforms, rates, HV, stage position and the
+# points taken so far).
+#
+# Snapshots are built by the acquisition loop itself, never more often than
+# the time they take allows: their measured cost is kept under BUDGET of the
+# run. HV readings are slow queries, they are taken by a thread of their own
+# and snapshots only carry the latest. The server threads only hand out the
+# last snapshot, already encoded.
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json, threading, time
+
+import numpy as np
+
+PORT = 8080
+# Fraction of the acquisition loop snapshots may take, and their shortest
+# interval in s
+BUDGET = 0.02
+MIN_INTERVAL = 0.5
+# Pause between HV readings
+HV_INTERVAL = 5 # s
+# Samples kept per waveform, as min/max pairs of buckets
+WAVE_POINTS = 256
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>UFSD DAQ</title>
+<style>
+body { font-family: monospace; margin: 1em; }
+canvas { border: 1px solid #ccc; margin: 2px; }
+td { padding: 0 1em 0 0; }
+</style></head>
+<body>
+<h3 id="title">UFSD DAQ</h3>
+<table id="status"></table>
+<canvas id="map" width="320" height="320"></canvas>
+<div id="waves"></div>
+<script>
+function row(name, value) {
+  return "<tr><td>" + name + "</td><td>" + value + "</td></tr>";
+}
+function plot(canvas, samples) {
+  var c = canvas.getContext("2d"), w = canvas.width, h = canvas.height;
+  var lo = Math.min.apply(null, samples), hi = Math.max.apply(null, samples);
+  c.clearRect(0, 0, w, h);
+  c.beginPath();
+  samples.forEach(function(v, i) {
+    var x = i * w / samples.length, y = h - (v - lo) / (hi - lo || 1) * h;
+    i ? c.lineTo(x, y) : c.moveTo(x, y);
+  });
+  c.stroke();
+}
+function map(canvas, points) {
+  var c = canvas.getContext("2d"), w = canvas.width, h = canvas.height;
+  c.clearRect(0, 0, w, h);
+  if (!points.length) return;
+  var xs = points.map(p => p.x), ys = points.map(p => p.y);
+  var x0 = Math.min(...xs), x1 = Math.max(...xs);
+  var y0 = Math.min(...ys), y1 = Math.max(...ys);
+  var vs = points.map(p => p.estimate === undefined ? p.events : p.estimate);
+  var v0 = Math.min(...vs), v1 = Math.max(...vs);
+  points.forEach(function(p, i) {
+    var shade = Math.round(255 * (vs[i] - v0) / (v1 - v0 || 1));
+    c.fillStyle = "rgb(" + shade + ",0," + (255 - shade) + ")";
+    c.fillRect(10 + (p.x - x0) / (x1 - x0 || 1) * (w - 30),
+      h - 20 - (p.y - y0) / (y1 - y0 || 1) * (h - 30), 10, 10);
+  });
+}
+function update() {
+  fetch("status.json").then(r => r.json()).then(function(s) {
+    var html = "";
+    for (var k in s.status) html += row(k, JSON.stringify(s.status[k]));
+    for (var k in s.hv) html += row("HV " + k, s.hv[k]);
+    html += row("monitor cost", (100 * s.cost).toFixed(2) + " %");
+    document.getElementById("status").innerHTML = html;
+    map(document.getElementById("map"), s.points);
+    var waves = document.getElementById("waves");
+    for (var name in s.waves) {
+      var canvas = document.getElementById(name);
+      if (!canvas) {
+        canvas = document.createElement("canvas");
+        canvas.id = name; canvas.width = 256; canvas.height = 96;
+        canvas.title = name;
+        waves.appendChild(canvas);
+      }
+      plot(canvas, s.waves[name]);
+    }
+  }).catch(function() {}).finally(function() {
+    setTimeout(update, 1000);
+  });
+}
+update();
+</script></body></html>
+"""
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path in ("/", "/index.html"):
+            self.answer(PAGE.encode(), "text/html")
+        elif self.path == "/status.json":
+            self.answer(self.server.monitor.encoded, "application/json")
+        else:
+            self.send_error(404)
+
+    def answer(self, body, kind):
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are not worth a line on the DAQ console
+    def log_message(self, format, *args):
+        pass
+
+class Monitor():
+
+    # _hv_ returns the HV readings as a dict, it's called by a thread of
+    # its own every HV_INTERVAL seconds
+    def __init__(self, port = PORT, hv = None, budget = BUDGET):
+        self.hv = hv
+        self.budget = budget
+        self.interval = MIN_INTERVAL
+        self.last = 0
+        self.readings = {}
+        self.stopped = threading.Event()
+        self.hvThread = None
+        if hv is not None:
+            self.hvThread = threading.Thread(target = self.readHv,
+                daemon = True)
+            self.hvThread.start()
+        # Time spent building snapshots and time since start
+        self.spent = 0
+        self.began = time.time()
+        self.encoded = json.dumps({"status": {}, "hv": {}, "points": [],
+            "waves": {}, "cost": 0}).encode()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.server.monitor = self
+        self.thread = threading.Thread(target = self.server.serve_forever,
+            daemon = True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    # Is it time for a new snapshot?
+    def due(self):
+        return time.time() - self.last >= self.interval
+
+    # Fraction of the time spent on snapshots
+    @property
+    def cost(self):
+        elapsed = time.time() - self.began
+        return self.spent / elapsed if elapsed > 0 else 0
+
+    # Keep the latest HV readings until closed, a failed reading keeps the
+    # previous ones
+    def readHv(self):
+        while not self.stopped.is_set():
+            try:
+                self.readings = self.hv()
+            except Exception as e:
+                print("Monitor: HV reading failed ({})".format(e))
+            self.stopped.wait(HV_INTERVAL)
+
+    # New snapshot from the _status_ dict, the _points_ summaries and
+    # _waves_ ({name: samples}). The next one waits long enough to keep
+    # within the budget.
+    def update(self, status, points, waves):
+        began = time.time()
+        snapshot = {"status": status, "hv": self.readings,
+            "points": [{k: point[k] for k in ("x", "y", "events", "estimate")
+                if k in point} for point in points],
+            "waves": {name: decimate(wave) for name, wave in waves.items()},
+            "cost": self.cost}
+        self.encoded = json.dumps(snapshot, default = float).encode()
+
+        ended = time.time()
+        self.spent += ended - began
+        self.last = ended
+        self.interval = max((ended - began) / self.budget, MIN_INTERVAL)
+
+    def close(self):
+        self.stopped.set()
+        if self.hvThread is not None:
+            self.hvThread.join()
+        self.server.shutdown()
+        self.server.server_close()
+
+# Down to WAVE_POINTS samples, keeping the minimum and maximum of every
+# bucket so that pulses survive
+def decimate(wave):
+    wave = np.asarray(wave, np.float32)
+    buckets = WAVE_POINTS // 2
+    if len(wave) <= WAVE_POINTS:
+        return [round(float(v), 1) for v in wave]
+    size = len(wave) // buckets
+    shaped = wave[:size * buckets].reshape(buckets, size)
+    pairs = np.stack((shaped.min(axis = 1), shaped.max(axis = 1)), axis = 1)
+    # Keep the order the extremes come in
+    swap = shaped.argmin(axis = 1) > shaped.argmax(axis = 1)
+    pairs[swap] = pairs[swap][:, ::-1]
+    return [round(float(v), 1) for v in pairs.ravel()]
+
+# Waves of event _index_ of a calibration.Block, named like the branches
+def blockWaves(block, index = -1):
+    waves = {}
+    for group in range(block.waves.shape[1]):
+        if not block.present[index, group]:
+            continue
+        for channel in range(8):
+            waves["w{}".format(group * 8 + channel)] = \
+                block.waves[index, group, channel]
+        waves["trg{}".format(group)] = block.waves[index, group, 8]
+    return waves
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,193 @@
+# Online estimators of per point observables, updated once per readout block.
+# They decide when a point has enough events in adaptive acquisition.
+
+import math
+
+import numpy as np
+
+# Samples averaged for the baseline, from the start of the waveform
+BASELINE_SAMPLES = 50
+# Constant fraction used to time pulses
+FRACTION = 0.5
+# Samples before the peak where the leading edge is looked for first
+EDGE_SAMPLES = 64
+
+# Running count, mean and variance, blocks of values are merged with the
+# pairwise Welford update
+class Running():
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values):
+        values = np.asarray(values, np.float64)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        count = len(values)
+        mean = values.mean()
+        m2 = ((values - mean) ** 2).sum()
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0
+
+# Collects one channel (and the digitized trigger of its group) from every
+# event of a block, then updates its estimate from all of them at once.
+# update() must be called after every block, collected waves are only
+# dropped there.
+class Estimator():
+
+    # _channel_ is the output channel index (board * 16 + group * 8 +
+    # channel), _period_ the sampling period in ns, _polarity_ -1 for
+    # negative pulses
+    def __init__(self, channel, period, polarity = -1):
+        self.index = channel
+        self.group, self.channel = divmod(channel % 16, 8)
+        self.period = period
+        self.polarity = polarity
+        self.running = Running()
+        self.waves = []
+        self.triggers = []
+
+    # Take the samples out of a decoded digitizer.Event, they are only valid
+    # until the next event is decoded
+    def addEvent(self, event):
+        if event.GrPresent[self.group] != 1:
+            return
+        group = event.DataGroup[self.group]
+        size = group.ChSize[self.channel]
+        self.addWave(copy(group.DataChannel[self.channel], size),
+            copy(group.DataChannel[8], group.ChSize[8]))
+
+    def addWave(self, wave, trigger):
+        self.waves.append(np.asarray(wave, np.float32))
+        self.triggers.append(np.asarray(trigger, np.float32))
+
+    # Waves of a whole calibration.Block at once
+    def addBlock(self, block):
+        present = block.present[:, self.group]
+        self.running.add(self.values(block.waves[present, self.group,
+            self.channel], block.waves[present, self.group, 8]))
+
+    # Fold the collected events into the estimate
+    def update(self):
+        if not self.waves:
+            return
+        length = min(len(wave) for wave in self.waves)
+        self.running.add(self.values(
+            np.stack([wave[:length] for wave in self.waves]),
+            np.stack([trigger[:length] for trigger in self.triggers])))
+        self.waves, self.triggers = [], []
+
+    @property
+    def events(self):
+        return self.running.count
+
+    def amplitudes(self, waves):
+        return amplitudes(waves, self.polarity)
+
+    def times(self, waves, polarity):
+        return times(waves, polarity, self.period)
+
+# Mean signal amplitude, done when its standard error is small enough
+# compared to it
+class Amplitude(Estimator):
+
+    name = "amplitude"
+
+    def values(self, waves, triggers):
+        return self.amplitudes(waves)
+
+    @property
+    def estimate(self):
+        return self.running.mean
+
+    @property
+    def relativeError(self):
+        running = self.running
+        if running.count < 2 or running.mean == 0:
+            return math.inf
+        return running.std / math.sqrt(running.count) / abs(running.mean)
+
+# Time resolution, as the spread of the signal time against the digitized
+# trigger. The relative error of a standard deviation only depends on the
+# number of events, 1 / sqrt(2 (n - 1)).
+class Timing(Estimator):
+
+    name = "timing"
+
+    def values(self, waves, triggers):
+        # TR0 is a negative square pulse
+        return self.times(waves, self.polarity) - self.times(triggers, -1)
+
+    @property
+    def estimate(self):
+        return self.running.std
+
+    @property
+    def relativeError(self):
+        if self.running.count < 2:
+            return math.inf
+        return 1 / math.sqrt(2 * (self.running.count - 1))
+
+ESTIMATORS = {"AMPLITUDE": Amplitude, "TIMING": Timing}
+
+# Signal amplitude of each event, (events, samples) arrays
+def amplitudes(waves, polarity = -1):
+    baseline = waves[:, :BASELINE_SAMPLES].mean(axis = 1)
+    extreme = waves.max(axis = 1) if polarity > 0 else waves.min(axis = 1)
+    return polarity * (extreme - baseline)
+
+# Constant fraction time of each event, in ns for a sampling _period_ in ns.
+# Events whose pulse never crosses come out as NaN.
+def times(waves, polarity, period):
+    baseline = waves[:, :BASELINE_SAMPLES].mean(axis = 1)
+    pulses = polarity * (waves - baseline[:, None])
+    rows = np.arange(len(pulses))
+    peak = pulses.argmax(axis = 1)
+    level = FRACTION * pulses[rows, peak]
+
+    # Last sample under the level before the peak, looked for just before
+    # the peak first and in the whole waveform only where it isn't there
+    before = np.zeros(len(pulses), np.int64)
+    found = np.zeros(len(pulses), bool)
+    window = peak[:, None] + np.arange(-EDGE_SAMPLES, 0)
+    under = window >= 0
+    window = np.maximum(window, 0)
+    under &= pulses[rows[:, None], window] < level[:, None]
+    last = EDGE_SAMPLES - 1 - np.argmax(under[:, ::-1], axis = 1)
+    found = under.any(axis = 1)
+    before[found] = window[found, last[found]]
+
+    missing = np.nonzero(~found & (peak > EDGE_SAMPLES))[0]
+    if len(missing):
+        under = (pulses[missing] < level[missing, None]) & \
+            (np.arange(pulses.shape[1])[None, :] < peak[missing, None])
+        before[missing] = pulses.shape[1] - 1 - \
+            np.argmax(under[:, ::-1], axis = 1)
+        found[missing] = under.any(axis = 1)
+    valid = found & (before + 1 < pulses.shape[1])
+    before = np.where(valid, before, 0)
+
+    v0 = pulses[rows, before]
+    v1 = pulses[rows, before + 1]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        result = (before + (level - v0) / (v1 - v0)) * period
+    return np.where(valid, result, np.nan)
+
+def copy(pointer, size):
+    return np.ctypeslib.as_array(pointer, (size,)).copy() if size \
+        else np.zeros(0, np.float32)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,115 @@
+# Pedestal (baseline) of every channel and DRS4 cell, from random trigger
+# events. Mean and RMS are accumulated a block at a time with Welford's
+# method, merging each block into the running totals, so no waveform is kept.
+
+import os
+
+import numpy as np
+
+from . import calibration
+from .io.config import SAMPLING_FREQUENCIES
+
+class Pedestal():
+
+    def __init__(self, frequency = 0, serial = None):
+        shape = (calibration.GROUPS, calibration.CHANNELS_PER_GROUP,
+            calibration.CELLS)
+        self.count = np.zeros(shape, np.int64)
+        self.mean = np.zeros(shape, np.float64)
+        self.m2 = np.zeros(shape, np.float64)
+        self.frequency = frequency
+        self.serial = serial
+        self.events = 0
+
+    # Accumulate the raw samples of a calibration.Block
+    def add(self, block):
+        events, groups, channels, length = block.waves.shape
+        if not events:
+            return
+        cells = (block.cells[..., None] + np.arange(length)) % \
+            calibration.CELLS
+
+        for g in range(groups):
+            present = block.present[:, g]
+            if not present.any():
+                continue
+            index = cells[present, g].ravel()
+            count = np.bincount(index, minlength = calibration.CELLS)
+            seen = count > 0
+            for c in range(channels):
+                samples = block.waves[present, g, c].ravel().astype(np.float64)
+                mean = np.bincount(index, samples, calibration.CELLS)
+                mean[seen] /= count[seen]
+                m2 = np.bincount(index, (samples - mean[index]) ** 2,
+                    calibration.CELLS)
+                self.merge(g, c, count, mean, m2)
+        self.events += events
+
+    # Chan et al. pairwise update of the running count, mean and M2
+    def merge(self, group, channel, count, mean, m2):
+        total = self.count[group, channel] + count
+        seen = total > 0
+        delta = mean - self.mean[group, channel]
+        weight = np.zeros(calibration.CELLS)
+        weight[seen] = count[seen] / total[seen]
+        self.mean[group, channel] += delta * weight
+        self.m2[group, channel] += m2 + delta ** 2 * \
+            self.count[group, channel] * weight
+        self.count[group, channel] = total
+
+    @property
+    def rms(self):
+        rms = np.zeros_like(self.m2)
+        seen = self.count > 1
+        rms[seen] = np.sqrt(self.m2[seen] / (self.count[seen] - 1))
+        return rms
+
+    # Mean and RMS of each channel over all its cells
+    def channels(self):
+        weights = np.maximum(self.count, 1)
+        mean = np.average(self.mean, axis = -1, weights = weights)
+        rms = np.sqrt(np.average(self.rms ** 2, axis = -1, weights = weights))
+        return mean, rms
+
+    # Only what's needed downstream, in single precision
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        np.savez_compressed(path, mean = self.mean.astype(np.float32),
+            rms = self.rms.astype(np.float32),
+            count = self.count.astype(np.int32), events = self.events,
+            frequency = self.frequency,
+            serial = -1 if self.serial is None else self.serial)
+
+    # Correction tables with cell offsets from this pedestal, relative to
+    # the mean of each channel. Per sample offsets and cell times come from
+    # _base_ if given.
+    def tables(self, base = None):
+        mean, rms = self.channels()
+        cell = self.mean - mean[..., None]
+        cell[self.count == 0] = 0
+        if base is None:
+            base = calibration.ideal(self.frequency, self.serial)
+        return calibration.Tables(cell, base.nsample, base.time,
+            self.frequency, self.serial)
+
+# Pedestal saved to _path_, the running M2 is recovered from the RMS
+def load(path):
+    data = np.load(path)
+    serial = int(data["serial"])
+    result = Pedestal(int(data["frequency"]), None if serial < 0 else serial)
+    result.count = data["count"].astype(np.int64)
+    result.mean = data["mean"].astype(np.float64)
+    result.m2 = data["rms"].astype(np.float64) ** 2 * \
+        np.maximum(result.count - 1, 0)
+    result.events = int(data["events"])
+    return result
+
+def cachePath(directory, serial, frequency):
+    return os.path.join(directory, "pedestal_{}_{:.0f}MHz.npz".format(serial,
+        SAMPLING_FREQUENCIES[frequency]))
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,345 @@
+# Multi-board readout: one process per DT5742, events merged by counter.
+
+from array import array
+from collections import deque
+import multiprocessing as mp
+import queue
+
+from . import digitizer
+
+# Each DT5742 contributes this many channels (and digitized triggers) to the
+# output tree: board N owns channels 16N-16N+15 and triggers 2N-2N+1
+CHANNELS_PER_BOARD = 16
+GROUPS_PER_BOARD = 2
+
+# How long to wait for a board to answer a command before giving up
+REPLY_TIMEOUT = 30 # s
+# How long poll() waits for a new block from any board
+POLL_TIMEOUT = 0.1 # s
+
+# Trigger time tags are 32 bit counters, deltas are taken modulo 2^32
+TTT_MASK = 0xFFFFFFFF
+# Two boards see the same trigger if the time elapsed since their previous
+# matched event agrees within this many ticks (or this fraction of the delta,
+# whichever is larger). Boards run on independent oscillators.
+TTT_TOLERANCE = 4 # ticks
+TTT_RELATIVE_TOLERANCE = 1E-3
+# Events needed on every board before their counters are aligned, and how far
+# (in events) one board may lead another after a staggered start
+ALIGN_EVENTS = 8
+ALIGN_MAX_SHIFT = 3
+
+# Proxy for a set of digitizers, each one owned by its own readout process.
+# Any Digitizer method called on this object is forwarded to every board,
+# so programming code written for a single Digitizer works unchanged.
+class Boards():
+
+    def __init__(self, numbers):
+        self.connected = False
+        self.numbers = list(numbers)
+
+        context = mp.get_context("fork")
+        self.results = context.Queue()
+        self.commands = []
+        self.processes = []
+        for board, number in enumerate(self.numbers):
+            commands = context.Queue()
+            process = context.Process(target = serve,
+                args = (board, number, commands, self.results), daemon = True)
+            process.start()
+
+            self.commands.append(commands)
+            self.processes.append(process)
+
+        self.merger = EventMerger(len(self.numbers))
+        # Whether the memory of each board was full at its latest readout
+        self.full = [False] * len(self.numbers)
+        # Every process answers with its connection outcome first
+        self.connected = all(self.collect())
+
+    def __len__(self):
+        return len(self.numbers)
+
+    # Forward _name_ to every board and return the list of results
+    def call(self, name, *args):
+        for commands in self.commands:
+            commands.put((name, args))
+        return self.collect()
+
+    # Wait for one reply per board. Data blocks still in flight from a
+    # previous acquisition are discarded. Calls that raised on some board
+    # raise here once every board answered.
+    def collect(self):
+        replies = [None] * len(self)
+        errors = []
+        pending = len(self)
+        while pending:
+            try:
+                kind, board, payload = self.results.get(timeout = REPLY_TIMEOUT)
+            except queue.Empty:
+                print("\nBoards: no answer from readout processes.")
+                break
+            if kind == "reply":
+                replies[board] = payload
+                pending -= 1
+            elif kind == "error":
+                name, message = payload
+                errors.append(failure(board, name, message))
+                # Readout errors are not the answer to a command
+                if name is not None:
+                    pending -= 1
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return replies
+
+    def __getattr__(self, name):
+        if not hasattr(digitizer.Digitizer, name):
+            raise AttributeError(name)
+        def forward(*args):
+            return self.call(name, *args)
+        return forward
+
+    # All boards must be ready, report the first one that is not
+    def status(self):
+        for status in self.call("status"):
+            if status != 0x180:
+                return status
+        return 0x180
+
+    # Boards are expected to be the same model, report the first one that
+    # differs from board 0 so that the caller rejects the whole set
+    def getInfo(self):
+        infos = self.call("getInfo")
+        for info in infos:
+            if info.ModelName != infos[0].ModelName:
+                return info
+        return infos[0]
+
+    # Only the channels in _layout_, (group, [channels]) pairs like
+    # Config.layout, are copied out of each event and sent over
+    def setLayout(self, layout):
+        return self.call("setLayout", layout)
+
+    def startAcquisition(self):
+        self.merger.reset()
+        self.full = [False] * len(self)
+        return self.call("startAcquisition")
+
+    def stopAcquisition(self):
+        replies = self.call("stopAcquisition")
+        if self.merger.orphans or self.merger.mismatches:
+            print("\nBoards: dropped {} unmatched events, {} time tag "
+                "mismatches.".format(self.merger.orphans,
+                self.merger.mismatches))
+        return replies
+
+    # Wait for the next block from any board, merge it and return at most
+    # _remaining_ complete events. Each event is a list with one
+    # (counter, ttt, channels, triggers) tuple per board. The memory status
+    # the block came with ends up in self.full.
+    def poll(self, remaining):
+        try:
+            kind, board, payload = self.results.get(timeout = POLL_TIMEOUT)
+        except queue.Empty:
+            return []
+        if kind == "error":
+            raise RuntimeError(failure(board, *payload))
+        if kind != "block":
+            return []
+
+        events, self.full[board] = payload
+        self.merger.add(board, events)
+        return list(self.merger.pop(remaining))
+
+    # Close every board and wait for the readout processes to exit
+    def close(self):
+        self.call("close")
+        for process in self.processes:
+            process.join(REPLY_TIMEOUT)
+        self.connected = False
+
+# Assembles events from several boards. Each board's EventCounter is shifted
+# by an offset found by matching the pattern of trigger time tag intervals
+# at the beginning of the acquisition (boards are started one after the
+# other, so the first board may see triggers the others missed). After that
+# events are matched by counter and the time tags double check the match.
+class EventMerger():
+
+    def __init__(self, boards):
+        self.boards = boards
+        self.reset()
+
+    def reset(self):
+        self.pending = [deque() for b in range(self.boards)]
+        self.offsets = None
+        self.last = None
+
+        # Events seen by some boards only
+        self.orphans = 0
+        # Events whose counters matched but time tags did not
+        self.mismatches = 0
+
+    # Add a block of (counter, ttt, channels, triggers) tuples from _board_
+    def add(self, board, events):
+        self.pending[board].extend(events)
+
+    # Yield up to _limit_ merged events, each one is a list with one
+    # (counter, ttt, channels, triggers) tuple per board
+    def pop(self, limit):
+        if self.offsets is None and not self.align():
+            return
+
+        while limit > 0 and all(self.pending):
+            heads = [pending[0] for pending in self.pending]
+            keys = [head[0] - offset
+                for head, offset in zip(heads, self.offsets)]
+
+            # Some board lost this trigger, drop it from the others
+            low = min(keys)
+            if max(keys) != low:
+                for board, key in enumerate(keys):
+                    if key == low:
+                        self.pending[board].popleft()
+                        self.orphans += 1
+                continue
+
+            if self.last is not None and not self.consistent(heads):
+                self.mismatches += 1
+
+            self.last = [head[1] for head in heads]
+            for pending in self.pending:
+                pending.popleft()
+
+            limit -= 1
+            yield heads
+
+    # Time elapsed since the previous matched event must agree on all boards
+    def consistent(self, heads):
+        deltas = [(head[1] - last) & TTT_MASK
+            for head, last in zip(heads, self.last)]
+        spread = max(deltas) - min(deltas)
+        return spread <= max(TTT_TOLERANCE,
+            TTT_RELATIVE_TOLERANCE * max(deltas))
+
+    # Find the counter offset of each board relative to board 0
+    def align(self):
+        if min(len(pending) for pending in self.pending) < ALIGN_EVENTS:
+            return False
+
+        reference = list(self.pending[0])
+        self.offsets = [0]
+        for pending in self.pending[1:]:
+            other = list(pending)
+            shift = max(range(-ALIGN_MAX_SHIFT, ALIGN_MAX_SHIFT + 1),
+                key = lambda s: (score(reference, other, s), -abs(s)))
+
+            if shift >= 0:
+                offset = other[shift][0] - reference[0][0]
+            else:
+                offset = other[0][0] - reference[-shift][0]
+            self.offsets.append(offset)
+        return True
+
+# How many trigger intervals of _other_, shifted by _shift_ events, match
+# the ones of _reference_
+def score(reference, other, shift):
+    matches = 0
+    for i in range(1, len(reference)):
+        j = i + shift
+        if j < 1 or j >= len(other):
+            continue
+        a = (reference[i][1] - reference[i - 1][1]) & TTT_MASK
+        b = (other[j][1] - other[j - 1][1]) & TTT_MASK
+        if abs(a - b) <= max(TTT_TOLERANCE, TTT_RELATIVE_TOLERANCE * a):
+            matches += 1
+    return matches
+
+# What went wrong on _board_, in command _name_ (None while reading out)
+def failure(board, name, message):
+    if name is None:
+        return "board {} readout: {}".format(board, message)
+    return "board {} {}: {}".format(board, name, message)
+
+# Body of each readout process: owns one Digitizer, executes the commands
+# forwarded by Boards and streams decoded blocks while acquiring, each one
+# with whether the board memory was full before it was read. Exceptions
+# are sent back as ("error", board, (command, message)) replies, the command
+# being None for the readout, so that the caller never waits for a process
+# that died.
+def serve(board, number, commands, results):
+    try:
+        dgt = digitizer.Digitizer(number)
+    except Exception as error:
+        results.put(("error", board, ("Digitizer", repr(error))))
+        return
+    results.put(("reply", board, dgt.connected))
+    if not dgt.connected:
+        return
+
+    # Every channel until told otherwise
+    layout = [(group, list(range(8))) for group in range(GROUPS_PER_BOARD)]
+    running = False
+    while True:
+        try:
+            name, args = commands.get(block = not running)
+        except queue.Empty:
+            try:
+                # A full memory drops triggers until this readout makes room
+                full = bool(dgt.acquisitionStatus() & digitizer.STATUS_FULL)
+                events = readBlock(dgt, layout)
+            except Exception as error:
+                # Nothing more to read until the acquisition is restarted
+                running = False
+                results.put(("error", board, (None, repr(error))))
+                continue
+            if events or full:
+                results.put(("block", board, (events, full)))
+            continue
+
+        try:
+            if name == "setLayout":
+                layout, value = args[0], None
+            else:
+                value = getattr(dgt, name)(*args)
+        except Exception as error:
+            results.put(("error", board, (name, repr(error))))
+        else:
+            if name == "startAcquisition":
+                running = True
+            elif name == "stopAcquisition":
+                running = False
+            results.put(("reply", board, value))
+
+        if name == "close":
+            return
+
+# Transfer one block from _dgt_ and copy the channels in _layout_ and the
+# triggers of their groups out of the CAEN buffers, so that they can be
+# sent to the merging process
+def readBlock(dgt, layout):
+    dgt.readData()
+
+    events = []
+    for i in range(dgt.getNumEvents()):
+        data, info = dgt.getEvent(i, True)
+
+        channels, triggers = {}, {}
+        for group, used in layout:
+            if data.GrPresent[group] != 1:
+                continue # If this group was disabled then skip it
+
+            block = data.DataGroup[group]
+            for channel in used:
+                size = block.ChSize[channel]
+                channels[8 * group + channel] = array("f",
+                    block.DataChannel[channel][:size])
+            triggers[group] = array("f",
+                block.DataChannel[8][:block.ChSize[8]])
+
+        events.append((info.EventCounter, info.TriggerTimeTag,
+            channels, triggers))
+    return events
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
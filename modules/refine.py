@@ -0,0 +1,168 @@
+# Coarse to fine 2D scans: a coarse grid first, then square cells whose
+# corners disagree the most are split in four, down to the finest step,
+# until nothing changes enough or the time budget runs out. Positions live
+# on the lattice of the finest step, (i, j) -> (X_START + i X_STEP, ...).
+#
+# A change only counts when it's real: larger than SIGNIFICANCE times the
+# uncertainty of the corners it's measured between, and than the absolute
+# minimum change. Noise alone never splits a cell.
+
+import heapq, math, time
+
+# Standard errors a change has to exceed to split a cell
+SIGNIFICANCE = 3
+
+class QuadTree():
+
+    # _columns_ x _rows_ finest steps, coarse cells _size_ steps wide. Cells
+    # are split when the observable changes by more than _threshold_ of its
+    # range, _minChange_ and SIGNIFICANCE times its uncertainty.
+    def __init__(self, columns, rows, size, threshold, minChange = 0):
+        self.columns = columns
+        self.rows = rows
+        self.size = size
+        self.threshold = threshold
+        self.minChange = minChange
+        # Observable and its standard error at each acquired lattice point
+        self.values = {}
+        self.errors = {}
+        # Cells waiting for their corners, and cells ready to be split by
+        # priority (largest first)
+        self.waiting = []
+        self.ready = []
+        self.pushed = 0
+
+    # Coarse grid points, serpentine so the stage never goes back
+    def initial(self):
+        columns = sorted(set(list(range(0, self.columns, self.size)) +
+            [self.columns]))
+        rows = sorted(set(list(range(0, self.rows, self.size)) +
+            [self.rows]))
+        points = []
+        for n, i in enumerate(columns):
+            points.extend((i, j) for j in (rows if n % 2 == 0 else
+                reversed(rows)))
+        self.waiting = [(i, j, self.size) for i in columns[:-1]
+            for j in rows[:-1]]
+        return points
+
+    def add(self, point, value, error = 0):
+        self.values[point] = value
+        self.errors[point] = error
+
+    # Corners of a cell, clipped to the scan area
+    def corners(self, cell):
+        i, j, size = cell
+        i2, j2 = min(i + size, self.columns), min(j + size, self.rows)
+        return [(i, j), (i2, j), (i, j2), (i2, j2)]
+
+    # How much the observable changes across a cell, relative to its range
+    # over the whole scan so far
+    def contrast(self, cell):
+        values = [self.values[c] for c in self.corners(cell)]
+        values = [v for v in values if not math.isnan(v)]
+        known = [v for v in self.values.values() if not math.isnan(v)]
+        if len(values) < 2 or not known:
+            return 0
+        scale = max(known) - min(known)
+        return (max(values) - min(values)) / scale if scale > 0 else 0
+
+    # Is the change across a cell more than noise?
+    def significant(self, cell):
+        corners = [c for c in self.corners(cell)
+            if not math.isnan(self.values[c])]
+        if len(corners) < 2:
+            return False
+        low = min(corners, key = self.values.get)
+        high = max(corners, key = self.values.get)
+        change = self.values[high] - self.values[low]
+        noise = SIGNIFICANCE * math.hypot(self.errors[high],
+            self.errors[low])
+        return change > max(noise, self.minChange)
+
+    # Queue the waiting cells whose corners are all acquired
+    def settle(self):
+        waiting = []
+        for cell in self.waiting:
+            if not all(c in self.values for c in self.corners(cell)):
+                waiting.append(cell)
+                continue
+            contrast = self.contrast(cell)
+            if cell[2] > 1 and contrast > self.threshold and \
+                self.significant(cell):
+                self.pushed += 1
+                heapq.heappush(self.ready, (-contrast * cell[2], self.pushed,
+                    cell))
+        self.waiting = waiting
+
+    # Split the most promising cell, returns the points to acquire for it,
+    # None when nothing is left to refine
+    def refine(self):
+        self.settle()
+        if not self.ready:
+            return None
+        priority, n, (i, j, size) = heapq.heappop(self.ready)
+        half = size // 2
+        points = []
+        for di in (0, half):
+            for dj in (0, half):
+                if i + di >= self.columns or j + dj >= self.rows:
+                    continue
+                child = (i + di, j + dj, half)
+                self.waiting.append(child)
+                for corner in self.corners(child):
+                    if corner not in self.values and corner not in points:
+                        points.append(corner)
+        return points
+
+class Refiner():
+
+    def __init__(self, config):
+        (self.xStart, self.xStep, xStop,
+            self.yStart, self.yStep, yStop) = config.getGrid(inclusive = False)
+        columns = max(0, (xStop - self.xStart) // self.xStep)
+        rows = max(0, (yStop - self.yStart) // self.yStep)
+        self.tree = QuadTree(columns, rows, config.coarseFactor,
+            config.refineThreshold, config.refineMinChange)
+        self.budget = config.timeBudget
+        self.points = 0
+
+    def position(self, point):
+        return (self.xStart + point[0] * self.xStep,
+            self.yStart + point[1] * self.yStep)
+
+    # Acquire every coarse point and then the refinements. _measure_(x, y)
+    # acquires one point and returns its observable and standard error, None
+    # if unknown.
+    def run(self, measure):
+        began = time.time()
+        for point in self.tree.initial():
+            self.acquire(point, measure)
+
+        while True:
+            points = self.tree.refine()
+            if points is None:
+                print("\nNothing left to refine after {} points".format(
+                    self.points))
+                break
+            # Don't start what won't fit in the budget
+            elapsed = time.time() - began
+            perPoint = elapsed / max(self.points, 1)
+            if self.budget and elapsed + perPoint * len(points) > self.budget:
+                print("\nTime budget used up after {} points".format(
+                    self.points))
+                break
+            for point in points:
+                self.acquire(point, measure)
+
+    def acquire(self, point, measure):
+        measured = measure(*self.position(point))
+        if measured is None:
+            self.tree.add(point, float("nan"))
+        else:
+            self.tree.add(point, *measured)
+        self.points += 1
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
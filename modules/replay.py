@@ -0,0 +1,205 @@
+# Recorded data as a stream of readout blocks, to run the online processing
+# again: a wfm tree written by TreeFile, or the raw blocks dumped during a
+# software corrected run (RAW_DUMP). Both are read in large chunks and cut
+# into segments that belong to a single point, so they can go through the
+# same pipeline poll feeds, paced on the original time tags if wanted.
+
+import glob, os, time
+
+import numpy as np
+
+from . import accounting, calibration
+from .io import tree
+
+# Events read at once from a tree
+CHUNK = 1024
+
+# Events of one point: its bias, position and a calibration.Block. _raw_
+# blocks still need the DRS4 correction.
+class Segment():
+
+    def __init__(self, bias, x, y, block, raw = False):
+        self.bias = bias
+        self.x = x
+        self.y = y
+        self.block = block
+        self.raw = raw
+
+# Where events of a new point start: bias, position (_biases_ and
+# _positions_ per event) or time tags (they restart with every point)
+# change. Returns the first and last + 1 event of every point.
+def bounds(biases, positions, timeTags):
+    keys = np.column_stack((biases, positions))
+    tags = np.asarray(timeTags, np.float64)
+    cuts = np.nonzero((keys[1:] != keys[:-1]).any(axis = 1) |
+        (tags[1:] < tags[:-1]))[0] + 1
+    edges = [0] + cuts.tolist() + [len(tags)]
+    return [(start, stop) for start, stop in zip(edges[:-1], edges[1:])
+        if stop > start]
+
+# Cut _block_ in segments of a single point
+def split(block, biases, positions, raw):
+    for start, stop in bounds(biases, positions, block.timeTags):
+        yield Segment(biases[start], *positions[start],
+            block.slice(start, stop), raw)
+
+# Blocks of a wfm tree, corrected as they were written
+class TreeSource():
+
+    def __init__(self, path, chunk = CHUNK):
+        tree.load()
+        self.path = path
+        self.chunk = chunk
+        self.file = tree.rt.TFile.Open(path)
+        self.tree = self.file.Get("wfm")
+        names = [branch.GetName() for branch in self.tree.GetListOfBranches()]
+        # Only the channels in use have a branch, keep their global index
+        self.channels = sorted(int(n[1:]) for n in names if n[0] == "w" and
+            n[1:].isdigit())
+        self.triggers = sorted(int(n[3:]) for n in names
+            if n.startswith("trg"))
+        self.groups = self.triggers[-1] + 1 if self.triggers else 0
+        # Older files have no counters, time tags or start cells
+        self.hasInfo = "evt" in names
+        self.hasCells = "cell" in names
+        self.tree.GetEntry(0)
+        self.length = int(self.tree.size)
+        self.frequency = self.tree.freq
+
+    def __len__(self):
+        return int(self.tree.GetEntries())
+
+    # Entries _start_ to _stop_ as a calibration.Block, with the bias and
+    # position of each
+    def read(self, start, stop):
+        count = stop - start
+        t = self.tree
+        block = calibration.Block(count, self.length, self.groups)
+        biases = np.zeros(count)
+        positions = np.zeros((count, 2))
+        for i in range(count):
+            t.GetEntry(start + i)
+            biases[i] = t.bias
+            if t.pos.size() >= 2:
+                positions[i] = (t.pos[0], t.pos[1])
+            if self.hasInfo:
+                block.counters[i] = int(t.evt)
+                block.timeTags[i] = int(t.ttt)
+            else:
+                block.counters[i] = start + i
+            for g in self.triggers:
+                trigger = np.asarray(getattr(t, "trg{}".format(g)))
+                if not len(trigger):
+                    continue
+                block.present[i, g] = True
+                if self.hasCells:
+                    block.cells[i, g] = t.cell[g]
+                size = min(len(trigger), self.length)
+                block.waves[i, g, 8, :size] = trigger[:size]
+                for c in self.channels:
+                    if c // 8 != g:
+                        continue
+                    wave = np.asarray(getattr(t, "w{}".format(c)))
+                    size = min(len(wave), self.length)
+                    block.waves[i, g, c % 8, :size] = wave[:size]
+        return block, biases, positions
+
+    def segments(self):
+        entries = len(self)
+        for start in range(0, entries, self.chunk):
+            block, biases, positions = self.read(start,
+                min(start + self.chunk, entries))
+            yield from split(block, biases, positions, False)
+
+    def close(self):
+        self.file.Close()
+
+# Raw blocks dumped by Dumper, in order
+class DumpSource():
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = sorted(glob.glob(os.path.join(directory,
+            "block_*.npz")))
+        first = np.load(self.paths[0]) if self.paths else None
+        self.frequency = int(first["frequency"]) if first is not None else 0
+        self.serial = int(first["serial"]) if first is not None else -1
+
+    def __len__(self):
+        return sum(int(np.load(path)["counters"].shape[0])
+            for path in self.paths)
+
+    def segments(self):
+        for path in self.paths:
+            data = np.load(path)
+            block = calibration.Block(0, 0)
+            block.waves = data["waves"]
+            block.cells = data["cells"]
+            block.present = data["present"]
+            block.counters = data["counters"].tolist()
+            block.timeTags = data["timeTags"].tolist()
+            count = len(block)
+            yield from split(block, np.full(count, float(data["bias"])),
+                np.tile(data["position"], (count, 1)), True)
+
+    def close(self):
+        pass
+
+# Saves every raw block of a run, with what's needed to correct it again
+class Dumper():
+
+    def __init__(self, directory, frequency, serial):
+        self.directory = directory
+        self.frequency = frequency
+        self.serial = serial
+        self.blocks = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def write(self, block, bias, x, y):
+        path = os.path.join(self.directory,
+            "block_{:08d}.npz".format(self.blocks))
+        np.savez(path, waves = block.waves, cells = block.cells,
+            present = block.present,
+            counters = np.asarray(block.counters, np.uint64),
+            timeTags = np.asarray(block.timeTags, np.uint64),
+            bias = bias, position = np.array([x, y], float),
+            frequency = self.frequency, serial = self.serial)
+        self.blocks += 1
+
+def dumpDirectory(directory, name):
+    return os.path.join(directory, "{}_raw".format(name))
+
+# Source for _path_: a raw dump directory or a ROOT file
+def source(path, chunk = CHUNK):
+    if os.path.isdir(path):
+        return DumpSource(path)
+    return TreeSource(path, chunk)
+
+# Holds segments back until the time they were taken at, relative to the
+# first event of their point
+class Pacer():
+
+    def __init__(self, period = accounting.TTT_PERIOD):
+        self.period = period
+        self.start()
+
+    def start(self):
+        self.began = None
+        self.first = None
+
+    def wait(self, segment):
+        tags = segment.block.timeTags
+        if not len(tags):
+            return
+        if self.began is None:
+            self.began = time.time()
+            self.first = tags[0]
+        delay = self.began + (tags[-1] - self.first) * self.period - \
+            time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,204 @@
+# Shared memory ring of readout blocks for local online consumers. The DAQ
+# writes every block into the next slot and never waits for anybody; readers
+# map the segment by name and follow at their own pace, skipping ahead when
+# they fall behind.
+#
+# Each slot has its own sequence number, zeroed while the slot is written
+# and set once it's complete (a seqlock): a reader checks it before and after
+# using a slot to know the data wasn't overwritten meanwhile.
+#
+# Layout: header, then _slots_ slots of slot header, counters, time tags,
+# start cells, group presence and waves, as in calibration.Block.
+
+from multiprocessing import shared_memory, resource_tracker
+import struct
+
+import numpy as np
+
+from . import calibration
+
+NAME = "ufsdpydaq"
+SLOTS = 8
+# Events per slot, the DT5742 holds 128 full length events
+EVENTS = 128
+MAGIC = b"UFSDRING"
+VERSION = 1
+# Magic, version, slots, events per slot, groups, channels per group,
+# samples, bytes per slot, latest sequence number
+HEADER = struct.Struct("<8sIIIIIIQQ")
+# Sequence number, events, bias, x, y
+SLOT_HEADER = struct.Struct("<QIddd")
+# Everything starts on a cache line
+ALIGN = 64
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+# Offset of every array within a slot and the slot size
+def layout(events, length):
+    shapes = [("counters", (events,), np.uint64),
+        ("timeTags", (events,), np.uint64),
+        ("cells", (events, calibration.GROUPS), np.int64),
+        ("present", (events, calibration.GROUPS), np.bool_),
+        ("waves", (events, calibration.GROUPS,
+            calibration.CHANNELS_PER_GROUP, length), np.float32)]
+    offset = align(SLOT_HEADER.size)
+    arrays = {}
+    for name, shape, dtype in shapes:
+        arrays[name] = (offset, shape, dtype)
+        offset = align(offset + int(np.prod(shape)) *
+            np.dtype(dtype).itemsize)
+    return arrays, offset
+
+# NumPy views of the arrays of the slot at _base_
+def views(buffer, base, arrays):
+    return {name: np.ndarray(shape, dtype, buffer, base + offset)
+        for name, (offset, shape, dtype) in arrays.items()}
+
+class Writer():
+
+    # Room for blocks of up to _events_ events of _length_ samples
+    def __init__(self, length, events = EVENTS, name = NAME, slots = SLOTS):
+        self.arrays, self.slotBytes = layout(events, length)
+        self.events = events
+        self.slots = slots
+        size = align(HEADER.size) + slots * self.slotBytes
+        try:
+            self.memory = shared_memory.SharedMemory(name, True, size)
+        except FileExistsError:
+            # Left behind by a run that didn't clean up
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name, True, size)
+        self.sequence = 0
+        self.slotViews = [views(self.memory.buf, self.base(i), self.arrays)
+            for i in range(slots)]
+        self.writeHeader()
+
+    def base(self, slot):
+        return align(HEADER.size) + slot * self.slotBytes
+
+    def writeHeader(self):
+        HEADER.pack_into(self.memory.buf, 0, MAGIC, VERSION, self.slots,
+            self.events, calibration.GROUPS, calibration.CHANNELS_PER_GROUP,
+            self.arrays["waves"][1][-1], self.slotBytes, self.sequence)
+
+    # Copy a calibration.Block taken at _bias_ and (_x_, _y_) into the next
+    # slot, larger blocks are split over several slots
+    def publish(self, block, bias, x, y):
+        for start in range(0, len(block), self.events):
+            self.publishSlice(block, start, min(start + self.events,
+                len(block)), bias, x, y)
+
+    def publishSlice(self, block, start, stop, bias, x, y):
+        self.sequence += 1
+        slot = self.sequence % self.slots
+        base = self.base(slot)
+        count = stop - start
+        length = min(block.waves.shape[-1], self.arrays["waves"][1][-1])
+
+        SLOT_HEADER.pack_into(self.memory.buf, base, 0, 0, 0, 0, 0)
+        arrays = self.slotViews[slot]
+        arrays["counters"][:count] = block.counters[start:stop]
+        arrays["timeTags"][:count] = block.timeTags[start:stop]
+        # Only the groups of one board fit
+        groups = calibration.GROUPS
+        arrays["cells"][:count] = block.cells[start:stop, :groups]
+        arrays["present"][:count] = block.present[start:stop, :groups]
+        arrays["waves"][:count, ..., :length] = \
+            block.waves[start:stop, :groups, ..., :length]
+        SLOT_HEADER.pack_into(self.memory.buf, base, self.sequence, count,
+            bias, x, y)
+        struct.pack_into("<Q", self.memory.buf, HEADER.size - 8,
+            self.sequence)
+
+    def close(self):
+        self.slotViews = []
+        self.memory.close()
+        self.memory.unlink()
+
+# One block as seen by a reader, its arrays are views into the shared
+# memory: check valid() after using them
+class Frame():
+
+    def __init__(self, reader, sequence, events, bias, x, y, arrays):
+        self.reader = reader
+        self.sequence = sequence
+        self.bias = bias
+        self.position = (x, y)
+        self.counters = arrays["counters"][:events]
+        self.timeTags = arrays["timeTags"][:events]
+        self.cells = arrays["cells"][:events]
+        self.present = arrays["present"][:events]
+        self.waves = arrays["waves"][:events]
+
+    def __len__(self):
+        return len(self.counters)
+
+    # Still the same block, not overwritten by the DAQ meanwhile?
+    def valid(self):
+        return self.reader.slotSequence(self.sequence) == self.sequence
+
+class Reader():
+
+    def __init__(self, name = NAME):
+        try:
+            self.memory = shared_memory.SharedMemory(name, track = False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the segment to be
+            # removed when this process exits, it belongs to the DAQ
+            self.memory = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self.memory._name, "shared_memory")
+
+        (magic, version, self.slots, self.events, groups, channels, length,
+            self.slotBytes, latest) = HEADER.unpack_from(self.memory.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} ring".format(name,
+                VERSION))
+        self.arrays, slotBytes = layout(self.events, length)
+        self.slotViews = [views(self.memory.buf, self.base(i), self.arrays)
+            for i in range(self.slots)]
+        # Start from what comes next
+        self.last = latest
+        self.skipped = 0
+
+    def base(self, slot):
+        return align(HEADER.size) + slot * self.slotBytes
+
+    @property
+    def latest(self):
+        return struct.unpack_from("<Q", self.memory.buf, HEADER.size - 8)[0]
+
+    def slotSequence(self, sequence):
+        return struct.unpack_from("<Q", self.memory.buf,
+            self.base(sequence % self.slots))[0]
+
+    # The next block not read yet, None if there is none. Blocks already
+    # overwritten are skipped and counted in _skipped_.
+    def next(self):
+        latest = self.latest
+        if latest <= self.last:
+            return None
+        # Keep one slot of margin from the writer
+        oldest = max(self.last + 1, latest - self.slots + 2)
+        self.skipped += oldest - self.last - 1
+        for sequence in range(oldest, latest + 1):
+            self.last = sequence
+            base = self.base(sequence % self.slots)
+            written, events, bias, x, y = SLOT_HEADER.unpack_from(
+                self.memory.buf, base)
+            if written != sequence:
+                self.skipped += 1
+                continue
+            return Frame(self, sequence, events, bias, x, y,
+                self.slotViews[sequence % self.slots])
+        return None
+
+    def close(self):
+        self.slotViews = []
+        self.memory.close()
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,8 @@
+# Simulated instruments, picked by the hardware modules when UFSDPYDAQ_SIMULATE
+# is set. caen, ximc and visa are imported by digitizer, stage and
+# highvoltage respectively.
+from . import clock, tree, scan
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,427 @@
+# Simulated CAEN DT5742, implements the part of the CAENDigitizer API used
+# by digitizer.py. Triggers arrive as a Poisson process and every event
+# carries synthetic DRS4 pulses.
+
+from collections import deque
+from ctypes import *
+import math, os, random
+
+import numpy as np
+
+from .. import accounting, digitizer
+from . import clock
+
+# Default trigger rate, 0 means the board memory is always full
+TRIGGER_RATE = 0 # Hz
+# Board memory, in events (1024 samples per channel)
+MEMORY_EVENTS = 128
+# Acquisition status register bits
+STATUS_RUN = 1 << 2
+STATUS_READY = 1 << 3
+STATUS_FULL = 1 << 4
+STATUS_PLL = 1 << 7
+STATUS_BOARD_READY = 1 << 8
+# DRS4 samples are 12 bit
+ADC_MAX = 4095
+# Number of different events generated per record length, decoding copies
+# one of them into the event buffers
+BANK_SIZE = 16
+# Link bandwidth, only used to account for transfer time in virtual time
+LINK_BANDWIDTH = 80E6 # B/s
+# Number of DRS4 cells
+CELLS = 1024
+
+# Pulse shape and noise, in ADC counts and samples
+BASELINE = 3000
+NOISE = 2.5
+AMPLITUDE_MPV = 400
+RISE_TIME = 8
+FALL_TIME = 40
+TRIGGER_AMPLITUDE = 1500
+# TR0 rate against the distance between threshold and DC offset, in DAC
+# counts: a gaussian noise wall around zero distance and signals whose rate
+# falls off past SIGNAL_EDGE
+NOISE_RATE = 10E6 # Hz
+NOISE_WIDTH = 80
+SIGNAL_EDGE = 16000
+SIGNAL_FALL = 2000
+# Spread of the DRS4 cell and per sample offsets added to raw samples when
+# the correction is off, ADC counts, and of the cell widths, fraction
+CELL_SPREAD = 15
+NSAMPLE_SPREAD = 2
+TIME_SPREAD = 0.05
+
+# Board settings after a reset, named after CAEN_DGTZ_Get/Set functions
+DEFAULT_SETTINGS = {"RecordLength": 1024, "MaxNumEventsBLT": 1023,
+    "GroupEnableMask": 0b11}
+
+# Bytes per event as sent over the link: 12 bit samples for 9 channels
+# per group plus headers
+def eventBytes(length, groups):
+    return 16 + groups * (12 + 9 * length * 3 // 2)
+
+def value(arg):
+    return arg.value if hasattr(arg, "value") else arg
+
+# One DT5742 as seen through a handle
+class Board():
+
+    def __init__(self, number, rate):
+        self.number = number
+        self.rate = rate
+        self.reset()
+
+        # Event object and readout buffer, once allocated
+        self.event = None
+        self.buffer = None
+        self.samples = [[(c_float * CELLS)() for c in range(9)]
+            for g in range(2)]
+        self.banks = {}
+        self.correction = False
+        self.tables = makeTables(number)
+
+    def reset(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.registers = {}
+        self.running = False
+        self.memory = deque()
+        self.block = []
+        self.counter = 0
+        self.full = False
+        self.began = clock.time()
+        self.nextTrigger = None
+
+    @property
+    def groups(self):
+        mask = self.settings["GroupEnableMask"]
+        return [g for g in range(2) if mask & (1 << g)]
+
+    def start(self):
+        self.running = True
+        self.memory.clear()
+        self.counter = 0
+        self.full = False
+        self.began = clock.time()
+        self.nextTrigger = self.began + self.interval()
+
+    def stop(self):
+        self.running = False
+
+    def interval(self):
+        return random.expovariate(self.triggerRate) \
+            if self.triggerRate > 0 else 0
+
+    # Rate of TR0 triggers for the current threshold and offset, only the
+    # unlimited rate stays unlimited
+    @property
+    def triggerRate(self):
+        if self.rate <= 0:
+            return 0
+        distance = abs(
+            self.settings.get(("GroupFastTriggerThreshold", 0), 0) -
+            self.settings.get(("GroupFastTriggerDCOffset", 0), 0))
+        noise = NOISE_RATE * math.exp(-(distance / NOISE_WIDTH) ** 2 / 2)
+        signal = self.rate * min(1, math.exp(-(distance - SIGNAL_EDGE) /
+            SIGNAL_FALL))
+        return noise + signal
+
+    # Store one trigger happening at time _when_. Software triggers see
+    # only the baseline, no pulse.
+    def trigger(self, when, software = False):
+        if len(self.memory) >= MEMORY_EVENTS:
+            self.full = True
+            return
+        tag = int((when - self.began) / accounting.TTT_PERIOD) & 0xFFFFFFFF
+        variant = random.randrange(BANK_SIZE)
+        self.memory.append((self.counter & 0x3FFFFF, tag,
+            random.randrange(CELLS), -1 - variant if software else variant))
+        self.counter += 1
+
+    # Let triggers happen up to now
+    def advance(self):
+        # TR0 triggers need the fast trigger enabled
+        if not self.running or not self.settings.get("FastTriggerMode", 0):
+            return
+        now = clock.time()
+
+        # Unlimited rate: memory refills as soon as it's read
+        if self.rate <= 0:
+            while len(self.memory) < MEMORY_EVENTS:
+                self.trigger(now)
+            return
+
+        # In virtual time nothing happens unless somebody sleeps, so wait
+        # for the next trigger when there's nothing to read
+        if clock.isVirtual() and not self.memory and self.nextTrigger > now:
+            clock.sleep(self.nextTrigger - now)
+            now = clock.time()
+
+        while self.nextTrigger <= now:
+            if len(self.memory) >= MEMORY_EVENTS:
+                # Nothing more fits, skip ahead (triggers are memoryless)
+                self.full = True
+                self.nextTrigger = now + self.interval()
+                break
+            self.trigger(self.nextTrigger)
+            self.nextTrigger += self.interval()
+
+    def read(self):
+        self.advance()
+        count = min(len(self.memory), self.settings["MaxNumEventsBLT"])
+        self.block = [self.memory.popleft() for i in range(count)]
+        if count:
+            self.full = False
+
+        size = count * eventBytes(self.settings["RecordLength"],
+            len(self.groups))
+        if clock.isVirtual():
+            clock.sleep(size / LINK_BANDWIDTH)
+        return size
+
+    # Pre-generated events for the current record length, with or without
+    # a pulse
+    def bank(self, pulse = True):
+        key = (self.settings["RecordLength"], pulse)
+        if key not in self.banks:
+            self.banks[key] = [makeEvent(key[0], pulse)
+                for i in range(BANK_SIZE)]
+        return self.banks[key]
+
+    def status(self):
+        status = STATUS_PLL | STATUS_BOARD_READY
+        if self.running:
+            status |= STATUS_RUN
+        if self.memory:
+            status |= STATUS_READY
+        if self.full:
+            status |= STATUS_FULL
+        return status
+
+# Correction tables of one board, always the same for the same board. Time
+# tables are for a 5 GHz cell width, in ns.
+def makeTables(number):
+    generator = np.random.default_rng(number)
+    cell = np.round(generator.normal(0, CELL_SPREAD, (2, 9, CELLS)))
+    nsample = np.round(generator.normal(0, NSAMPLE_SPREAD, (2, 9, CELLS)))
+    widths = 0.2 * (1 + generator.uniform(-TIME_SPREAD, TIME_SPREAD,
+        (2, CELLS)))
+    time = np.cumsum(widths, axis = 1) - widths[:, :1]
+    return cell.astype(np.int16), nsample.astype(np.int8), \
+        time.astype(np.float32)
+
+# Each event has 2 groups x 9 channels of samples, the 9th channel of each
+# group being the digitized TR0
+def makeEvent(length, pulse = True):
+    amplitude = AMPLITUDE_MPV * (1 + 0.3 * abs(random.gauss(0, 1)))
+    arrival = length * random.uniform(0.3, 0.5)
+
+    groups = []
+    for g in range(2):
+        channels = []
+        for c in range(9):
+            wave = (c_float * length)()
+            for i in range(length):
+                sample = BASELINE + random.gauss(0, NOISE)
+                t = i - arrival
+                if pulse and c == 8:
+                    sample -= TRIGGER_AMPLITUDE if 0 <= t < 4 * FALL_TIME else 0
+                elif pulse and t > 0:
+                    sample -= amplitude * (1 - math.exp(-t / RISE_TIME)) \
+                        * math.exp(-t / FALL_TIME)
+                wave[i] = min(max(sample, 0), ADC_MAX)
+            channels.append(wave)
+        groups.append(channels)
+    return groups
+
+# Drop-in replacement for the CDLL object in digitizer.py. Functions that are
+# not implemented explicitly only store their arguments and return 0.
+class SimulatedDigitizer():
+
+    def __init__(self, rate = None):
+        if rate is None:
+            rate = float(os.environ.get("UFSDPYDAQ_SIM_RATE", TRIGGER_RATE))
+        self.rate = rate
+        self.boards = {}
+
+    def board(self, handle):
+        return self.boards[value(handle)]
+
+    # CAEN_DGTZ_Set<name>(handle, [index,] value) stores the value and
+    # CAEN_DGTZ_Get<name>(handle, [index,] &value) reads it back
+    def __getattr__(self, name):
+        if not name.startswith("CAEN_DGTZ_"):
+            raise AttributeError(name)
+        function = name[len("CAEN_DGTZ_"):]
+        setting = function[3:]
+
+        def call(handle, *args):
+            settings = self.board(handle).settings
+            if not args or function[:3] not in ("Set", "Get"):
+                return 0
+            key = setting if len(args) == 1 else (setting, value(args[0]))
+            if function.startswith("Set"):
+                settings[key] = value(args[-1])
+            else:
+                args[-1]._obj.value = settings.get(key, 0)
+            return 0
+        return call
+
+    # Boards keep their settings between connections, like the real ones
+    def CAEN_DGTZ_OpenDigitizer(self, link, number, conet, address, handle):
+        number = value(number)
+        if number not in self.boards:
+            self.boards[number] = Board(number, self.rate)
+        handle._obj.value = number
+        return 0
+
+    def CAEN_DGTZ_CloseDigitizer(self, handle):
+        self.board(handle).stop()
+        return 0
+
+    def CAEN_DGTZ_Reset(self, handle):
+        self.board(handle).reset()
+        return 0
+
+    def CAEN_DGTZ_WriteRegister(self, handle, address, data):
+        self.board(handle).registers[value(address)] = value(data)
+        return 0
+
+    def CAEN_DGTZ_ReadRegister(self, handle, address, dest):
+        board = self.board(handle)
+        address = value(address)
+        if address == 0x8104:
+            # The status is live, triggers may have filled the memory
+            board.advance()
+            dest._obj.value = board.status()
+        else:
+            dest._obj.value = board.registers.get(address, 0)
+        return 0
+
+    def CAEN_DGTZ_GetInfo(self, handle, info):
+        info = info._obj
+        info.ModelName = b"DT5742"
+        info.Model = 5742
+        info.Channels = 16
+        info.SerialNumber = 10000 + value(handle)
+        info.ADC_NBits = 12
+        return 0
+
+    def CAEN_DGTZ_EnableDRS4Correction(self, handle):
+        self.board(handle).correction = True
+        return 0
+
+    def CAEN_DGTZ_DisableDRS4Correction(self, handle):
+        self.board(handle).correction = False
+        return 0
+
+    def CAEN_DGTZ_GetCorrectionTables(self, handle, frequency, tables):
+        cell, nsample, time = self.board(handle).tables
+        for g in range(2):
+            np.ctypeslib.as_array(tables._obj[g].cell)[:] = cell[g]
+            np.ctypeslib.as_array(tables._obj[g].nsample)[:] = nsample[g]
+            np.ctypeslib.as_array(tables._obj[g].time)[:] = time[g]
+        return 0
+
+    def CAEN_DGTZ_AllocateEvent(self, handle, event):
+        board = self.board(handle)
+        board.event = digitizer.Event()
+        event[0] = addressof(board.event)
+        return 0
+
+    def CAEN_DGTZ_FreeEvent(self, handle, event):
+        self.board(handle).event = None
+        return 0
+
+    def CAEN_DGTZ_MallocReadoutBuffer(self, handle, buffer, size):
+        board = self.board(handle)
+        # Events are kept in Python, the buffer only needs one byte per
+        # event so that event pointers can be told apart
+        board.buffer = create_string_buffer(MEMORY_EVENTS + 1)
+        buffer._obj.contents = c_char.from_buffer(board.buffer)
+        size._obj.value = MEMORY_EVENTS * eventBytes(CELLS, 2)
+        return 0
+
+    def CAEN_DGTZ_FreeReadoutBuffer(self, buffer):
+        return 0
+
+    def CAEN_DGTZ_ClearData(self, handle):
+        self.board(handle).memory.clear()
+        return 0
+
+    def CAEN_DGTZ_SWStartAcquisition(self, handle):
+        self.board(handle).start()
+        return 0
+
+    def CAEN_DGTZ_SWStopAcquisition(self, handle):
+        self.board(handle).stop()
+        return 0
+
+    def CAEN_DGTZ_SendSWtrigger(self, handle):
+        board = self.board(handle)
+        if board.running:
+            board.trigger(clock.time(), True)
+        return 0
+
+    def CAEN_DGTZ_ReadData(self, handle, mode, buffer, size):
+        size._obj.value = self.board(handle).read()
+        return 0
+
+    def CAEN_DGTZ_GetNumEvents(self, handle, buffer, size, number):
+        number._obj.value = len(self.board(handle).block)
+        return 0
+
+    def CAEN_DGTZ_GetEventInfo(self, handle, buffer, size, index, info,
+        pointer):
+        board = self.board(handle)
+        index = value(index)
+        counter, tag, cell, variant = board.block[index]
+
+        info = info._obj
+        info.EventSize = eventBytes(board.settings["RecordLength"],
+            len(board.groups))
+        info.BoardId = 0
+        info.Pattern = 0
+        info.ChannelMask = board.settings["GroupEnableMask"]
+        info.EventCounter = counter
+        info.TriggerTimeTag = tag
+
+        pointer._obj.contents = c_char.from_buffer(board.buffer, index)
+        return 0
+
+    def CAEN_DGTZ_DecodeEvent(self, handle, pointer, event):
+        board = self.board(handle)
+        index = cast(pointer, c_void_p).value - addressof(board.buffer)
+        counter, tag, cell, variant = board.block[index]
+
+        length = board.settings["RecordLength"]
+        if variant < 0:
+            template = board.bank(False)[-1 - variant]
+        else:
+            template = board.bank()[variant]
+        decoded = board.event
+        for g in range(2):
+            present = g in board.groups
+            decoded.GrPresent[g] = 1 if present else 0
+            if not present:
+                continue
+
+            group = decoded.DataGroup[g]
+            group.StartIndexCell = cell
+            group.TriggerTimeLag = 0
+            for c in range(9):
+                memmove(board.samples[g][c], template[g][c],
+                    length * sizeof(c_float))
+                # Raw samples carry the cell and per sample offsets
+                if not board.correction:
+                    samples = np.ctypeslib.as_array(board.samples[g][c])
+                    cells = (cell + np.arange(length)) % CELLS
+                    samples[:length] += board.tables[0][g][c][cells] + \
+                        board.tables[1][g][c][:length]
+                group.ChSize[c] = length
+                group.DataChannel[c] = cast(board.samples[g][c],
+                    POINTER(c_float))
+        return 0
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,50 @@
+# Clocks used by the simulated instruments. The module itself can stand in
+# for the time module: time() and sleep() go to the active clock.
+
+import time as systime
+
+# Wall clock, simulated instruments run in real time
+class Clock():
+    virtual = False
+
+    def time(self):
+        return systime.perf_counter()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            systime.sleep(seconds)
+
+# Virtual clock, sleeping only moves the time forward. A whole scan runs
+# as fast as the code around the simulated instruments allows.
+class VirtualClock():
+    virtual = True
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+active = Clock()
+
+# Make every simulated instrument use _clock_
+def use(clock):
+    global active
+    active = clock
+
+def time():
+    return active.time()
+
+def sleep(seconds):
+    active.sleep(seconds)
+
+def isVirtual():
+    return active.virtual
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
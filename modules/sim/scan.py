@@ -0,0 +1,65 @@
+# Bookkeeping for whole scan simulations, see simulate.py.
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import clock
+
+CATEGORIES = ["motion", "ramps", "acquisition", "processing", "I/O"]
+
+# Splits the (virtual) time of a run into categories. Categories nest: time
+# spent in an inner category is not counted in the outer one.
+class Breakdown():
+
+    def __init__(self):
+        self.totals = OrderedDict((c, 0.0) for c in CATEGORIES)
+        self.stack = []
+        self.began = clock.time()
+        self.mark = self.began
+
+    @contextmanager
+    def category(self, name):
+        self.switch()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.switch()
+            self.stack.pop()
+
+    # Charge the time since the last mark to the current category
+    def switch(self):
+        now = clock.time()
+        if self.stack:
+            self.totals[self.stack[-1]] = \
+                self.totals.get(self.stack[-1], 0) + now - self.mark
+        self.mark = now
+
+    # Wrap _func_ so that its time goes to _name_
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            with self.category(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    @property
+    def total(self):
+        return clock.time() - self.began
+
+    def report(self):
+        total = self.total
+        totals = OrderedDict(self.totals)
+        totals["other"] = total - sum(self.totals.values())
+        return total, totals
+
+# 3725 -> "1h 02m 05s"
+def formatDuration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{}h {:02d}m {:02d}s".format(hours, minutes, seconds)
+    return "{}m {:02d}s".format(minutes, seconds)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,73 @@
+# Stand-in for io.tree.TreeFile that only counts what would be written.
+
+from array import array
+
+from . import clock
+
+# Bytes per stored sample, TreeFile writes doubles
+SAMPLE_BYTES = 8
+# Disk throughput, only used to account for write time in virtual time
+DISK_BANDWIDTH = 150E6 # B/s
+
+class NullTreeFile():
+
+    def __init__(self, path = None, name = None, compression = 0,
+        channels = 32, used = None):
+        self.bias = array("d", [0.0])
+        self.entries = 0
+        self.points = 0
+        # Bytes filled since the last write() and in total
+        self.pending = 0
+        self.bytes = 0
+
+    def fill(self):
+        self.entries += 1
+
+    def fillPoint(self, values):
+        self.points += 1
+
+    def rolled(self):
+        return []
+
+    def clearEvent(self):
+        pass
+
+    def clearMeta(self):
+        pass
+
+    def write(self):
+        if clock.isVirtual():
+            clock.sleep(self.pending / DISK_BANDWIDTH)
+        self.bytes += self.pending
+        self.pending = 0
+
+    def close(self):
+        self.write()
+
+    def setChannel(self, index, data, length):
+        self.pending += length * SAMPLE_BYTES
+
+    def setTrigger(self, index, data, length):
+        self.pending += length * SAMPLE_BYTES
+
+    def setEventInfo(self, counter, timeTag):
+        pass
+
+    def setStartCell(self, group, cell):
+        pass
+
+    def setFrequency(self, frequency):
+        pass
+
+    def setEventLength(self, length):
+        pass
+
+    def setPosition(self, x, y):
+        pass
+
+    def setBias(self, bias):
+        self.bias[0] = float(bias)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
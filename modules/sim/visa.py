@@ -0,0 +1,115 @@
+# Simulated CAEN DT1471ET speaking its serial command protocol, stands in for
+# the pyvisa module in highvoltage.py.
+
+from . import clock
+
+MODEL = "DT1471ET"
+CHANNELS = 4
+# Default ramp rates, Volt/s
+RAMP_UP = 50
+RAMP_DOWN = 50
+# Time for one command/answer round trip on the serial line
+COMMAND_LATENCY = 20E-3 # s
+# Leakage current shown by IMON, uA per Volt
+LEAKAGE = 1E-3
+
+RESOURCES = ("ASRL/dev/ttyACM0::INSTR",)
+
+class Channel():
+
+    def __init__(self):
+        self.on = False
+        self.target = 0.0
+        self.voltage = 0.0
+        self.rampUp = RAMP_UP
+        self.rampDown = RAMP_DOWN
+        self.updated = clock.time()
+
+    # Ramp towards the set voltage (or zero if off) up to now
+    def update(self):
+        now = clock.time()
+        elapsed = now - self.updated
+        self.updated = now
+
+        target = self.target if self.on else 0.0
+        if self.voltage < target:
+            self.voltage = min(target, self.voltage + self.rampUp * elapsed)
+        else:
+            self.voltage = max(target, self.voltage - self.rampDown * elapsed)
+
+class PowerSupply():
+
+    def __init__(self):
+        self.query_delay = 0
+        self.channels = [Channel() for c in range(CHANNELS)]
+
+    # Parse "$BD:0,CMD:SET,CH:1,PAR:VSET,VAL:100" and answer like the DT1471
+    def query(self, cmd):
+        clock.sleep(COMMAND_LATENCY + self.query_delay)
+        for channel in self.channels:
+            channel.update()
+
+        fields = {}
+        for field in cmd.lstrip("$").split(","):
+            key, sep, value = field.partition(":")
+            fields[key] = value
+
+        board = fields.get("BD", "0")
+        command, param = fields.get("CMD"), fields.get("PAR")
+        try:
+            channel = self.channels[int(fields["CH"])] \
+                if "CH" in fields else None
+        except (ValueError, IndexError):
+            return "#BD:{},CMD:ERR\r\n".format(board)
+
+        if command == "MON":
+            if param == "BDCTR":
+                value = "REMOTE"
+            elif param == "BDNAME":
+                value = MODEL
+            elif param == "VMON" and channel:
+                value = "{:.1f}".format(channel.voltage)
+            elif param == "IMON" and channel:
+                value = "{:.4f}".format(channel.voltage * LEAKAGE)
+            elif param == "VSET" and channel:
+                value = "{:.1f}".format(channel.target)
+            else:
+                return "#BD:{},CMD:ERR\r\n".format(board)
+            return "#BD:{},CMD:OK,VAL:{}\r\n".format(board, value)
+
+        if command == "SET" and channel:
+            if param == "ON":
+                channel.on = True
+            elif param == "OFF":
+                channel.on = False
+            elif param == "VSET":
+                channel.target = float(fields["VAL"])
+            elif param == "RUP":
+                channel.rampUp = float(fields["VAL"])
+            elif param == "RDW":
+                channel.rampDown = float(fields["VAL"])
+            else:
+                return "#BD:{},CMD:ERR\r\n".format(board)
+            return "#BD:{},CMD:OK\r\n".format(board)
+
+        return "#BD:{},CMD:ERR\r\n".format(board)
+
+    def close(self):
+        pass
+
+class ResourceManager():
+
+    def __init__(self, backend = None):
+        self.supplies = {}
+
+    def list_resources(self):
+        return RESOURCES
+
+    def open_resource(self, resource):
+        if resource not in RESOURCES:
+            raise ValueError(resource)
+        return self.supplies.setdefault(resource, PowerSupply())
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
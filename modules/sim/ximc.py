@@ -0,0 +1,178 @@
+# Simulated Standa 8MTF controllers, implements the part of the libximc API
+# used by stage.py. Axes follow a trapezoidal speed profile.
+
+from ctypes import *
+import math
+
+from . import clock
+
+# Axes found by enumerate_devices
+AXES = 2
+# Default motion settings, steps/s and steps/s^2
+SPEED = 1500
+ACCELERATION = 1000
+DECELERATION = 1000
+# Time taken by each command sent over USB
+COMMAND_LATENCY = 1E-3 # s
+# Travel range, moves are clamped to it
+TRAVEL = 25E3 / 2.496 # steps
+
+def value(arg):
+    return arg.value if hasattr(arg, "value") else arg
+
+# Position (in steps) of an axis that started at _start_ towards _target_,
+# _elapsed_ seconds ago. Returns the position and whether it stopped.
+def profile(start, target, elapsed, speed, accel, decel):
+    distance = abs(target - start)
+    direction = 1 if target >= start else -1
+    if distance == 0 or speed <= 0:
+        return target, True
+
+    # Distance needed to reach full speed and to stop from it
+    up = speed ** 2 / (2 * accel)
+    down = speed ** 2 / (2 * decel)
+    if up + down > distance:
+        # Triangular profile, never reaches full speed
+        peak = math.sqrt(2 * distance * accel * decel / (accel + decel))
+        up = peak ** 2 / (2 * accel)
+        down = distance - up
+    else:
+        peak = speed
+    tUp = peak / accel
+    tFlat = (distance - up - down) / peak
+    tDown = peak / decel
+
+    if elapsed >= tUp + tFlat + tDown:
+        return target, True
+    if elapsed < tUp:
+        covered = accel * elapsed ** 2 / 2
+    elif elapsed < tUp + tFlat:
+        covered = up + peak * (elapsed - tUp)
+    else:
+        t = elapsed - tUp - tFlat
+        covered = up + peak * tFlat + peak * t - decel * t ** 2 / 2
+    return start + direction * covered, False
+
+# Time needed to go from _start_ to _target_
+def duration(start, target, speed, accel, decel):
+    distance = abs(target - start)
+    if distance == 0 or speed <= 0:
+        return 0
+    up = speed ** 2 / (2 * accel)
+    down = speed ** 2 / (2 * decel)
+    if up + down > distance:
+        peak = math.sqrt(2 * distance * accel * decel / (accel + decel))
+        return peak / accel + peak / decel
+    return speed / accel + (distance - up - down) / speed + speed / decel
+
+class Axis():
+
+    def __init__(self):
+        self.position = 0.0 # steps
+        self.start = 0.0
+        self.target = 0.0
+        self.began = clock.time()
+        self.speed = SPEED
+        self.accel = ACCELERATION
+        self.decel = DECELERATION
+        self.microstep = 9
+
+    def now(self):
+        position, stopped = profile(self.start, self.target,
+            clock.time() - self.began, self.speed, self.accel, self.decel)
+        return position
+
+    def move(self, target):
+        self.start = self.now()
+        self.target = min(max(target, -TRAVEL), TRAVEL)
+        self.began = clock.time()
+
+    # Seconds until this axis stops
+    def remaining(self):
+        elapsed = clock.time() - self.began
+        return max(0, duration(self.start, self.target, self.speed,
+            self.accel, self.decel) - elapsed)
+
+class SimulatedStageAPI():
+
+    def __init__(self, axes = AXES):
+        self.axes = {}
+        self.names = [b"xi-emu:///sim%d" % i for i in range(axes)]
+
+    def enumerate_devices(self, flags, hints):
+        return self.names
+
+    def get_device_count(self, devices):
+        return len(devices)
+
+    def get_device_name(self, devices, index):
+        index = value(index)
+        return devices[index] if 0 <= index < len(devices) else None
+
+    def open_device(self, name):
+        handle = self.names.index(name) + 1
+        self.axes[handle] = Axis()
+        return handle
+
+    def axis(self, handle):
+        return self.axes[value(handle)]
+
+    def close_device(self, handle):
+        address = cast(handle._obj, c_void_p).value
+        self.axes.pop(address, None)
+        return 0
+
+    def command_move_calb(self, handle, position, units):
+        clock.sleep(COMMAND_LATENCY)
+        self.axis(handle).move(value(position) / units._obj.A)
+        return 0
+
+    # Block until the axis stops, polling every _interval_ ms as the real
+    # library does
+    def command_wait_for_stop(self, handle, interval):
+        interval = value(interval) / 1E3
+        remaining = self.axis(handle).remaining()
+        polls = math.ceil(remaining / interval) if interval > 0 else 0
+        clock.sleep(max(polls * interval, COMMAND_LATENCY))
+        return 0
+
+    def command_zero(self, handle):
+        clock.sleep(COMMAND_LATENCY)
+        axis = self.axis(handle)
+        axis.start = axis.target = 0.0
+        return 0
+
+    def get_engine_settings(self, handle, settings):
+        settings._obj.MicrostepMode = self.axis(handle).microstep
+        return 0
+
+    def set_engine_settings(self, handle, settings):
+        clock.sleep(COMMAND_LATENCY)
+        self.axis(handle).microstep = settings._obj.MicrostepMode
+        return 0
+
+    def get_move_settings(self, handle, settings):
+        axis = self.axis(handle)
+        settings._obj.Speed = int(axis.speed)
+        settings._obj.Accel = int(axis.accel)
+        settings._obj.Decel = int(axis.decel)
+        return 0
+
+    def set_move_settings(self, handle, settings):
+        clock.sleep(COMMAND_LATENCY)
+        axis = self.axis(handle)
+        axis.speed = settings._obj.Speed
+        axis.accel = settings._obj.Accel or ACCELERATION
+        axis.decel = settings._obj.Decel or DECELERATION
+        return 0
+
+    def get_position_calb(self, handle, position, units):
+        clock.sleep(COMMAND_LATENCY)
+        steps = self.axis(handle).now()
+        position._obj.Position = steps * units._obj.A
+        position._obj.EncPosition = int(steps)
+        return 0
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -1,7 +1,9 @@
 # Standa 8MTF control module, not all original API features supported.
 
 from ctypes import *
-import urllib.parse
+import os, urllib.parse
+
+from . import trace
 
 # Container for the transformation coefficient between steps and *meters
 class CustomUnits(LittleEndianStructure):
@@ -44,7 +46,20 @@ class Position(Structure):
 		("EncPosition", c_longlong)]
 
 SO_FILENAME = "libximc.so.7"
-API = CDLL("/usr/lib/" + SO_FILENAME)
+# Loaded by load() when the first Stage is created
+API = None
+
+# Load libximc, or the simulated controllers (see sim/ximc.py) if
+# UFSDPYDAQ_SIMULATE is set
+def load():
+    global API
+    if API is not None:
+        return
+    if os.environ.get("UFSDPYDAQ_SIMULATE"):
+        from .sim import ximc
+        API = ximc.SimulatedStageAPI()
+    else:
+        API = CDLL("/usr/lib/" + SO_FILENAME)
 
 # Absolute maximum speed in steps/min
 MAX_STEP_SPEED = 2000
@@ -135,6 +150,7 @@ class Stage():
 
     # Connect to each axis
     def __init__(self, axes, units = None):
+        load()
         self.devices = API.enumerate_devices(0x01, b"addr=")
         self.connected = True
 
@@ -184,6 +200,7 @@ class Stage():
         for k, coord in coords.items():
             self.axes[k].to(coord, wait)
 
+    @trace.traced("stage.to2d")
     def to2d(self, x, y, wait = True):
         coords = {"x": x, "y": y}
         self.to(coords, wait)
@@ -218,5 +235,3 @@ def __init__():
 if __name__ == "__main__":
     print("I'm a module, please don't run me alone.")
     exit()
-else:
-    print("[Stage ok] ", end = "")
@@ -0,0 +1,120 @@
+# Span timing for the readout pipeline, exported as a Chrome trace.
+# Everything is a no-op until enable() is called, so the decorators can stay
+# on the hot paths for good.
+
+import functools, json, os, random, threading, time
+
+# Raw spans kept for the Chrome trace, past this only statistics are updated
+MAX_TRACE_EVENTS = 1000000
+# Span durations kept per name to estimate percentiles (reservoir sampling)
+RESERVOIR_SIZE = 10000
+
+enabled = False
+
+events = []
+stats = {}
+counters = {"events": 0, "bytes": 0}
+began = 0
+
+# Start recording spans, clears anything recorded so far
+def enable():
+    global enabled, began
+    events.clear()
+    stats.clear()
+    for k in counters:
+        counters[k] = 0
+    began = time.perf_counter_ns()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+# Store one span, _begin_ and _end_ are perf_counter_ns() readings
+def record(name, begin, end):
+    duration = end - begin
+    if len(events) < MAX_TRACE_EVENTS:
+        events.append((name, begin, duration, threading.get_ident()))
+
+    stat = stats.get(name)
+    if stat is None:
+        stat = stats[name] = Stat()
+    stat.add(duration)
+
+# Add to the run totals used for the events/s and MB/s figures
+def count(events = 0, bytes = 0):
+    if enabled:
+        counters["events"] += events
+        counters["bytes"] += bytes
+
+# Time every call to the decorated function
+def traced(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            begin = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, begin, time.perf_counter_ns())
+        return wrapper
+    return decorate
+
+# Running total of one span name plus a uniform sample of its durations
+class Stat():
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.samples = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(duration)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = duration
+
+    def percentile(self, fraction):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return 0
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+# Write recorded spans to _path_ in Chrome trace format (chrome://tracing,
+# ui.perfetto.dev)
+def write(path):
+    pid = os.getpid()
+    trace = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+        "ts": (begin - began) / 1E3, "dur": duration / 1E3}
+        for name, begin, duration, tid in events]
+
+    with open(path, "w") as file:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+
+# Summary table: total, p50 and p99 per span plus overall throughput
+def summary():
+    elapsed = (time.perf_counter_ns() - began) / 1E9
+    lines = ["{:<24}{:>10}{:>12}{:>12}{:>12}".format("Span", "Calls",
+        "Total [s]", "p50 [ms]", "p99 [ms]")]
+
+    for name, stat in sorted(stats.items(), key = lambda s: -s[1].total):
+        lines.append("{:<24}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}".format(name,
+            stat.count, stat.total / 1E9, stat.percentile(0.5) / 1E6,
+            stat.percentile(0.99) / 1E6))
+
+    if elapsed > 0:
+        lines.append("{:.1f} events/s, {:.2f} MB/s over {:.1f} s".format(
+            counters["events"] / elapsed, counters["bytes"] / 1E6 / elapsed,
+            elapsed))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
@@ -0,0 +1,215 @@
+# TR0 trigger tuning by rate scan: the rate offered to the digitizer is
+# measured over short windows for different thresholds (or DC offsets) and
+# bisected towards a target rate, or towards the edge of the noise wall.
+#
+# Readout tuning: the block transfer size and the pause between readouts
+# are chosen point after point from the trigger rate, so that every
+# transfer carries a good part of the board memory without it ever filling.
+
+import math, time
+
+from . import accounting
+
+# DAC range of threshold and offset
+DAC_MIN = 0
+DAC_MAX = 65535
+# Time spent measuring each setting and between readouts
+WINDOW = 0.2 # s
+POLL_INTERVAL = 0.01 # s
+# Range searched around the configured value, DAC counts
+SPAN = 8000
+# Coarse scan points, closer than the width of the noise wall
+SCAN_POINTS = 33
+# Neighbouring settings whose rates differ more than this are on the noise
+# wall, the knee is where the wall starts
+KNEE_FACTOR = 3
+# Distance kept from the noise wall, DAC counts
+KNEE_MARGIN = 100
+# Bisection stops at this resolution (DAC counts) or relative rate error
+RESOLUTION = 4
+TOLERANCE = 0.1
+
+class TriggerTuner():
+
+    # _knob_ is "threshold" or "offset", the other one is held
+    def __init__(self, dgt, offset, threshold, knob = "threshold",
+        window = WINDOW):
+        self.dgt = dgt
+        self.settings = {"offset": offset, "threshold": threshold}
+        self.knob = knob
+        self.window = window
+        # (value, rate) of every measurement, in order
+        self.measured = []
+
+    @property
+    def value(self):
+        return self.settings[self.knob]
+
+    # Offered trigger rate with the knob at _value_, in Hz
+    def measure(self, value):
+        self.settings[self.knob] = value
+        self.dgt.setFastTriggerDCOffset(self.settings["offset"])
+        self.dgt.setFastTriggerThreshold(self.settings["threshold"])
+
+        counting = accounting.Accounting()
+        self.dgt.startAcquisition()
+        while time.time() - counting.began < self.window:
+            time.sleep(POLL_INTERVAL)
+            self.dgt.readData()
+            for i in range(self.dgt.getNumEvents()):
+                info = self.dgt.getEventInfo(i)
+                counting.add(info.EventCounter, info.TriggerTimeTag)
+        self.dgt.stopAcquisition()
+        counting.stop()
+
+        # Too few events to time them, count them over the window instead
+        rate = counting.offeredRate if counting.triggers > 2 \
+            else counting.acceptedRate
+        self.measured.append((value, rate))
+        print("  {} = {:5d}: {:12.1f} Hz".format(self.knob, value, rate))
+        return rate
+
+    # Coarse scan around the current value to find the noise wall. Returns
+    # the settings from the far end on the side of the current value up to
+    # the wall, with their rates, so the rate grows along them.
+    def scan(self, span = SPAN):
+        value = self.value
+        low = max(DAC_MIN, value - span)
+        high = min(DAC_MAX, value + span)
+        step = (high - low) / (SCAN_POINTS - 1)
+        values = [int(round(low + i * step)) for i in range(SCAN_POINTS)]
+        rates = [self.measure(v) for v in values]
+
+        wall = max(range(len(rates)), key = lambda i: rates[i])
+        floor = max(sorted(rates)[len(rates) // 2], 1 / self.window)
+        if rates[wall] <= KNEE_FACTOR * floor:
+            print("No noise wall in range")
+        # Only the side of the wall where the current value is
+        if value < values[wall]:
+            return values[:wall + 1], rates[:wall + 1]
+        return values[wall:][::-1], rates[wall:][::-1]
+
+    # Setting giving _target_ Hz, bisecting on the rate between the quiet
+    # end and the noise wall. Returns the setting and its rate.
+    def toRate(self, target, span = SPAN):
+        values, rates = self.scan(span)
+        best = min(zip(values, rates), key = lambda m: error(m[1], target))
+        above = next((i for i, rate in enumerate(rates) if rate >= target),
+            None)
+        if above is None or above == 0:
+            # Out of reach, the closest end will have to do
+            self.settings[self.knob] = best[0]
+            return best
+
+        quiet, noisy = values[above - 1], values[above]
+        while abs(noisy - quiet) > RESOLUTION:
+            middle = (quiet + noisy) // 2
+            rate = self.measure(middle)
+            if error(rate, target) < error(best[1], target):
+                best = (middle, rate)
+            if abs(rate - target) <= TOLERANCE * target:
+                break
+            if rate < target:
+                quiet = middle
+            else:
+                noisy = middle
+        self.settings[self.knob] = best[0]
+        return best
+
+    # Setting just before the noise wall, KNEE_MARGIN away from it on the
+    # quiet side. Returns the setting and its rate.
+    def knee(self, span = SPAN):
+        values, rates = self.scan(span)
+
+        # Walk back from the wall while the rate keeps dropping fast
+        edge = len(values) - 1
+        while edge > 0 and rates[edge] > KNEE_FACTOR * max(rates[edge - 1],
+            1 / self.window):
+            edge -= 1
+        if edge == len(values) - 1:
+            self.settings[self.knob] = values[edge]
+            return values[edge], rates[edge]
+
+        # The wall starts between values[edge] and values[edge + 1]
+        plateau = max(rates[edge], 1 / self.window)
+        inside, outside = values[edge], values[edge + 1]
+        while abs(outside - inside) > RESOLUTION:
+            middle = (inside + outside) // 2
+            if self.measure(middle) > KNEE_FACTOR * plateau:
+                outside = middle
+            else:
+                inside = middle
+
+        direction = 1 if outside > inside else -1
+        value = min(max(inside - direction * KNEE_MARGIN, DAC_MIN), DAC_MAX)
+        return value, self.measure(value)
+
+    # Config lines for the tuned setting
+    def snippet(self, comment):
+        return "# {}\nTRIGGER_THRESHOLD = {}\nTRIGGER_OFFSET = {}\n".format(
+            comment, self.settings["threshold"], self.settings["offset"])
+
+# Events the DT5742 memory holds
+MEMORY_EVENTS = 128
+# Share of the memory let fill up between readouts, and how low it goes
+# after the memory was found full
+FILL = 0.5
+MIN_FILL = 1 / 32
+# Longest pause between readouts
+MAX_POLL_INTERVAL = 0.1 # s
+MIN_BLT = 1
+
+class ReadoutTuner():
+
+    # Starts from _blt_ events per transfer, which is also the most it will
+    # use (the readout buffer is allocated for it), and _interval_ s
+    # between readouts
+    def __init__(self, blt, interval = 0, memory = MEMORY_EVENTS):
+        self.maxBlt = blt
+        self.blt = blt
+        self.interval = interval
+        self.memory = memory
+        self.fill = FILL
+        # (blt, interval, rate, full episodes) of every point
+        self.history = []
+
+    # Settings for the next point, after one with triggers at _rate_ Hz
+    # and _full_ full memory episodes. Returns whether they changed.
+    def update(self, rate, full):
+        self.history.append((self.blt, self.interval, rate, full))
+        old = (self.blt, self.interval)
+        if full:
+            self.fill = max(self.fill / 2, MIN_FILL)
+        else:
+            self.fill = min(self.fill * 2, FILL)
+
+        if rate <= 0:
+            self.blt, self.interval = min(self.memory, self.maxBlt), 0
+            return old != (self.blt, self.interval)
+
+        # Events piling up between readouts, read in one transfer with
+        # room to spare
+        events = self.fill * self.memory
+        interval = min(events / rate, MAX_POLL_INTERVAL)
+        if full:
+            # Whatever the rate says, wait less than last time
+            interval = min(interval, self.interval / 2)
+        self.interval = interval if interval >= 1E-4 else 0
+        # After a full memory every readout takes all there is, never more
+        # than the memory holds anyway
+        blt = self.memory if full else math.ceil(2 * events)
+        self.blt = int(min(max(blt, MIN_BLT), self.memory, self.maxBlt))
+        return old != (self.blt, self.interval)
+
+    # Config lines for the settings reached
+    def snippet(self, comment):
+        return "# {}\nBLT_SIZE = {}\nPOLL_INTERVAL = {}\n".format(comment,
+            self.blt, round(self.interval, 4))
+
+# Distance between two rates in decades
+def error(rate, target):
+    return abs(math.log10(max(rate, 1E-3)) - math.log10(max(target, 1E-3)))
+
+if __name__ == "__main__":
+    print("I'm a module, please don't run me alone.")
+    exit()
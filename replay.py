@@ -0,0 +1,150 @@
+# Run the online processing again on recorded data: wfm trees written by
+# main.py, or the raw blocks saved with RAW_DUMP (corrected again with the
+# cached tables of CALIBRATION_PATH). Every input goes through the same
+# block pipeline as the readout, writer, maps, histograms, shared memory and
+# monitor included, as configured, without touching any instrument.
+#
+# python replay.py config.ini INPUT [INPUT ...] [--realtime] [--jobs N]
+#                  [--output DIR] [--verbose]
+#
+# Inputs are replayed as fast as possible unless --realtime, which holds
+# every block back until its original time. Several inputs are replayed in
+# parallel with --jobs, each to INPUT_replay in --output (DATA_PATH if not
+# given). The throughput of every input is reported, for benchmarks.
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse, contextlib, os, sys, time
+
+import main
+from main import calibration, replay, formatted, FORMAT_NOTE, FORMAT_OK
+
+# UFSDPyDAQ fed by a recorded source instead of the instruments
+class ReplayDAQ(main.UFSDPyDAQ):
+
+    def prompt(self, question):
+        return ""
+
+    def connectHighVoltage(self):
+        self.hv = main.Nothing()
+        return False
+
+    def connectStage(self):
+        self.stage = main.Nothing()
+        return False
+
+    def setupDigitizer(self):
+        self.dgt = main.Nothing()
+
+    def disconnectDigitizer(self):
+        if self.corrector is not None:
+            self.corrector.close()
+            self.corrector = None
+
+    # Correct raw blocks with the tables cached for _serial_ at _frequency_
+    def useTables(self, serial, frequency):
+        path = calibration.cachePath(self.config.calibrationPath, serial,
+            frequency)
+        if os.path.exists(path):
+            tables = calibration.load(path)
+        else:
+            formatted("No tables in {}, raw blocks are only cleaned of "
+                "spikes".format(path), FORMAT_NOTE)
+            tables = calibration.ideal(frequency, serial)
+        self.corrector = calibration.Corrector(tables,
+            self.config.isCorrectionWorkerEnabled())
+
+    # Feed every segment of _source_ through the pipeline, returns the
+    # number of events
+    def replay(self, source, realtime = False):
+        if isinstance(source, replay.DumpSource):
+            self.useTables(source.serial, source.frequency)
+        pacer = replay.Pacer() if realtime else None
+        point = None
+        last = None
+        events = 0
+        for segment in source.segments():
+            tags = segment.block.timeTags
+            key = (segment.bias, segment.x, segment.y)
+            # Time tags restart with every point
+            if key != point or (len(tags) and tags[0] < last):
+                if point is not None:
+                    self.endPoint(*point[1:])
+                point = key
+                self.file.setBias(segment.bias)
+                if self.histograms is not None:
+                    self.histograms.setBias(segment.bias)
+                self.beginPoint(segment.x, segment.y)
+                if pacer is not None:
+                    pacer.start()
+            if len(tags):
+                last = tags[-1]
+            if pacer is not None:
+                pacer.wait(segment)
+
+            block = segment.block
+            for i in range(len(block)):
+                self.accounting.add(block.counters[i], block.timeTags[i])
+            if segment.raw and self.corrector is not None:
+                for ready in self.corrector.submit(block):
+                    self.writeBlock(ready)
+            else:
+                self.writeBlock(block)
+            events += len(block)
+        if point is not None:
+            self.endPoint(*point[1:])
+        return events
+
+# Replay _path_ with the config at _configPath_, to _output_. Returns the
+# input, its events and the time taken.
+def replayOne(configPath, path, output, realtime, verbose):
+    stream = sys.stdout if verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(stream):
+        config = main.io.config.Config(configPath)
+        if output is not None:
+            config.acq["DATA_PATH"] = output
+        config.acq["FILENAME"] = "{}_replay".format(
+            os.path.splitext(os.path.basename(os.path.normpath(path)))[0])
+        # Replayed blocks are not dumped again
+        config.acq["RAW_DUMP"] = False
+
+        began = time.time()
+        daq = ReplayDAQ(config)
+        daq.prepare()
+        source = replay.source(path)
+        events = daq.replay(source, realtime)
+        source.close()
+        daq.finish()
+        daq.disconnect()
+    return path, events, time.time() - began
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Replay recorded data")
+    parser.add_argument("config")
+    parser.add_argument("inputs", nargs = "+",
+        help = "ROOT files or raw dump directories")
+    parser.add_argument("--realtime", action = "store_true",
+        help = "Keep the original timing of the events")
+    parser.add_argument("--jobs", type = int, default = 1,
+        help = "Inputs replayed in parallel")
+    parser.add_argument("--output", help = "Output directory")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args()
+
+    began = time.time()
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            results = list(pool.map(replayOne,
+                *zip(*[(args.config, path, args.output, args.realtime,
+                args.verbose) for path in args.inputs])))
+    else:
+        results = [replayOne(args.config, path, args.output, args.realtime,
+            args.verbose) for path in args.inputs]
+    elapsed = time.time() - began
+
+    total = 0
+    for path, events, seconds in results:
+        total += events
+        print("{}: {} events in {:.1f} s, {:.0f} events/s".format(path,
+            events, seconds, events / seconds if seconds > 0 else 0))
+    formatted("{} events in {:.1f} s, {:.0f} events/s overall".format(total,
+        elapsed, total / elapsed if elapsed > 0 else 0), FORMAT_OK)
@@ -0,0 +1,143 @@
+# Predict how long a config takes: runs the real UFSDPyDAQ.acquire loop on the
+# simulated digitizer, stage and power supply (modules/sim) in virtual time,
+# then reports the time spent in motion, HV ramps, acquisition and I/O.
+#
+# python simulate.py config.ini [--rate HZ] [--event-cost S]
+#                    [--set SECTION.KEY=VALUE ...]
+#                    [--compare ACQUISITION.SCAN_ORDER=SERPENTINE ...]
+#
+# Each --compare argument is one more run with the given (comma separated)
+# overrides, so different scan strategies can be weighed against each other.
+
+import argparse, contextlib, os, sys
+
+os.environ["UFSDPYDAQ_SIMULATE"] = "1"
+import main
+from modules.sim import clock, scan
+from modules.sim.tree import NullTreeFile
+
+# Trigger rate used when none is given, Hz
+TRIGGER_RATE = 1000
+# Host time to decode and fill one event, measure it with bench/readout.py
+EVENT_COST = 1E-3 # s
+
+SECTIONS = {"ACQUISITION": "acq", "DIGITIZER": "dgt", "HIGHVOLTAGE": "hv",
+    "STAGE": "stage"}
+
+# UFSDPyDAQ with its time accounted for and the operator taken out
+class SimulatedDAQ(main.UFSDPyDAQ):
+
+    def __init__(self, config, breakdown, eventCost):
+        self.breakdown = breakdown
+        self.eventCost = eventCost
+        self.points = 0
+        self.events = 0
+        super().__init__(config)
+
+    def prompt(self, question):
+        return ""
+
+    def openFile(self):
+        file = NullTreeFile()
+        file.write = self.breakdown.wrap("I/O", file.write)
+        file.close = self.breakdown.wrap("I/O", file.close)
+        return file
+
+    def connectStage(self):
+        connected = super().connectStage()
+        self.stage.to2d = self.breakdown.wrap("motion", self.stage.to2d)
+        return connected
+
+    def connectHighVoltage(self):
+        connected = super().connectHighVoltage()
+        self.hv.disableChannel = self.breakdown.wrap("ramps",
+            self.hv.disableChannel)
+        return connected
+
+    def hvSetBlocking(self, channel, bias):
+        with self.breakdown.category("ramps"):
+            super().hvSetBlocking(channel, bias)
+
+    def acquirePoint(self, x, y):
+        self.points += 1
+        return super().acquirePoint(x, y)
+
+    def poll(self, taken, target):
+        with self.breakdown.category("acquisition"):
+            events = super().poll(taken, target)
+        with self.breakdown.category("processing"):
+            clock.sleep(events * self.eventCost)
+        self.events += events
+        return events
+
+# Apply "SECTION.KEY=VALUE" to _config_
+def override(config, setting):
+    key, sep, param = setting.partition("=")
+    section, sep, key = key.partition(".")
+    if section not in SECTIONS or not key:
+        print("Bad override '{}', use SECTION.KEY=VALUE".format(setting))
+        exit(1)
+    getattr(config, SECTIONS[section])[key] = \
+        main.io.config.parseValue(key, param)
+
+# Run the whole config once, returns the breakdown and the DAQ object
+def simulate(path, overrides, rate, eventCost, verbose = False):
+    clock.use(clock.VirtualClock())
+    main.digitizer.load()
+    main.digitizer.API.rate = rate
+
+    output = sys.stdout if verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(output):
+        config = main.io.config.Config(path)
+        # Everything is simulated, nobody needs to turn knobs by hand
+        config.hv["MANUAL"] = False
+        config.hv["RESOURCE"] = 0
+        config.stage["MANUAL"] = False
+        for setting in overrides:
+            override(config, setting)
+
+        breakdown = scan.Breakdown()
+        daq = SimulatedDAQ(config, breakdown, eventCost)
+        if daq.prepare():
+            daq.acquire()
+        daq.cleanup()
+    return breakdown, daq
+
+def report(name, breakdown, daq):
+    total, totals = breakdown.report()
+    print("\n{}: {} for {} points, {} events".format(name,
+        scan.formatDuration(total), daq.points, daq.events))
+    for category, seconds in totals.items():
+        print("  {:<12}{:>14}{:>8.1f} %".format(category,
+            scan.formatDuration(seconds),
+            100 * seconds / total if total > 0 else 0))
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Scan time simulator")
+    parser.add_argument("config", nargs = "?", default = main.CONFIG_PATH)
+    parser.add_argument("--rate", type = float, default = TRIGGER_RATE,
+        help = "Trigger rate in Hz")
+    parser.add_argument("--event-cost", type = float, default = EVENT_COST,
+        help = "Host time per event in seconds")
+    parser.add_argument("--set", nargs = "+", default = [],
+        metavar = "SECTION.KEY=VALUE")
+    parser.add_argument("--compare", nargs = "+", default = [],
+        metavar = "SECTION.KEY=VALUE[,...]")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args()
+
+    variants = [("config", [])]
+    for variant in args.compare:
+        variants.append((variant, variant.split(",")))
+
+    results = []
+    for name, overrides in variants:
+        breakdown, daq = simulate(args.config, args.set + overrides,
+            args.rate, args.event_cost, args.verbose)
+        results.append((name, report(name, breakdown, daq)))
+
+    if len(results) > 1:
+        best = min(results, key = lambda r: r[1])
+        print("\nFastest: {} ({})".format(best[0],
+            scan.formatDuration(best[1])))
@@ -0,0 +1,8 @@
+# Tests run on the simulated instruments (see modules/sim), from the root of
+# the repository: python -m pytest tests
+
+import os, sys
+
+os.environ["UFSDPYDAQ_SIMULATE"] = "1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
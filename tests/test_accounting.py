@@ -0,0 +1,34 @@
+# Unwrapper and Accounting: counters and time tags made monotonic, lost
+# triggers counted from counter gaps
+
+from modules import accounting
+
+def testUnwrapperPassesThrough():
+    unwrapper = accounting.Unwrapper(4)
+    assert [unwrapper.unwrap(v) for v in (0, 3, 7, 15)] == [0, 3, 7, 15]
+
+def testUnwrapperWraps():
+    unwrapper = accounting.Unwrapper(4)
+    assert [unwrapper.unwrap(v) for v in (14, 15, 0, 1, 15, 2)] == \
+        [14, 15, 16, 17, 31, 34]
+
+def testUnwrapperMasksHighBits():
+    unwrapper = accounting.Unwrapper(4)
+    assert unwrapper.unwrap(0x1F) == 15
+
+def testUnwrapperRepeatedValue():
+    unwrapper = accounting.Unwrapper(4)
+    assert [unwrapper.unwrap(v) for v in (5, 5, 6)] == [5, 5, 6]
+
+def testLostTriggersAcrossWrap():
+    counts = accounting.Accounting()
+    top = (1 << accounting.COUNTER_BITS) - 1
+    # Triggers top - 1, top, 0 and 3 (1 and 2 lost), time tags wrap too
+    ttt = (1 << accounting.TTT_BITS) - 100
+    for counter, tag in ((top - 1, ttt), (top, ttt + 50), (0, 20), (3, 90)):
+        counts.add(counter, tag)
+    summary = counts.summary()
+    assert summary["events"] == 4
+    assert summary["triggers"] == 6
+    assert summary["lost"] == 2
+    assert counts.lastTag > counts.firstTag
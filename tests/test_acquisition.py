@@ -0,0 +1,169 @@
+# Whole runs on the simulated instruments, with the example config
+
+import configparser, os
+
+import numpy as np
+
+import main, replay
+from modules import calibration, daemon, digitizer, pedestal
+from modules.sim import caen
+from modules.sim.tree import NullTreeFile
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), "Old_ini_files", "config_RSD.ini")
+
+# Remembers the channels and triggers written
+class RecordingTreeFile(NullTreeFile):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.channels = set()
+        self.triggers = set()
+
+    def setChannel(self, index, data, length):
+        super().setChannel(index, data, length)
+        self.channels.add(index)
+
+    def setTrigger(self, index, data, length):
+        super().setTrigger(index, data, length)
+        self.triggers.add(index)
+
+class RecordingDAQ(main.UFSDPyDAQ):
+
+    def openFile(self):
+        return RecordingTreeFile()
+
+def settings(tmp_path, **digitizer):
+    config = main.io.config.Config(CONFIG)
+    config.acq.update(MODE = main.io.config.MODE_PARAM["SINGLE"],
+        MAX_EVENTS = 100, DATA_PATH = str(tmp_path), FILENAME = "run",
+        HANDOFF = False)
+    config.dgt.update(DEVICE_ID = 0, **digitizer)
+    return config
+
+def run(config):
+    daq = RecordingDAQ(config, interactive = False)
+    daq.prepare()
+    daq.acquire()
+    daq.finish()
+    return daq
+
+def testOnlyUsedChannelsAreWritten(tmp_path):
+    daq = run(settings(tmp_path, CHANNELS = [0, 1, 2, 3],
+        GROUP_ENABLE_MASK = 3))
+    assert daq.file.channels == {0, 1, 2, 3}
+    assert daq.file.triggers == {0}
+    assert [s["events"] for s in daq.summaries] == [100]
+
+def testSecondGroupOnly(tmp_path):
+    daq = run(settings(tmp_path, GROUP_ENABLE_MASK = "0b10"))
+    assert daq.file.channels == set(range(8, 16))
+    assert daq.file.triggers == {1}
+
+# The daemon and batch runs reuse the DAQ, with the channels of each config
+def testReconfigureToFewerChannels(tmp_path):
+    daq = run(settings(tmp_path))
+    assert daq.file.channels == set(range(16))
+    daq.reconfigure(settings(tmp_path, CHANNELS = [0, 1]))
+    daq.prepare()
+    daq.acquire()
+    daq.finish()
+    assert daq.layout == [(0, [0, 1])]
+    assert daq.file.channels == {0, 1}
+    assert daq.file.triggers == {0}
+
+# A pedestal run of the board gives the cell offsets of the host correction
+def testPedestalCorrection(tmp_path):
+    config = settings(tmp_path, SOFTWARE_CORRECTION = True,
+        PEDESTAL_CORRECTION = True, CORRECTION_WORKER = False,
+        CALIBRATION_PATH = str(tmp_path / "calibration"))
+    daq = RecordingDAQ(config, interactive = False)
+    board = daq.corrector.tables
+    result = daq.takePedestals(256)
+    path = pedestal.cachePath(config.calibrationPath, result.serial,
+        config.frequency)
+    result.save(path)
+    daq.setupCorrector()
+    tables = daq.corrector.tables
+    assert np.allclose(tables.cell, pedestal.load(path).tables().cell)
+    assert np.array_equal(tables.nsample, board.nsample)
+    assert np.array_equal(tables.time, board.time)
+    daq.disconnect()
+
+# Estimators only hold the waves of the block being read out
+def testEstimatorKeepsNoWaves(tmp_path):
+    config = settings(tmp_path)
+    config.acq.update(MODE = main.io.config.MODE_PARAM["REFINE"])
+    daq = RecordingDAQ(config, interactive = False)
+    daq.prepare()
+    daq.beginPoint(0, 0)
+    daq.dgt.startAcquisition()
+    events = daq.poll(0, 100)
+    daq.dgt.stopAcquisition()
+    assert events == 100
+    assert daq.estimator.waves == []
+    assert daq.estimator.events == 100
+    daq.finish()
+
+# Every board reports its full memory, triggers arrive much faster than
+# they are read out
+def testMultiBoardFullMemory(tmp_path, monkeypatch):
+    monkeypatch.setattr(digitizer, "API", caen.SimulatedDigitizer(1E6))
+    config = settings(tmp_path, CHANNELS = [0, 1])
+    config.acq["MAX_EVENTS"] = 2000
+    config.dgt["DEVICE_ID"] = [0, 1]
+    daq = run(config)
+    daq.disconnect()
+    assert daq.file.channels == {0, 1, 16, 17}
+    assert daq.summaries[0]["events"] == 2000
+    assert daq.summaries[0]["full"] > 0
+
+# Replay never programs a digitizer, blocks are written all the same
+def testReplayWritesBlocks(tmp_path):
+    daq = replay.ReplayDAQ(settings(tmp_path, CHANNELS = [8, 9]))
+    daq.file = RecordingTreeFile()
+    block = calibration.Block(3, 16)
+    block.present[:] = True
+    daq.writeBlock(block)
+    assert daq.file.entries == 3
+    assert daq.file.channels == {8, 9}
+    assert daq.file.triggers == {1}
+
+# Every bin of a line scan is a point, maps included
+def testLineScanPoints(tmp_path):
+    config = settings(tmp_path)
+    config.acq.update(MODE = main.io.config.MODE_PARAM["LINE"],
+        MAX_EVENTS = 20000, X_START = 0, X_END = 100, X_STEP = 20,
+        Y_START = 0, Y_END = 0, MAPS = True)
+    config.stage.update(MANUAL = False, SPEED = 20)
+    daq = run(config)
+    assert len(daq.summaries) > 1
+    assert [s["x"] for s in daq.summaries] == \
+        sorted(s["x"] for s in daq.summaries)
+    maps = np.load(str(tmp_path / "run_maps.npz"))
+    assert list(maps["x"]) == [s["x"] for s in daq.summaries]
+    assert list(maps["count"][:, 0]) == [s["events"] for s in daq.summaries]
+
+# Line scan bins are points like any other for the daemon
+def testDaemonLineScan(tmp_path):
+    parser = configparser.ConfigParser()
+    parser.optionxform = lambda option: option
+    parser.read(CONFIG)
+    parser["ACQUISITION"].update(MODE = "LINE", MAX_EVENTS = "20000",
+        X_START = "0", X_END = "100", X_STEP = "20", Y_START = "0",
+        Y_END = "0", DATA_PATH = str(tmp_path), FILENAME = "run",
+        HANDOFF = "NO")
+    parser["DIGITIZER"]["DEVICE_ID"] = "0"
+    parser["STAGE"].update(MANUAL = "NO", SPEED = "20")
+    path = str(tmp_path / "line.ini")
+    with open(path, "w") as file:
+        parser.write(file)
+
+    server = daemon.Server(RecordingDAQ)
+    result = server.run(path)
+    assert result["ok"], result.get("error")
+    assert result["points"] > 1
+    assert result["events"] == sum(s["events"] for s in server.daq.summaries)
+    assert result["lost"] == 0
+    assert server.daq is not None
+    server.close()
@@ -0,0 +1,47 @@
+# Groups and channels read out, from GROUP_ENABLE_MASK and CHANNELS
+
+import pytest
+
+from modules.io import config
+
+def load(tmp_path, digitizer = ""):
+    path = tmp_path / "config.ini"
+    path.write_text("[ACQUISITION]\nX_LIST = [0]\nY_LIST = [0]\n\n"
+        "[DIGITIZER]\nDEVICE_ID = 2\n" + digitizer + "\n"
+        "[HIGHVOLTAGE]\nMANUAL = YES\n\n[STAGE]\nMANUAL = YES\n")
+    return config.Config(str(path))
+
+@pytest.mark.parametrize("digitizer, mask, channels", [
+    ("", 0b11, list(range(16))),
+    ("GROUP_ENABLE_MASK = 0b01\n", 0b01, list(range(8))),
+    ("GROUP_ENABLE_MASK = 2\n", 0b10, list(range(8, 16))),
+    ("CHANNELS = [0, 1, 2, 3]\n", 0b01, [0, 1, 2, 3]),
+    ("CHANNELS = [3, 12]\n", 0b11, [3, 12]),
+    ("CHANNELS = 9\n", 0b10, [9]),
+    ("CHANNELS = [0, 1]\nGROUP_ENABLE_MASK = 0b01\n", 0b01, [0, 1]),
+    # Groups with nothing to write are not read out
+    ("CHANNELS = [0, 1, 2, 3]\nGROUP_ENABLE_MASK = 3\n", 0b01, [0, 1, 2, 3]),
+])
+def testGroupsAndChannels(tmp_path, digitizer, mask, channels):
+    settings = load(tmp_path, digitizer)
+    assert settings.groupMask == mask
+    assert settings.channels == channels
+    assert settings.groups == [g for g in (0, 1) if mask & (1 << g)]
+
+def testLayout(tmp_path):
+    settings = load(tmp_path, "CHANNELS = [10, 0, 1, 9]\n")
+    assert settings.layout == [(0, [0, 1]), (1, [1, 2])]
+
+def testUsedChannelsOfEveryBoard(tmp_path):
+    settings = load(tmp_path, "CHANNELS = [0, 8]\n")
+    settings.dgt["DEVICE_ID"] = [2, 3]
+    assert settings.usedChannels == [0, 8, 16, 24]
+
+@pytest.mark.parametrize("digitizer", [
+    "CHANNELS = [8]\nGROUP_ENABLE_MASK = 0b01\n",
+    "CHANNELS = [0, 20]\n",
+    "GROUP_ENABLE_MASK = 0\n",
+])
+def testInvalidChannels(tmp_path, digitizer):
+    with pytest.raises(SystemExit):
+        load(tmp_path, digitizer)
@@ -0,0 +1,75 @@
+# Handoff queue: entries appended by the DAQ, read back by the watcher
+
+import json, os, types
+
+from modules import handoff
+
+def settings():
+    return types.SimpleNamespace(acq = {"MAX_EVENTS": 100},
+        dgt = {"DEVICE_ID": 2}, hv = {"MANUAL": True}, stage = {"MANUAL": True})
+
+def testRoundTrip(tmp_path):
+    path = str(tmp_path / "log" / "queue.log")
+    entries = [{"path": "/data/run_{}.root".format(i), "events": i}
+        for i in range(3)]
+    for entry in entries:
+        handoff.append(entry, path)
+    read = list(handoff.read(path))
+    assert [entry for entry, offset in read] == entries
+    assert read[-1][1] == os.path.getsize(path)
+    assert list(handoff.read(path, read[-1][1])) == []
+
+def testReadFromOffset(tmp_path):
+    path = str(tmp_path / "queue.log")
+    handoff.append({"n": 0}, path)
+    offset = os.path.getsize(path)
+    handoff.append({"n": 1}, path)
+    assert [entry for entry, o in handoff.read(path, offset)] == [{"n": 1}]
+
+def testMissingQueue(tmp_path):
+    assert list(handoff.read(str(tmp_path / "nothing.log"))) == []
+
+def testHalfWrittenLine(tmp_path):
+    path = str(tmp_path / "queue.log")
+    handoff.append({"n": 0}, path)
+    with open(path, "a") as file:
+        file.write(json.dumps({"n": 1}))
+    assert [entry for entry, offset in handoff.read(path)] == [{"n": 0}]
+    with open(path, "a") as file:
+        file.write("\n")
+    assert [entry for entry, offset in handoff.read(path)] == \
+        [{"n": 0}, {"n": 1}]
+
+def testRecord(tmp_path):
+    path = tmp_path / "run.root"
+    path.write_bytes(b"0123456789")
+    entry = handoff.record(str(path), settings(), 2, 200, False)
+    assert entry["size"] == 10
+    assert entry["checksum"] == handoff.checksum(str(path))
+    assert entry["config"] == handoff.configHash(settings())
+    assert (entry["points"], entry["events"], entry["final"]) == (2, 200, False)
+
+def testWatcherRunsOnce(tmp_path):
+    data = tmp_path / "run.root"
+    data.write_bytes(b"data")
+    queue = str(tmp_path / "queue.log")
+    handoff.append(handoff.record(str(data), settings(), 1, 10), queue)
+    output = tmp_path / "out.txt"
+    command = "echo {name} > " + str(output)
+    assert handoff.Watcher([command], 1, queue).run(once = True) == [0]
+    assert output.read_text().strip() == "run"
+    # Done files are never run again
+    assert handoff.Watcher([command], 1, queue).run(once = True) == []
+
+def testWatcherRecordsFailures(tmp_path):
+    data = tmp_path / "run.root"
+    data.write_bytes(b"data")
+    queue = str(tmp_path / "queue.log")
+    handoff.append(handoff.record(str(data), settings(), 1, 10), queue)
+    watcher = handoff.Watcher(["echo {nothing}"], 1, queue)
+    assert watcher.run(once = True) == [handoff.ERROR_STATUS]
+    assert not watcher.pending
+    done = [entry for entry, offset in handoff.read(queue +
+        handoff.DONE_SUFFIX)]
+    assert done[0]["status"] == handoff.ERROR_STATUS
+    assert "nothing" in done[0]["error"]
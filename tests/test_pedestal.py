@@ -0,0 +1,53 @@
+# Pedestal: cell-wise mean and RMS accumulated block by block, saved and
+# turned into correction tables
+
+import numpy as np
+
+from modules import calibration, pedestal
+
+# _events_ raw events whose samples are _offsets_ (groups, channels, cells)
+# read from random start cells, plus unit noise
+def block(events, offsets, generator, length = 256):
+    result = calibration.Block(events, length)
+    result.present[:] = True
+    result.cells[:] = generator.integers(0, calibration.CELLS,
+        result.cells.shape)
+    cells = (result.cells[..., None] + np.arange(length)) % calibration.CELLS
+    for g in range(calibration.GROUPS):
+        result.waves[:, g] = np.moveaxis(offsets[g][:, cells[:, g]], 0, 1) + \
+            generator.normal(0, 1, result.waves[:, g].shape)
+    return result
+
+def testCellOffsets():
+    generator = np.random.default_rng(1)
+    offsets = 100 + generator.normal(0, 10, (calibration.GROUPS,
+        calibration.CHANNELS_PER_GROUP, calibration.CELLS))
+    result = pedestal.Pedestal(0, 1234)
+    for i in range(10):
+        result.add(block(100, offsets, generator))
+    assert result.events == 1000
+    assert np.allclose(result.mean, offsets, atol = 0.5)
+    assert np.allclose(result.rms.mean(), 1, atol = 0.05)
+
+    base = calibration.ideal(0, 1234)
+    base.nsample[:] = 3
+    tables = result.tables(base)
+    mean, rms = result.channels()
+    assert np.allclose(tables.cell, result.mean - mean[..., None], atol = 1E-3)
+    assert np.array_equal(tables.nsample, base.nsample)
+    assert np.array_equal(tables.time, base.time)
+
+def testSaveAndLoad(tmp_path):
+    generator = np.random.default_rng(2)
+    offsets = generator.normal(0, 10, (calibration.GROUPS,
+        calibration.CHANNELS_PER_GROUP, calibration.CELLS))
+    result = pedestal.Pedestal(1, 99)
+    result.add(block(50, offsets, generator))
+    path = str(tmp_path / "pedestal.npz")
+    result.save(path)
+
+    loaded = pedestal.load(path)
+    assert (loaded.frequency, loaded.serial, loaded.events) == (1, 99, 50)
+    assert np.array_equal(loaded.count, result.count)
+    assert np.allclose(loaded.mean, result.mean, atol = 1E-3)
+    assert np.allclose(loaded.rms, result.rms, atol = 1E-3)
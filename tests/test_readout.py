@@ -0,0 +1,107 @@
+# EventMerger: events of several boards matched by counter and time tag
+
+import random
+
+import pytest
+
+from modules import digitizer, readout
+
+# Irregular trigger intervals, so that alignment has something to go by
+def timeTags(count, seed = 1):
+    generator = random.Random(seed)
+    tags, tag = [], 0
+    for i in range(count):
+        tag += generator.randint(1000, 50000)
+        tags.append(tag & readout.TTT_MASK)
+    return tags
+
+def events(counters, tags):
+    return [(counter, tag, {}, {}) for counter, tag in zip(counters, tags)]
+
+def testIdenticalBoards():
+    tags = timeTags(20)
+    merger = readout.EventMerger(2)
+    merger.add(0, events(range(20), tags))
+    merger.add(1, events(range(20), tags))
+    merged = list(merger.pop(100))
+    assert len(merged) == 20
+    assert all(a[0] == b[0] and a[1] == b[1] for a, b in merged)
+    assert merger.orphans == 0
+    assert merger.mismatches == 0
+
+def testLimit():
+    tags = timeTags(20)
+    merger = readout.EventMerger(2)
+    merger.add(0, events(range(20), tags))
+    merger.add(1, events(range(20), tags))
+    assert len(list(merger.pop(5))) == 5
+    assert len(list(merger.pop(100))) == 15
+
+def testNothingBeforeAlignment():
+    tags = timeTags(readout.ALIGN_EVENTS - 1)
+    merger = readout.EventMerger(2)
+    merger.add(0, events(range(len(tags)), tags))
+    merger.add(1, events(range(len(tags)), tags))
+    assert list(merger.pop(100)) == []
+
+def testLostTriggerIsDropped():
+    tags = timeTags(20)
+    merger = readout.EventMerger(2)
+    merger.add(0, events(range(20), tags))
+    # Board 1 never handed over trigger 12
+    kept = [i for i in range(20) if i != 12]
+    merger.add(1, events(kept, [tags[i] for i in kept]))
+    merged = list(merger.pop(100))
+    assert [event[0][0] for event in merged] == kept
+    assert merger.orphans == 1
+
+def testStaggeredStart():
+    tags = timeTags(20)
+    merger = readout.EventMerger(2)
+    merger.add(0, events(range(20), tags))
+    # Board 1 started two triggers late, its counters start from zero there
+    merger.add(1, events(range(18), tags[2:]))
+    merged = list(merger.pop(100))
+    assert len(merged) == 18
+    assert all(a[1] == b[1] for a, b in merged)
+
+def testTimeTagMismatch():
+    tags = timeTags(20)
+    other = list(tags)
+    # Counters agree but board 1 saw trigger 15 much later
+    other[15] += 10000
+    merger = readout.EventMerger(2)
+    merger.add(0, events(range(20), tags))
+    merger.add(1, events(range(20), other))
+    assert len(list(merger.pop(100))) == 20
+    assert merger.mismatches > 0
+
+# A call that raises in a readout process raises in the caller, and the
+# processes keep answering
+def testBoardErrors():
+    boards = readout.Boards([0, 1])
+    try:
+        assert boards.connected
+        with pytest.raises(RuntimeError, match = "board 1 setRecordLength"):
+            boards.setRecordLength()
+        assert boards.status() == 0x180
+    finally:
+        boards.close()
+
+# Readout processes only copy the channels written to file
+def testReadBlockLayout():
+    dgt = digitizer.Digitizer(0)
+    try:
+        dgt.setGroupEnableMask(0b11)
+        dgt.setFastTriggerMode(1)
+        dgt.allocateEvent()
+        dgt.mallocBuffer()
+        dgt.startAcquisition()
+        events = readout.readBlock(dgt, [(1, [0, 2])])
+        dgt.stopAcquisition()
+    finally:
+        dgt.close()
+    assert events
+    for counter, ttt, channels, triggers in events:
+        assert sorted(channels) == [8, 10]
+        assert sorted(triggers) == [1]
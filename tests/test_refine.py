@@ -0,0 +1,53 @@
+# QuadTree: cells are only split where the observable really changes
+
+import random
+
+from modules import refine
+
+# Acquire every point QuadTree asks for from _value_(i, j), with standard
+# error _error_, until it's done. Returns the points acquired.
+def scan(tree, value, error):
+    todo = tree.initial()
+    acquired = 0
+    while todo:
+        for point in todo:
+            tree.add(point, value(*point), error)
+            acquired += 1
+        todo = tree.refine()
+    return acquired
+
+def testCoarseGrid():
+    tree = refine.QuadTree(16, 16, 8, 0.1)
+    points = tree.initial()
+    assert sorted(points) == [(i, j) for i in (0, 8, 16) for j in (0, 8, 16)]
+
+def testFlatNoisyMapIsNotRefined():
+    generator = random.Random(1)
+    tree = refine.QuadTree(16, 16, 8, 0.1)
+    acquired = scan(tree, lambda i, j: 100 + generator.gauss(0, 1), 1)
+    assert acquired == 9
+
+def testEdgeIsRefined():
+    generator = random.Random(1)
+    tree = refine.QuadTree(16, 16, 8, 0.1)
+    acquired = scan(tree, lambda i, j: 100 + (50 if i >= 5 else 0) +
+        generator.gauss(0, 1), 1)
+    assert acquired > 9
+    # Only the column of cells across the edge goes down to the finest step
+    assert (4, 0) in tree.values and (5, 0) in tree.values
+    assert (12, 0) not in tree.values
+
+def testChangeWithinErrorsIsNotRefined():
+    tree = refine.QuadTree(16, 16, 8, 0.1)
+    acquired = scan(tree, lambda i, j: 100 + (5 if i >= 5 else 0), 2)
+    assert acquired == 9
+
+def testMinimumChange():
+    value = lambda i, j: 100 + (5 if i >= 5 else 0)
+    assert scan(refine.QuadTree(16, 16, 8, 0.1), value, 0) > 9
+    assert scan(refine.QuadTree(16, 16, 8, 0.1, minChange = 10), value,
+        0) == 9
+
+def testUnknownValues():
+    tree = refine.QuadTree(16, 16, 8, 0.1)
+    assert scan(tree, lambda i, j: float("nan"), 0) == 9
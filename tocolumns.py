@@ -0,0 +1,156 @@
+# Convert the wfm tree of ROOT files written by main.py into NumPy arrays
+# that can be memory mapped, so that the analysis never goes through PyROOT
+# event by event again.
+#
+# python tocolumns.py FILE [FILE ...] [--jobs N] [--entries N]
+#                     [--output DIR]
+#
+# Every FILE becomes a FILE_columns directory with
+#   waves.npy     float32 (entries, channels, samples)
+#   triggers.npy  float32 (entries, groups, samples)
+#   events.npz    per entry: bias, x, y, evt, ttt, cell, present
+#   points.npz    per point: bias, x, y and first and last + 1 entry, and
+#                 the points tree as written by main.py when there is one
+#
+# The tree is cut in ranges of --entries entries, converted by a pool of
+# --jobs processes straight into the final arrays, so there's nothing left
+# to merge but the per entry metadata.
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse, os, time
+
+import numpy as np
+
+from modules import replay
+from modules.io import tree
+from main import formatted, FORMAT_OK
+
+# Entries converted by one job
+ENTRIES = 20000
+
+def outputDirectory(path, output = None):
+    name = os.path.splitext(os.path.basename(path))[0]
+    directory = output if output is not None else os.path.dirname(path)
+    return os.path.join(directory, "{}_columns".format(name))
+
+# Entries _start_ to _stop_ of the tree in _path_, written into the arrays
+# already created in _directory_. Returns the per entry metadata.
+def convertRange(path, directory, start, stop):
+    source = replay.TreeSource(path)
+    waves = np.load(os.path.join(directory, "waves.npy"), mmap_mode = "r+")
+    triggers = np.load(os.path.join(directory, "triggers.npy"),
+        mmap_mode = "r+")
+    groups = triggers.shape[1]
+    meta = {"bias": [], "position": [], "evt": [], "ttt": [], "cell": [],
+        "present": []}
+    for first in range(start, stop, source.chunk):
+        last = min(first + source.chunk, stop)
+        block, biases, positions = source.read(first, last)
+        count = len(block)
+        waves[first:last] = block.waves[:, :groups, :8].reshape(count,
+            groups * 8, -1)
+        triggers[first:last] = block.waves[:, :groups, 8]
+        meta["bias"].append(biases)
+        meta["position"].append(positions)
+        meta["evt"].append(np.asarray(block.counters, np.uint64))
+        meta["ttt"].append(np.asarray(block.timeTags, np.uint64))
+        meta["cell"].append(block.cells[:, :groups])
+        meta["present"].append(block.present[:, :groups])
+    waves.flush()
+    triggers.flush()
+    source.close()
+    return {key: np.concatenate(values) for key, values in meta.items()}
+
+# Fields of the points tree of _path_, empty if it has none
+def readPoints(path):
+    tree.load()
+    file = tree.rt.TFile.Open(path)
+    points = file.Get("points")
+    fields = {}
+    if points:
+        values = {field: [] for field in tree.POINT_FIELDS}
+        for i in range(int(points.GetEntries())):
+            points.GetEntry(i)
+            for field in tree.POINT_FIELDS:
+                values[field].append(getattr(points, field))
+        fields = {"tree_" + field: np.array(value, float)
+            for field, value in values.items()}
+    file.Close()
+    return fields
+
+# Convert the file at _path_ with _jobs_ processes, in ranges of _entries_
+# entries. Returns the output directory, the entries and the time taken.
+def convert(path, output = None, jobs = 1, entries = ENTRIES):
+    began = time.time()
+    directory = outputDirectory(path, output)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    source = replay.TreeSource(path)
+    total = len(source)
+    # Only the groups read in the first entry are kept, a 32 channel tree
+    # with a single board has two empty ones
+    if total:
+        block = source.read(0, 1)[0]
+        used = np.nonzero(block.present[0])[0]
+        groups = int(used[-1]) + 1 if len(used) else source.groups
+    else:
+        groups = source.groups
+    length, frequency = source.length, source.frequency
+    source.close()
+
+    np.lib.format.open_memmap(os.path.join(directory, "waves.npy"), "w+",
+        np.float32, (total, groups * 8, length))
+    np.lib.format.open_memmap(os.path.join(directory, "triggers.npy"), "w+",
+        np.float32, (total, groups, length))
+
+    ranges = [(start, min(start + entries, total))
+        for start in range(0, total, entries)]
+    if jobs > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(min(jobs, len(ranges))) as pool:
+            parts = list(pool.map(convertRange, [path] * len(ranges),
+                [directory] * len(ranges), *zip(*ranges)))
+    else:
+        parts = [convertRange(path, directory, start, stop)
+            for start, stop in ranges]
+
+    if parts:
+        meta = {key: np.concatenate([part[key] for part in parts])
+            for key in parts[0]}
+    else:
+        meta = {"bias": np.zeros(0), "position": np.zeros((0, 2)),
+            "evt": np.zeros(0, np.uint64), "ttt": np.zeros(0, np.uint64),
+            "cell": np.zeros((0, groups), np.int64),
+            "present": np.zeros((0, groups), bool)}
+    np.savez(os.path.join(directory, "events.npz"), bias = meta["bias"],
+        x = meta["position"][:, 0], y = meta["position"][:, 1],
+        evt = meta["evt"], ttt = meta["ttt"], cell = meta["cell"],
+        present = meta["present"], frequency = frequency, length = length)
+
+    points = replay.bounds(meta["bias"], meta["position"], meta["ttt"])
+    starts = np.array([start for start, stop in points], np.int64)
+    np.savez(os.path.join(directory, "points.npz"),
+        bias = meta["bias"][starts], x = meta["position"][starts, 0],
+        y = meta["position"][starts, 1], start = starts,
+        stop = np.array([stop for start, stop in points], np.int64),
+        **readPoints(path))
+    return directory, total, time.time() - began
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Convert wfm trees to NumPy arrays")
+    parser.add_argument("files", nargs = "+", help = "ROOT files")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(),
+        help = "Processes converting entry ranges in parallel")
+    parser.add_argument("--entries", type = int, default = ENTRIES,
+        help = "Entries converted by one job")
+    parser.add_argument("--output", help = "Output directory, next to the "
+        "files if not given")
+    args = parser.parse_args()
+
+    for path in args.files:
+        directory, entries, seconds = convert(path, args.output, args.jobs,
+            args.entries)
+        formatted("{}: {} entries in {:.1f} s, {:.0f} entries/s".format(
+            directory, entries, seconds, entries / seconds if seconds > 0
+            else 0), FORMAT_OK)
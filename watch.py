@@ -0,0 +1,34 @@
+# Follow the handoff queue the DAQ appends finished files to and run the
+# analysis on each as soon as it's there, overlapping with the next runs.
+#
+# python watch.py --command "python tocolumns.py {path}" [--command ...]
+#                 [--jobs N] [--queue PATH] [--once]
+#
+# Commands run in the given order for every file, formatted with its entry:
+# {path}, {name}, {directory}, {size}, {checksum}, {config}, {points},
+# {events}. Up to --jobs files are processed at once. Files already done
+# are listed next to the queue and never run again, so the watcher can be
+# stopped and started at will.
+
+import argparse
+
+from modules import handoff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description = "Run the analysis on every file handed off by the DAQ")
+    parser.add_argument("--command", action = "append", required = True,
+        help = "Command to run on every file, can be repeated")
+    parser.add_argument("--jobs", type = int, default = 1,
+        help = "Files processed at once")
+    parser.add_argument("--queue", default = handoff.QUEUE_PATH)
+    parser.add_argument("--once", action = "store_true",
+        help = "Process what's queued and exit")
+    args = parser.parse_args()
+
+    watcher = handoff.Watcher(args.command, args.jobs, args.queue)
+    print("Watching {}...".format(args.queue))
+    try:
+        watcher.run(args.once)
+    except KeyboardInterrupt:
+        print("Stopped")